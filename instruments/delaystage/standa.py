@@ -39,22 +39,39 @@ from instruments.delaystage.generic import DelayStage, StageError
 
 ximc_dir = 'C:/code/standa_stage/ximc-2.10.5/ximc/'
 ximc_package_dir = os.path.join(ximc_dir, "crossplatform", "wrappers", "python")
-sys.path.append(ximc_package_dir)
-if platform.system() == "Windows":
-    arch_dir = "win64" if "64" in platform.architecture()[0] else "win32"
-    libdir = os.path.join(ximc_dir, arch_dir)
-    os.environ["Path"] = libdir + ";" + os.environ["Path"]  # add dll
 
-try:
-    import pyximc
+pyximc = None  # the ximc wrapper and library, loaded by load_ximc on first use
+lib = None
 
-    lib = pyximc.lib
-except ImportError as err:
-    print(
-        "Can't import pyximc module. The most probable reason is that you changed the relative location of the testpython.py and pyximc.py files. See developers' documentation for details.")
-except OSError as err:
-    print(
-        "Can't load libximc library. Please add all shared libraries to the appropriate places. It is decribed in detail in developers' documentation. On Linux make sure you installed libximc-dev package.\nmake sure that the architecture of the system and the interpreter is the same")
+
+def load_ximc():
+    """ Import the ximc wrapper and load its library, if not done yet.
+
+    Probing the library is slow, so it is done when a stage is first used
+    instead of when this module is imported.
+    """
+    global pyximc, lib
+    if lib is not None:
+        return lib
+    if ximc_package_dir not in sys.path:
+        sys.path.append(ximc_package_dir)
+    if platform.system() == "Windows":
+        arch_dir = "win64" if "64" in platform.architecture()[0] else "win32"
+        libdir = os.path.join(ximc_dir, arch_dir)
+        os.environ["Path"] = libdir + ";" + os.environ["Path"]  # add dll
+
+    try:
+        import pyximc as _pyximc
+
+        lib = _pyximc.lib
+        pyximc = _pyximc
+    except ImportError as err:
+        print(
+            "Can't import pyximc module. The most probable reason is that you changed the relative location of the testpython.py and pyximc.py files. See developers' documentation for details.")
+    except OSError as err:
+        print(
+            "Can't load libximc library. Please add all shared libraries to the appropriate places. It is decribed in detail in developers' documentation. On Linux make sure you installed libximc-dev package.\nmake sure that the architecture of the system and the interpreter is the same")
+    return lib
 
 
 class Standa_8SMC5(DelayStage):
@@ -91,6 +108,7 @@ class Standa_8SMC5(DelayStage):
         return pos, uPos
 
     def connect(self, device_number=None):
+        load_ximc()
         if device_number is not None:
             self.device_number = device_number
         if self._devenum is None:
@@ -280,6 +298,7 @@ class Standa_8SMC5(DelayStage):
     @staticmethod
     def get_device_list():
         """ Find all available devices and return the enumeration of them."""
+        load_ximc()
         probe_flags = pyximc.EnumerateFlags.ENUMERATE_PROBE  # + EnumerateFlags.ENUMERATE_NETWORK
         enum_hints = b"addr=192.168.0.1,172.16.2.3"
         devenum = lib.enumerate_devices(probe_flags, enum_hints)
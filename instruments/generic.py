@@ -48,7 +48,7 @@ class Instrument(object):
 
     def get_setting(self,setting, key='value'):
         """allowes to read values locally, without promting the device itself."""
-        assert isinstance(self,setting), '{} is not an available setting in {}'.format(setting,self.name)
+        assert setting in self._settings, '{} is not an available setting in {}'.format(setting,self.name)
         return self._settings[setting][key]
 
     def connect(self):
@@ -49,6 +49,10 @@ class LockInAmplifier(generic.Instrument):
         self._settings = {'time_constant': {'value': .1}}
         self._version = 'Fake lockin 0.1'
 
+        # data buffer: parameters which each display channel can store, in DDEF order
+        self.buffer_displays = {1: ['X', 'R', 'X noise', 'Aux1', 'Aux2'],
+                                2: ['Y', 'Theta', 'Y noise', 'Aux3', 'Aux4']}
+
     def connect(self):
         self._connected = True
         self.logger.info('Connected Fake LockInAmplifier amplifier.')
@@ -112,6 +116,39 @@ class LockInAmplifier(generic.Instrument):
         else:
             return values
 
+    def buffer_channels(self, parameters):
+        """ Display channel buffering each parameter.
+
+        Raises:
+            ValueError if a parameter cannot be buffered, or two need the same
+            display channel, as X and R.
+        Returns:
+            dict of parameter: display channel
+        """
+        channels = {}
+        for parameter in parameters:
+            channel = [c for c, names in self.buffer_displays.items() if parameter in names]
+            if len(channel) != 1:
+                raise ValueError('{} cannot be stored in the lock-in buffer'.format(parameter))
+            if channel[0] in channels.values():
+                raise ValueError('Cannot buffer {}: only one parameter per display channel can be buffered, '
+                                 'choose at most one of each of {}'.format(list(parameters),
+                                                                           list(self.buffer_displays.values())))
+            channels[parameter] = channel[0]
+        return channels
+
+    def measure_buffered(self, parameters=('X', 'Y'), n_samples=64, sample_rate=512., return_dict=True, average=True):
+        """ emulates the measure_buffered method from SR830"""
+        assert self.connected, 'lockin not connected.'
+        self.buffer_channels(parameters)
+        time.sleep(self.dwell_time + n_samples / sample_rate)
+        samples = np.random.randn(len(parameters), n_samples)
+        values = [float(v) for v in samples.mean(axis=1)] if average else list(samples)
+        if return_dict:
+            return dict(zip(parameters, values))
+        else:
+            return values
+
 
 class SR830(LockInAmplifier):
 
@@ -146,7 +183,7 @@ class SR830(LockInAmplifier):
             'input_config': {'value': 'A',
                              'allowed_values': ['A', 'A-B', 'I(1mOm)', 'I(100mOm)'],
                              'unit': '',
-                             'cmd': 'OFSL',
+                             'cmd': 'ISRC',
                              },
             'input_shield': {'value': 'Float',
                              'allowed_values': ['Float', 'Ground'],
@@ -158,7 +195,7 @@ class SR830(LockInAmplifier):
                                'unit': '',
                                'cmd': 'ICPL',
                                },
-            'input_line_notch_filter': {'value': 'AC',
+            'input_line_notch_filter': {'value': 'no filters',
                                         'allowed_values': ['no filters', 'Line notch',
                                                            '2xLine notch', 'Both notch'],
                                         'unit': '',
@@ -179,8 +216,8 @@ class SR830(LockInAmplifier):
                       'unit': '',
                       'cmd': 'PHAS',
                       },
-            'reference_source': {'value': 'Off',
-                                 'allowed_values': ['Internal', 'External'],
+            'reference_source': {'value': 'External',
+                                 'allowed_values': ['External', 'Internal'],
                                  'unit': '',
                                  'cmd': 'FMOD',
                                  },
@@ -199,9 +236,9 @@ class SR830(LockInAmplifier):
                                    'unit': '',
                                    'cmd': 'HARM',
                                    },
-            'sine_output_amplitude': {'value': 2,
-                                      'allowed_values': ['Zero crossing', 'Rising edge', 'Falling edge'],
-                                      'unit': '',
+            'sine_output_amplitude': {'value': 2.,
+                                      'allowed_values': None,
+                                      'unit': 'V',
                                       'cmd': 'SLVL',
                                       },
 
@@ -216,12 +253,19 @@ class SR830(LockInAmplifier):
 
         # settings
         self.should_sync = True  # to keep track if all settings are up to date with device state
+        self._unsynced = set()  # settings changed while disconnected, written at the next sync
         self.output_dict = {'X': 1, 'Y': 2, 'R': 3, 'Theta': 4, 'Aux1': 5, 'Aux2': 6, 'Aux3': 7,
                             'Aux4': 8, 'Reference Frequency': 9, 'CH1 display': 10, 'CH2 diplay': 11}
         self._channel_names = ['X', 'Y', 'R', 'Theta', 'Aux1', 'Aux2', 'Aux3',
                                'Aux4', 'Reference Frequency', 'CH1 display',
                                'CH2 diplay']
 
+        # data buffer, see also buffer_displays
+        self.buffer_sample_rates = [.0625 * 2 ** i for i in range(14)]  # SRAT 0 to 13, in Hz
+        self.buffer_size = 16383  # points per channel
+        self.buffer_transfer_rate = 1e4  # conservative estimate of TRCB bytes per second, sets read timeouts
+        self._buffer_channels = {}  # parameter: display channel, as set by start_buffer
+
     @property
     def connected(self):
         """ test if the lock-in amplifier is connected and read/write is allowed.
@@ -261,6 +305,7 @@ class SR830(LockInAmplifier):
             self.ser.write('++ver\r\n'.encode('utf-8'))  # query version of the prologix USB-GPIB adapter to test connection
             value = self.ser.readline()# reads version
             self._connected=True
+            self.should_sync = True  # the settings are synced on first access
             self.logger.info('Encoder version: {}'.format(value))
             # self.ser.close()
             self.write('++eoi 1')  # enable the eoi signal mode, which signals about and of the line
@@ -409,6 +454,131 @@ class SR830(LockInAmplifier):
         
 
 
+    # data buffer
+    def start_buffer(self, parameters=('X', 'Y'), sample_rate=512.):
+        """ Start filling the internal data buffer.
+
+        The buffer stores the CH1 and CH2 displays, which are set to show the
+        parameters. It is reset, and filled at sample_rate until full, or
+        until pause_buffer is called.
+
+        Args:
+            parameters: list of str
+                one or two parameters, at most one of each display channel, as
+                in buffer_displays, see buffer_channels.
+            sample_rate: float
+                sampling rate in Hz, one of buffer_sample_rates.
+        """
+        if not self._connected: raise DeviceNotConnectedError('COM port is closed. Device is not connected.')
+        assert sample_rate in self.buffer_sample_rates, 'sample rate must be one of {}'.format(
+            self.buffer_sample_rates)
+        channels = self.buffer_channels(parameters)
+        for parameter, channel in channels.items():
+            self.write('DDEF {},{},0'.format(channel, self.buffer_displays[channel].index(parameter)))
+        self._buffer_channels = channels
+        self.write('REST')
+        self.write('SRAT {}'.format(self.buffer_sample_rates.index(sample_rate)))
+        self.write('SEND 0')  # single shot: stop when the buffer is full
+        self.write('STRT')
+        self.logger.debug('Started buffering {} at {} Hz'.format(list(parameters), sample_rate))
+
+    def pause_buffer(self):
+        """ Stop filling the data buffer, keeping the stored points."""
+        self.write('PAUS')
+
+    def buffer_points(self):
+        """ Number of points stored in the data buffer."""
+        return int(self.read('SPTS?'))
+
+    def read_binary(self, command, n_bytes):
+        """ Send a query and read its answer as n_bytes of raw binary data.
+
+        Unlike read, the answer is not read up to a line end, as binary data
+        can contain line end characters.
+        """
+        if not self._connected: raise DeviceNotConnectedError('COM port is closed. Device is not connected.')
+        self.write(command)
+        self.ser.write(('++read eoi\r\n').encode('utf-8'))
+        timeout = self.ser.timeout
+        self.ser.timeout = max(timeout, 1 + n_bytes / self.buffer_transfer_rate)
+        try:
+            data = self.ser.read(n_bytes)
+        finally:
+            self.ser.timeout = timeout
+        if len(data) != n_bytes:
+            raise IOError('Expected {} bytes in answer to {}, received {}'.format(n_bytes, command, len(data)))
+        return data
+
+    def read_buffer(self, parameter, start=0, n_points=None):
+        """ Read points stored in the data buffer, with a single binary transfer.
+
+        Args:
+            parameter: str
+                parameter buffered by start_buffer.
+            start: int
+                index of the first point to read.
+            n_points: int
+                number of points to read. Defaults to all those stored.
+        Returns:
+            values: np.ndarray of float
+        """
+        assert parameter in self._buffer_channels, '{} is not being buffered'.format(parameter)
+        if n_points is None:
+            n_points = self.buffer_points() - start
+        if n_points <= 0:
+            return np.zeros(0)
+        data = self.read_binary('TRCB?{},{},{}'.format(self._buffer_channels[parameter], start, n_points),
+                                4 * n_points)
+        return np.frombuffer(data, dtype='<f4').astype(np.float64)  # IEEE little endian floats
+
+    def measure_buffered(self, parameters=('X', 'Y'), n_samples=64, sample_rate=512., return_dict=True, average=True):
+        """ Measure many samples of the parameters at once, with the data buffer.
+
+        Waits the dwell time, as measure, then fills the buffer with n_samples
+        points at sample_rate and reads them back with one binary transfer per
+        parameter, instead of one SNAP query per point.
+
+        Args:
+            parameters: list of str
+                parameters to measure, see start_buffer.
+            n_samples: int
+                number of points to acquire.
+            sample_rate: float
+                sampling rate in Hz, one of buffer_sample_rates.
+            return_dict: bool
+                if True returns a dictionary with parameters as keys, else a
+                list in the order of parameters.
+            average: bool
+                if True return the mean of the samples of each parameter,
+                else the arrays of samples.
+        Returns:
+            dict or list of the values, as measure.
+        """
+        if not self._connected: raise DeviceNotConnectedError('COM port is closed. Device is not connected.')
+        assert 0 < n_samples <= self.buffer_size, 'n_samples must be between 1 and {}'.format(self.buffer_size)
+        self.buffer_channels(parameters)  # fail before dwelling
+        dwell = self._settings['time_constant']['value'] * self._dwell_time_factor
+        self.logger.info('Lockin dwelling {}s'.format(dwell))
+        time.sleep(dwell)
+
+        self.start_buffer(parameters, sample_rate)
+        time.sleep(n_samples / sample_rate)
+        t_timeout = time.time() + 1 + n_samples / sample_rate
+        while self.buffer_points() < n_samples:
+            if time.time() > t_timeout:
+                raise IOError('Lock-in buffer not filled in time')
+            time.sleep(.05)
+        self.pause_buffer()
+
+        samples = [self.read_buffer(parameter, 0, n_samples) for parameter in parameters]
+        values = [float(s.mean()) for s in samples] if average else samples
+        self.logger.info('Buffered read of {} points: {} for {}'.format(n_samples, values if average else '',
+                                                                        list(parameters)))
+        if return_dict:
+            return dict(zip(parameters, values))
+        else:
+            return values
+
     def measure_avg(self, avg=10, sleep=None, var='R'):
         ''' [DEPRECATED] Perform one action of mesurements, average signal(canceling function in case of not real values should be implemeted), sleep time could be set manualy or automaticaly sets tim constant of lockin x 3'''
         self.logger.warning('[DEPRECATED] Using method "measure_avg" which is Deprecated')
@@ -426,562 +596,225 @@ class SR830(LockInAmplifier):
 
  
         
-    # settings property generators:
-    @property
-    def sensitivity(self):
-        """ return the value on lockin or if disconnected the locally set value"""
-        setting = 'sensitivity'
-        try:
-            command = self._settings[setting]['cmd'] + ' ?'
-            value_idx = int(self.read(command))
-            value = self._settings[setting]['allowed_values'][value_idx]
+    # settings mirror
+    def _encode(self, setting, value):
+        """ Command setting the device to value, validated against the allowed values."""
+        allowed = self._settings[setting]['allowed_values']
+        if allowed is None:
+            return '{} {}'.format(self._settings[setting]['cmd'], value)
+        assert value in allowed, '{} is not a valid value for {}. Allowed values: {}'.format(value, setting, allowed)
+        return '{} {}'.format(self._settings[setting]['cmd'], allowed.index(value))
+
+    def _decode(self, setting, answer):
+        """ Value of setting from the answer of the device to its query."""
+        if isinstance(answer, bytes):
+            answer = answer.decode('utf-8')
+        answer = answer.strip()
+        allowed = self._settings[setting]['allowed_values']
+        if allowed is None:
+            return type(self._settings[setting]['value'])(float(answer))
+        return allowed[int(answer)]
+
+    def query_batch(self, commands):
+        """ Send several queries in one message, and return the list of answers.
+
+        The SR830 answers queries sent together, separated by ';', with a
+        single message. If the answer cannot be split in one value per query,
+        the input buffer is cleared of what remains of it, and they are sent
+        again one at a time.
+        """
+        answer = self.read(';'.join(commands))
+        if answer is None:
+            raise DeviceNotConnectedError('No answer from the lock-in amplifier.')
+        answers = answer.decode('utf-8').strip().split(';')
+        if len(answers) != len(commands):
+            self.logger.warning('Batched query returned {} values for {} queries, querying one by one'.format(
+                len(answers), len(commands)))
+            self.ser.reset_input_buffer()  # else the rest of the answer shifts every later read
+            answers = [self.read(command) for command in commands]
+        return answers
+
+    def refresh(self):
+        """ Read all settings from the device, in one exchange, and update the local values."""
+        settings = list(self._settings)
+        answers = self.query_batch([self._settings[setting]['cmd'] + '?' for setting in settings])
+        for setting, answer in zip(settings, answers):
+            value = self._decode(setting, answer)
             old_value = self._settings[setting]['value']
             if old_value != value:
                 self._settings[setting]['value'] = value
                 self.logger.debug(
                     'Local value of {} changed to remote value: was {}, now is {}'.format(setting, old_value, value))
-        except DeviceNotConnectedError:
-            self.logger.warning('Device not connected: returning stored value')
-            value = self._settings[setting]['value']
-        return value
 
-    @sensitivity.setter
-    def sensitivity(self, value):
-        """ Set the value on the lockin or if disconnected queue it to be set."""
-        setting = 'sensitivity'
-        try:
-            cmd = self._settings[setting]['cmd']
-            cmd += ' '+str(self._settings[setting]['allowed_values'].index(value))
-            self.write(cmd)
-            old_val = self._settings[setting]['value']
-            self._settings[setting]['value'] = value
+    def sync(self):
+        """ Reconcile the local settings with the device.
+
+        Settings changed while disconnected are written to the device, then
+        all others are read from it. Getters call this automatically when
+        should_sync is set, as after connecting.
+
+        Returns:
+            bool: True if the settings are in sync.
+        """
+        if not self._connected:
+            self.logger.warning('Device not connected, cannot sync settings')
+            return False
+        if self._unsynced:
+            self.write(';'.join(self._encode(s, self._settings[s]['value']) for s in sorted(self._unsynced)))
+            self.logger.debug('Wrote settings changed while disconnected: {}'.format(sorted(self._unsynced)))
+            self._unsynced.clear()
+        self.refresh()
+        self.should_sync = not self._connected
+        return not self.should_sync
+
+    def _get_setting(self, setting):
+        """ Local value of setting, synced first with the device if needed."""
+        if self.should_sync and self._connected:
+            try:
+                self.sync()
+            except DeviceNotConnectedError:
+                self.logger.warning('Device not connected: returning stored value')
+        return self._settings[setting]['value']
+
+    def _set_setting(self, setting, value):
+        """ Set the value locally and on the lockin, or if disconnected queue it to be set at the next sync."""
+        command = self._encode(setting, value)
+        old_value = self._settings[setting]['value']
+        self._settings[setting]['value'] = value
+        if self._connected:
+            self.write(command)
+        if self._connected:
             self.logger.debug('Local AND Remote value of {} changed from {} '
-                              'to {}'.format(setting, old_val, value))
-        except DeviceNotConnectedError:
+                              'to {}'.format(setting, old_value, value))
+        else:
             self.should_sync = True
+            self._unsynced.add(setting)
             self.logger.warning('Device not connected, couldnt set value remotely.'
                                 '\n Local value of {} changed from {} '
-                                'to {}\n'.format(setting, old_val, value))
-            self._settings[setting]['value'] = value
+                                'to {}\n'.format(setting, old_value, value))
+
+    # settings properties, served from the local mirror:
+    @property
+    def sensitivity(self):
+        return self._get_setting('sensitivity')
+
+    @sensitivity.setter
+    def sensitivity(self, value):
+        self._set_setting('sensitivity', value)
 
     @property
     def time_constant(self):
-        """ return the value on lockin or if disconnected the locally set value"""
-        setting = 'time_constant'
-        try:
-            command = self._settings[setting]['cmd'] + ' ?'
-            value_idx = int(self.read(command))
-            value = self._settings[setting]['allowed_values'][value_idx]
-            old_value = self._settings[setting]['value']
-            if old_value != value:
-                self._settings[setting]['value'] = value
-                self.logger.debug(
-                    'Local value of {} changed to remote value: was {}, now is {}'.format(setting, old_value, value))
-        except DeviceNotConnectedError:
-            self.logger.warning('Device not connected: returning stored value')
-            value = self._settings[setting]['value']
-        return value
+        return self._get_setting('time_constant')
 
     @time_constant.setter
     def time_constant(self, value):
-        """ Set the value on the lockin or if disconnected queue it to be set."""
-        setting = 'time_constant'
-        assert value in self._settings[setting]['allowed_values']
-        try:
-            cmd = self._settings[setting]['cmd']
-            cmd += ' '+str(self._settings[setting]['allowed_values'].index(value))
-            self.write(cmd)
-            old_val = self._settings[setting]['value']
-            self._settings[setting]['value'] = value
-            self.logger.debug('Local AND Remote value of {} changed from {} '
-                              'to {}'.format(setting, old_val, value))
-        except DeviceNotConnectedError:
-            self.should_sync = True
-            self.logger.warning('Device not connected, couldnt set value remotely.'
-                                '\n Local value of {} changed from {} '
-                                'to {}\n'.format(setting, old_val, value))
-            self._settings[setting]['value'] = value
+        self._set_setting('time_constant', value)
 
     @property
     def low_pass_filter_slope(self):
-        """ return the value on lockin or if disconnected the locally set value"""
-        setting = 'low_pass_filter_slope'
-        try:
-            command = self._settings[setting]['cmd'] + '?'
-            value_idx = int(self.read(command))
-            value = self._settings[setting]['allowed_values'][value_idx]
-            old_value = self._settings[setting]['value']
-            if old_value != value:
-                self._settings[setting]['value'] = value
-                self.logger.debug(
-                    'Local value of {} changed to remote value: was {}, now is {}'.format(setting, old_value, value))
-        except DeviceNotConnectedError:
-            self.logger.warning('Device not connected: returning stored value')
-            value = self._settings[setting]['value']
-        return value
+        return self._get_setting('low_pass_filter_slope')
 
     @low_pass_filter_slope.setter
     def low_pass_filter_slope(self, value):
-        """ Set the value on the lockin or if disconnected queue it to be set."""
-        setting = 'low_pass_filter_slope'
-        try:
-            cmd = self._settings[setting]['cmd']
-            cmd += str(self._settings[setting]['allowed_values'].index(value))
-            self.write(cmd)
-            old_val = self._settings[setting]['value']
-            self._settings[setting]['value'] = value
-            self.logger.debug('Local AND Remote value of {} changed from {} '
-                              'to {}'.format(setting, old_val, value))
-        except DeviceNotConnectedError:
-            self.should_sync = True
-            self.logger.warning('Device not connected, couldnt set value remotely.'
-                                '\n Local value of {} changed from {} '
-                                'to {}\n'.format(setting, old_val, value))
-            self._settings[setting]['value'] = value
+        self._set_setting('low_pass_filter_slope', value)
 
     @property
     def input_config(self):
-        """ return the value on lockin or if disconnected the locally set value"""
-        setting = 'input_config'
-        try:
-            command = self._settings[setting]['cmd'] + '?'
-            value_idx = int(self.read(command))
-            value = self._settings[setting]['allowed_values'][value_idx]
-            old_value = self._settings[setting]['value']
-            if old_value != value:
-                self._settings[setting]['value'] = value
-                self.logger.debug(
-                    'Local value of {} changed to remote value: was {}, now is {}'.format(setting, old_value, value))
-        except DeviceNotConnectedError:
-            self.logger.warning('Device not connected: returning stored value')
-            value = self._settings[setting]['value']
-        return value
+        return self._get_setting('input_config')
 
     @input_config.setter
     def input_config(self, value):
-        """ Set the value on the lockin or if disconnected queue it to be set."""
-        setting = 'input_config'
-        try:
-            cmd = self._settings[setting]['cmd']
-            cmd += str(self._settings[setting]['allowed_values'].index(value))
-            self.write(cmd)
-            old_val = self._settings[setting]['value']
-            self._settings[setting]['value'] = value
-            self.logger.debug('Local AND Remote value of {} changed from {} '
-                              'to {}'.format(setting, old_val, value))
-        except DeviceNotConnectedError:
-            self.should_sync = True
-            self.logger.warning('Device not connected, couldnt set value remotely.'
-                                '\n Local value of {} changed from {} '
-                                'to {}\n'.format(setting, old_val, value))
-            self._settings[setting]['value'] = value
+        self._set_setting('input_config', value)
 
     @property
     def input_shield(self):
-        """ return the value on lockin or if disconnected the locally set value"""
-        setting = 'input_shield'
-        try:
-            command = self._settings[setting]['cmd'] + '?'
-            value_idx = int(self.read(command))
-            value = self._settings[setting]['allowed_values'][value_idx]
-            old_value = self._settings[setting]['value']
-            if old_value != value:
-                self._settings[setting]['value'] = value
-                self.logger.debug(
-                    'Local value of {} changed to remote value: was {}, now is {}'.format(setting, old_value, value))
-        except DeviceNotConnectedError:
-            self.logger.warning('Device not connected: returning stored value')
-            value = self._settings[setting]['value']
-        return value
+        return self._get_setting('input_shield')
 
     @input_shield.setter
     def input_shield(self, value):
-        """ Set the value on the lockin or if disconnected queue it to be set."""
-        setting = 'input_shield'
-        try:
-            cmd = self._settings[setting]['cmd']
-            cmd += str(self._settings[setting]['allowed_values'].index(value))
-            self.write(cmd)
-            old_val = self._settings[setting]['value']
-            self._settings[setting]['value'] = value
-            self.logger.debug('Local AND Remote value of {} changed from {} '
-                              'to {}'.format(setting, old_val, value))
-        except DeviceNotConnectedError:
-            self.should_sync = True
-            self.logger.warning('Device not connected, couldnt set value remotely.'
-                                '\n Local value of {} changed from {} '
-                                'to {}\n'.format(setting, old_val, value))
-            self._settings[setting]['value'] = value
+        self._set_setting('input_shield', value)
 
     @property
     def input_coupling(self):
-        """ return the value on lockin or if disconnected the locally set value"""
-        setting = 'input_coupling'
-        try:
-            command = self._settings[setting]['cmd'] + '?'
-            value_idx = int(self.read(command))
-            value = self._settings[setting]['allowed_values'][value_idx]
-            old_value = self._settings[setting]['value']
-            if old_value != value:
-                self._settings[setting]['value'] = value
-                self.logger.debug(
-                    'Local value of {} changed to remote value: was {}, now is {}'.format(setting, old_value, value))
-        except DeviceNotConnectedError:
-            self.logger.warning('Device not connected: returning stored value')
-            value = self._settings[setting]['value']
-        return value
+        return self._get_setting('input_coupling')
 
     @input_coupling.setter
     def input_coupling(self, value):
-        """ Set the value on the lockin or if disconnected queue it to be set."""
-        setting = 'input_coupling'
-        try:
-            cmd = self._settings[setting]['cmd']
-            cmd += str(self._settings[setting]['allowed_values'].index(value))
-            self.write(cmd)
-            old_val = self._settings[setting]['value']
-            self._settings[setting]['value'] = value
-            self.logger.debug('Local AND Remote value of {} changed from {} '
-                              'to {}'.format(setting, old_val, value))
-        except DeviceNotConnectedError:
-            self.should_sync = True
-            self.logger.warning('Device not connected, couldnt set value remotely.'
-                                '\n Local value of {} changed from {} '
-                                'to {}\n'.format(setting, old_val, value))
-            self._settings[setting]['value'] = value
+        self._set_setting('input_coupling', value)
 
     @property
     def input_line_notch_filter(self):
-        """ return the value on lockin or if disconnected the locally set value"""
-        setting = 'input_line_notch_filter'
-        try:
-            command = self._settings[setting]['cmd'] + '?'
-            value_idx = int(self.read(command))
-            value = self._settings[setting]['allowed_values'][value_idx]
-            old_value = self._settings[setting]['value']
-            if old_value != value:
-                self._settings[setting]['value'] = value
-                self.logger.debug(
-                    'Local value of {} changed to remote value: was {}, now is {}'.format(setting, old_value, value))
-        except DeviceNotConnectedError:
-            self.logger.warning('Device not connected: returning stored value')
-            value = self._settings[setting]['value']
-        return value
+        return self._get_setting('input_line_notch_filter')
 
     @input_line_notch_filter.setter
     def input_line_notch_filter(self, value):
-        """ Set the value on the lockin or if disconnected queue it to be set."""
-        setting = 'input_line_notch_filter'
-        try:
-            cmd = self._settings[setting]['cmd']
-            cmd += str(self._settings[setting]['allowed_values'].index(value))
-            self.write(cmd)
-            old_val = self._settings[setting]['value']
-            self._settings[setting]['value'] = value
-            self.logger.debug('Local AND Remote value of {} changed from {} '
-                              'to {}'.format(setting, old_val, value))
-        except DeviceNotConnectedError:
-            self.should_sync = True
-            self.logger.warning('Device not connected, couldnt set value remotely.'
-                                '\n Local value of {} changed from {} '
-                                'to {}\n'.format(setting, old_val, value))
-            self._settings[setting]['value'] = value
+        self._set_setting('input_line_notch_filter', value)
 
     @property
     def reserve_mode(self):
-        """ return the value on lockin or if disconnected the locally set value"""
-        setting = 'reserve_mode'
-        try:
-            command = self._settings[setting]['cmd'] + '?'
-            value_idx = int(self.read(command))
-            value = self._settings[setting]['allowed_values'][value_idx]
-            old_value = self._settings[setting]['value']
-            if old_value != value:
-                self._settings[setting]['value'] = value
-                self.logger.debug(
-                    'Local value of {} changed to remote value: was {}, now is {}'.format(setting, old_value, value))
-        except DeviceNotConnectedError:
-            self.logger.warning('Device not connected: returning stored value')
-            value = self._settings[setting]['value']
-        return value
+        return self._get_setting('reserve_mode')
 
     @reserve_mode.setter
     def reserve_mode(self, value):
-        """ Set the value on the lockin or if disconnected queue it to be set."""
-        setting = 'reserve_mode'
-        try:
-            cmd = self._settings[setting]['cmd']
-            cmd += str(self._settings[setting]['allowed_values'].index(value))
-            self.write(cmd)
-            old_val = self._settings[setting]['value']
-            self._settings[setting]['value'] = value
-            self.logger.debug('Local AND Remote value of {} changed from {} '
-                              'to {}'.format(setting, old_val, value))
-        except DeviceNotConnectedError:
-            self.should_sync = True
-            self.logger.warning('Device not connected, couldnt set value remotely.'
-                                '\n Local value of {} changed from {} '
-                                'to {}\n'.format(setting, old_val, value))
-            self._settings[setting]['value'] = value
+        self._set_setting('reserve_mode', value)
 
     @property
     def synchronous_filter(self):
-        """ return the value on lockin or if disconnected the locally set value"""
-        setting = 'synchronous_filter'
-        try:
-            command = self._settings[setting]['cmd'] + '?'
-            value_idx = int(self.read(command))
-            value = self._settings[setting]['allowed_values'][value_idx]
-            old_value = self._settings[setting]['value']
-            if old_value != value:
-                self._settings[setting]['value'] = value
-                self.logger.debug(
-                    'Local value of {} changed to remote value: was {}, now is {}'.format(setting, old_value, value))
-        except DeviceNotConnectedError:
-            self.logger.warning('Device not connected: returning stored value')
-            value = self._settings[setting]['value']
-        return value
+        return self._get_setting('synchronous_filter')
 
     @synchronous_filter.setter
     def synchronous_filter(self, value):
-        """ Set the value on the lockin or if disconnected queue it to be set."""
-        setting = 'synchronous_filter'
-        try:
-            cmd = self._settings[setting]['cmd']
-            cmd += str(self._settings[setting]['allowed_values'].index(value))
-            self.write(cmd)
-            old_val = self._settings[setting]['value']
-            self._settings[setting]['value'] = value
-            self.logger.debug('Local AND Remote value of {} changed from {} '
-                              'to {}'.format(setting, old_val, value))
-        except DeviceNotConnectedError:
-            self.should_sync = True
-            self.logger.warning('Device not connected, couldnt set value remotely.'
-                                '\n Local value of {} changed from {} '
-                                'to {}\n'.format(setting, old_val, value))
-            self._settings[setting]['value'] = value
+        self._set_setting('synchronous_filter', value)
 
     @property
     def reference_source(self):
-        """ return the value on lockin or if disconnected the locally set value"""
-        setting = 'reference_source'
-        try:
-            command = self._settings[setting]['cmd'] + '?'
-            value_idx = int(self.read(command))
-            value = self._settings[setting]['allowed_values'][value_idx]
-            old_value = self._settings[setting]['value']
-            if old_value != value:
-                self._settings[setting]['value'] = value
-                self.logger.debug(
-                    'Local value of {} changed to remote value: was {}, now is {}'.format(setting, old_value, value))
-        except DeviceNotConnectedError:
-            self.logger.warning('Device not connected: returning stored value')
-            value = self._settings[setting]['value']
-        return value
+        return self._get_setting('reference_source')
 
     @reference_source.setter
     def reference_source(self, value):
-        """ Set the value on the lockin or if disconnected queue it to be set."""
-        setting = 'reference_source'
-        try:
-            cmd = self._settings[setting]['cmd']
-            cmd += str(self._settings[setting]['allowed_values'].index(value))
-            self.write(cmd)
-            old_val = self._settings[setting]['value']
-            self._settings[setting]['value'] = value
-            self.logger.debug('Local AND Remote value of {} changed from {} '
-                              'to {}'.format(setting, old_val, value))
-        except DeviceNotConnectedError:
-            self.should_sync = True
-            self.logger.warning('Device not connected, couldnt set value remotely.'
-                                '\n Local value of {} changed from {} '
-                                'to {}\n'.format(setting, old_val, value))
-            self._settings[setting]['value'] = value
+        self._set_setting('reference_source', value)
 
     @property
     def reference_trigger(self):
-        """ return the value on lockin or if disconnected the locally set value"""
-        setting = 'reference_trigger'
-        try:
-            command = self._settings[setting]['cmd'] + '?'
-            value_idx = int(self.read(command))
-            value = self._settings[setting]['allowed_values'][value_idx]
-            old_value = self._settings[setting]['value']
-            if old_value != value:
-                self._settings[setting]['value'] = value
-                self.logger.debug(
-                    'Local value of {} changed to remote value: was {}, now is {}'.format(setting, old_value, value))
-        except DeviceNotConnectedError:
-            self.logger.warning('Device not connected: returning stored value')
-            value = self._settings[setting]['value']
-        return value
+        return self._get_setting('reference_trigger')
 
     @reference_trigger.setter
     def reference_trigger(self, value):
-        """ Set the value on the lockin or if disconnected queue it to be set."""
-        setting = 'reference_trigger'
-        try:
-            cmd = self._settings[setting]['cmd']
-            cmd += str(self._settings[setting]['allowed_values'].index(value))
-            self.write(cmd)
-            old_val = self._settings[setting]['value']
-            self._settings[setting]['value'] = value
-            self.logger.debug('Local AND Remote value of {} changed from {} '
-                              'to {}'.format(setting, old_val, value))
-        except DeviceNotConnectedError:
-            self.should_sync = True
-            self.logger.warning('Device not connected, couldnt set value remotely.'
-                                '\n Local value of {} changed from {} '
-                                'to {}\n'.format(setting, old_val, value))
-            self._settings[setting]['value'] = value
+        self._set_setting('reference_trigger', value)
 
     @property
     def sine_output_amplitude(self):
-        """ return the value on lockin or if disconnected the locally set value"""
-        setting = 'sine_output_amplitude'
-        try:
-            command = self._settings[setting]['cmd'] + '?'
-            value_idx = int(self.read(command))
-            value = self._settings[setting]['allowed_values'][value_idx]
-            old_value = self._settings[setting]['value']
-            if old_value != value:
-                self._settings[setting]['value'] = value
-                self.logger.debug(
-                    'Local value of {} changed to remote value: was {}, now is {}'.format(setting, old_value, value))
-        except DeviceNotConnectedError:
-            self.logger.warning('Device not connected: returning stored value')
-            value = self._settings[setting]['value']
-        return value
+        return self._get_setting('sine_output_amplitude')
 
     @sine_output_amplitude.setter
     def sine_output_amplitude(self, value):
-        """ Set the value on the lockin or if disconnected queue it to be set."""
-        setting = 'sine_output_amplitude'
-        try:
-            cmd = self._settings[setting]['cmd']
-            cmd += str(self._settings[setting]['allowed_values'].index(value))
-            self.write(cmd)
-            old_val = self._settings[setting]['value']
-            self._settings[setting]['value'] = value
-            self.logger.debug('Local AND Remote value of {} changed from {} '
-                              'to {}'.format(setting, old_val, value))
-        except DeviceNotConnectedError:
-            self.should_sync = True
-            self.logger.warning('Device not connected, couldnt set value remotely.'
-                                '\n Local value of {} changed from {} '
-                                'to {}\n'.format(setting, old_val, value))
-            self._settings[setting]['value'] = value
+        assert .004 <= value <= 5, 'sine output amplitude must be between 0.004 and 5 V'
+        self._set_setting('sine_output_amplitude', float(value))
 
     @property
     def detection_harmonic(self):
-        """ return the value on lockin or if disconnected the locally set value"""
-        setting = 'detection_harmonic'
-        try:
-            command = self._settings[setting]['cmd'] + '?'
-            value = float(self.read(command))
-            old_value = self._settings[setting]['value']
-            if old_value != value:
-                self._settings[setting]['value'] = value
-                self.logger.debug(
-                    'Local value of {} changed to remote value: was {}, now is {}'.format(setting, old_value, value))
-        except DeviceNotConnectedError:
-            self.logger.warning('Device not connected: returning stored value')
-            value = self._settings[setting]['value']
-        return value
+        return self._get_setting('detection_harmonic')
 
     @detection_harmonic.setter
     def detection_harmonic(self, value):
-        """ Set the value on the lockin or if disconnected queue it to be set."""
-        setting = 'detection_harmonic'
-        assert isinstance(value, float), 'wrong type for detection harmonic'
-        try:
-            cmd = self._settings[setting]['cmd']
-            cmd += str(self._settings[setting]['allowed_values'].index(value))
-            self.write(cmd)
-            old_val = self._settings[setting]['value']
-            self._settings[setting]['value'] = value
-            self.logger.debug('Local AND Remote value of {} changed from {} '
-                              'to {}'.format(setting, old_val, value))
-        except DeviceNotConnectedError:
-            self.should_sync = True
-            self.logger.warning('Device not connected, couldnt set value remotely.'
-                                '\n Local value of {} changed from {} '
-                                'to {}\n'.format(setting, old_val, value))
-            self._settings[setting]['value'] = value
+        assert isinstance(value, int) and value >= 1, 'detection harmonic must be a positive integer'
+        self._set_setting('detection_harmonic', value)
 
     @property
     def frequency(self):
-        """ return the value on lockin or if disconnected the locally set value"""
-        setting = 'frequency'
-        try:
-            command = self._settings[setting]['cmd'] + '?'
-            value = float(self.read(command))
-            old_value = self._settings[setting]['value']
-            if old_value != value:
-                self._settings[setting]['value'] = value
-                self.logger.debug(
-                    'Local value of {} changed to remote value: was {}, now is {}'.format(setting, old_value, value))
-        except DeviceNotConnectedError:
-            self.logger.warning('Device not connected: returning stored value')
-            value = self._settings[setting]['value']
-        return value
+        return self._get_setting('frequency')
 
     @frequency.setter
     def frequency(self, value):
-        """ Set the value on the lockin or if disconnected queue it to be set."""
-        setting = 'frequency'
-        assert isinstance(value, float), 'wrong type for detection harmonic'
-        try:
-            cmd = self._settings[setting]['cmd']
-            cmd += str(self._settings[setting]['allowed_values'].index(value))
-            self.write(cmd)
-            old_val = self._settings[setting]['value']
-            self._settings[setting]['value'] = value
-            self.logger.debug('Local AND Remote value of {} changed from {} '
-                              'to {}'.format(setting, old_val, value))
-        except DeviceNotConnectedError:
-            self.should_sync = True
-            self.logger.warning('Device not connected, couldnt set value remotely.'
-                                '\n Local value of {} changed from {} '
-                                'to {}\n'.format(setting, old_val, value))
-            self._settings[setting]['value'] = value
+        self._set_setting('frequency', float(value))
 
     @property
     def phase(self):
-        """ return the value on lockin or if disconnected the locally set value"""
-        setting = 'phase'
-        try:
-            command = self._settings[setting]['cmd'] + '?'
-            value = float(self.read(command))
-            old_value = self._settings[setting]['value']
-            if old_value != value:
-                self._settings[setting]['value'] = value
-                self.logger.debug(
-                    'Local value of {} changed to remote value: was {}, now is {}'.format(setting, old_value, value))
-        except DeviceNotConnectedError:
-            self.logger.warning('Device not connected: returning stored value')
-            value = self._settings[setting]['value']
-        return value
+        return self._get_setting('phase')
 
     @phase.setter
     def phase(self, value):
-        """ Set the value on the lockin or if disconnected queue it to be set."""
-        setting = 'phase'
-        assert isinstance(value, float), 'wrong type for detection harmonic'
-        try:
-            cmd = self._settings[setting]['cmd']
-            cmd += str(self._settings[setting]['allowed_values'].index(value))
-            self.write(cmd)
-            old_val = self._settings[setting]['value']
-            self._settings[setting]['value'] = value
-            self.logger.debug('Local AND Remote value of {} changed from {} '
-                              'to {}'.format(setting, old_val, value))
-        except DeviceNotConnectedError:
-            self.should_sync = True
-            self.logger.warning('Device not connected, couldnt set value remotely.'
-                                '\n Local value of {} changed from {} '
-                                'to {}\n'.format(setting, old_val, value))
-            self._settings[setting]['value'] = value
+        self._set_setting('phase', float(value))
 
 
 if __name__ == '__main__':
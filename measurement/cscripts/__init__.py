@@ -19,6 +19,56 @@
     along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 """
+import logging
+from functools import partial
+
+PROJECTOR_BACKENDS = ('cython', 'cython_parallel', 'numpy', 'python')
+_loaded_projectors = {}
+logger = logging.getLogger(__name__)
+
+
+def load_projector(backend='cython', n_threads=1):
+    """ Load the project and project_r0 functions from the chosen backend.
+
+    Args:
+        backend (str): one of 'cython', 'cython_parallel', 'numpy' or
+            'python'. If the cython module is not compiled, logs a warning
+            and falls back to the numpy backend. The cython module is built
+            with `python setup.py build_ext --inplace`.
+        n_threads (int): number of threads used by the 'cython_parallel'
+            backend. Ignored by the others.
+
+    Returns:
+        project, project_r0: the projection functions of the backend.
+    """
+    if backend not in PROJECTOR_BACKENDS:
+        raise ValueError('Unknown projector backend "{}". Choose from {}'.format(backend, PROJECTOR_BACKENDS))
+    key = (backend, n_threads) if backend == 'cython_parallel' else backend
+    if key in _loaded_projectors:
+        return _loaded_projectors[key]
+
+    if backend == 'cython_parallel':
+        try:
+            from measurement.cscripts.project import project_parallel, project_r0_parallel
+            project = partial(project_parallel, n_threads=n_threads)
+            project_r0 = partial(project_r0_parallel, n_threads=n_threads)
+        except ImportError as e:
+            logger.warning('failed loading parallel cython projector ({}), loading numpy instead'.format(e))
+            backend = 'numpy'
+    elif backend == 'cython':
+        try:
+            from measurement.cscripts.project import project, project_r0
+            logger.debug('loaded cython projector')
+        except ImportError as e:
+            logger.warning('failed loading cython projector ({}), loading numpy instead'.format(e))
+            backend = 'numpy'
+    if backend == 'numpy':
+        from measurement.cscripts.projectNp import project, project_r0
+    elif backend == 'python':
+        from measurement.cscripts.projectPy import project, project_r0
+
+    _loaded_projectors[key] = project, project_r0
+    return project, project_r0
 
 
 def main():
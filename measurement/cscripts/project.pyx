@@ -1,10 +1,11 @@
 cimport numpy as np
 import numpy as np
 cimport cython
+from cython.parallel cimport prange
 
 DTYPE = np.float64
-ctypedef np.float_t DTYPE_t
-ctypedef np.int_t DTYPE_i
+ctypedef np.float64_t DTYPE_t
+ctypedef np.intp_t DTYPE_i
 
 @cython.boundscheck(False) # turn off bounds-checking for entire function
 @cython.wraparound(False)  # turn off negative index wrapping for entire function
@@ -15,7 +16,7 @@ def project_r0(
         np.ndarray[DTYPE_t, ndim = 1]  reference,
         bint use_dark_control):
     cdef int n_pts, pos_min, res_size, i, pos, count
-    cdef float r0, val,ref
+    cdef double r0, val,ref
 
     n_pts = len(spos)
     pos_min = spos.min()
@@ -61,7 +62,7 @@ def project(
         np.ndarray[DTYPE_t, ndim = 1]  dark_control,
         bint use_dark_control):
     cdef int n_pts, pos_min, res_size, i, pos
-    cdef float r0, val,ref
+    cdef double val
 
     n_pts = len(spos)
     pos_min = spos.min()
@@ -89,3 +90,113 @@ def project(
             norm_array[spos[i]-pos_min] += 1.
 
     return result_val/(norm_array)
+
+
+# -----------------------------------------------------------------------------
+#       GIL-free parallel projection
+# -----------------------------------------------------------------------------
+
+ctypedef fused spos_t:
+    int
+    long
+    long long
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef void _bin_block(const spos_t[::1] spos,
+                     const double[::1] signal,
+                     const double[::1] dark_control,
+                     const double[::1] reference,
+                     bint use_reference,
+                     bint use_dark_control,
+                     Py_ssize_t start,
+                     Py_ssize_t stop,
+                     Py_ssize_t pos_min,
+                     double[::1] hist_val,
+                     double[::1] hist_ref,
+                     double[::1] hist_norm) noexcept nogil:
+    """ Accumulate the samples (or sample pairs, with dark control) with
+    index in [start, stop) into the given histograms."""
+    cdef Py_ssize_t i, pos
+    cdef double val, ref
+
+    for i in range(start, stop):
+        if use_dark_control:
+            pos = (spos[2 * i] + spos[2 * i + 1]) // 2 - pos_min
+            if dark_control[2 * i] > dark_control[2 * i + 1]:
+                val = signal[2 * i] - signal[2 * i + 1]
+                if use_reference:
+                    ref = reference[2 * i]
+            else:
+                val = signal[2 * i + 1] - signal[2 * i]
+                if use_reference:
+                    ref = reference[2 * i + 1]
+        else:
+            pos = spos[i] - pos_min
+            val = signal[i]
+            if use_reference:
+                ref = reference[i]
+        hist_val[pos] += val
+        if use_reference:
+            hist_ref[pos] += ref
+        hist_norm[pos] += 1.
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def _project_parallel(const spos_t[::1] spos,
+                      const double[::1] signal,
+                      const double[::1] dark_control,
+                      const double[::1] reference,
+                      bint use_reference,
+                      bint use_dark_control,
+                      int n_threads):
+    """ Split the stream in n_threads blocks, bin each block in its private
+    histogram without holding the GIL, and reduce the histograms at the end.
+
+    Returns:
+        result_val, result_ref, norm_array: summed histograms.
+    """
+    cdef Py_ssize_t n_pts, n_items, pos_min, res_size, block, t
+    n_pts = spos.shape[0]
+    n_threads = max(1, n_threads)
+    n_items = n_pts // 2 if use_dark_control else n_pts
+
+    spos_arr = np.asarray(spos)
+    pos_min = spos_arr.min()
+    res_size = spos_arr.max() - pos_min + 1
+
+    cdef double[:, ::1] hist_val = np.zeros((n_threads, res_size), dtype=np.float64)
+    cdef double[:, ::1] hist_ref = np.zeros((n_threads if use_reference else 1, res_size), dtype=np.float64)
+    cdef double[:, ::1] hist_norm = np.zeros((n_threads, res_size), dtype=np.float64)
+
+    block = (n_items + n_threads - 1) // n_threads
+    for t in prange(n_threads, nogil=True, schedule='static', num_threads=n_threads):
+        _bin_block(spos, signal, dark_control, reference, use_reference, use_dark_control,
+                   t * block, min((t + 1) * block, n_items), pos_min,
+                   hist_val[t], hist_ref[t if use_reference else 0], hist_norm[t])
+
+    return (np.asarray(hist_val).sum(axis=0),
+            np.asarray(hist_ref).sum(axis=0),
+            np.asarray(hist_norm).sum(axis=0))
+
+
+def project_r0_parallel(spos, signal, dark_control, reference, use_dark_control, n_threads=1):
+    """ GIL-free, multi-threaded version of project_r0."""
+    result_val, result_ref, norm_array = _project_parallel(
+        np.ascontiguousarray(spos), np.ascontiguousarray(signal, dtype=np.float64),
+        np.ascontiguousarray(dark_control, dtype=np.float64), np.ascontiguousarray(reference, dtype=np.float64),
+        True, use_dark_control, n_threads)
+    r0 = np.nanmean(result_ref / norm_array)
+    return result_val / (norm_array * r0)
+
+
+def project_parallel(spos, signal, dark_control, use_dark_control, n_threads=1):
+    """ GIL-free, multi-threaded version of project."""
+    signal = np.ascontiguousarray(signal, dtype=np.float64)
+    result_val, _, norm_array = _project_parallel(
+        np.ascontiguousarray(spos), signal,
+        np.ascontiguousarray(dark_control, dtype=np.float64), signal,
+        False, use_dark_control, n_threads)
+    return result_val / norm_array
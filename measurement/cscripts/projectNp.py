@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+
+@author: Steinn Ymir Agustsson
+
+    Copyright (C) 2018 Steinn Ymir Agustsson
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+import numpy as np
+
+
+def _pair_dark_control(spos, signal, dark_control, reference=None):
+    """ Combine consecutive pump-on/pump-off samples into single points.
+
+    Samples are paired as (2i, 2i+1). The position of each pair is the mean of
+    the two positions, and the value is the pump-on minus pump-off signal,
+    where pump-on is the sample with the higher dark control value.
+
+    Returns:
+        pos, val, ref: ndarrays of length n_pts//2. ref is None if no reference
+        is given.
+    """
+    n = (len(spos) // 2) * 2
+    spos_0, spos_1 = spos[0:n:2], spos[1:n:2]
+    pump_on_first = dark_control[0:n:2] > dark_control[1:n:2]
+
+    pos = (spos_0 + spos_1) // 2
+    val = signal[0:n:2] - signal[1:n:2]
+    val = np.where(pump_on_first, val, -val)
+    if reference is None:
+        ref = None
+    else:
+        ref = np.where(pump_on_first, reference[0:n:2], reference[1:n:2])
+    return pos, val, ref
+
+
+def project_r0(spos, signal, dark_control, reference, use_dark_control):
+    spos = np.asarray(spos, dtype=np.int64)
+    pos_min = spos.min()
+    res_size = spos.max() - pos_min + 1
+
+    if use_dark_control:
+        pos, val, ref = _pair_dark_control(spos, signal, dark_control, reference)
+    else:
+        pos, val, ref = spos, signal, reference
+    pos = pos - pos_min
+
+    result_val = np.bincount(pos, weights=val, minlength=res_size)
+    result_ref = np.bincount(pos, weights=ref, minlength=res_size)
+    norm_array = np.bincount(pos, minlength=res_size).astype(np.float64)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        r0 = np.nanmean(result_ref / norm_array)
+        return result_val / (norm_array * r0)
+
+
+def project(spos, signal, dark_control, use_dark_control):
+    spos = np.asarray(spos, dtype=np.int64)
+    pos_min = spos.min()
+    res_size = spos.max() - pos_min + 1
+
+    if use_dark_control:
+        pos, val, _ = _pair_dark_control(spos, signal, dark_control)
+    else:
+        pos, val = spos, signal
+    pos = pos - pos_min
+
+    result_val = np.bincount(pos, weights=val, minlength=res_size)
+    norm_array = np.bincount(pos, minlength=res_size).astype(np.float64)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return result_val / norm_array
+
+
+def project_to_grid(spos, signal, dark_control, reference, use_dark_control, pos_min, n_bins):
+    """ Bin the stream on a fixed grid of shaker positions.
+
+    Samples falling outside [pos_min, pos_min + n_bins) are discarded, and
+    counted in n_outside.
+
+    Args:
+        reference: reference channel, or None if r0 is not used.
+        pos_min (int): shaker position of the first bin, in ADC steps.
+        n_bins (int): number of bins of the grid.
+
+    Returns:
+        result_val, result_ref, norm_array, n_outside: sums of the signal and
+        reference values and number of samples in each bin, and number of
+        samples outside the grid. result_ref is None if no reference is given.
+    """
+    spos = np.asarray(spos, dtype=np.int64)
+    if use_dark_control:
+        pos, val, ref = _pair_dark_control(spos, signal, dark_control, reference)
+    else:
+        pos, val, ref = spos, signal, reference
+    pos = pos - pos_min
+
+    inside = (pos >= 0) & (pos < n_bins)
+    n_outside = len(pos) - np.count_nonzero(inside)
+    if n_outside:
+        pos, val = pos[inside], val[inside]
+        if ref is not None:
+            ref = ref[inside]
+
+    result_val = np.bincount(pos, weights=val, minlength=n_bins)
+    norm_array = np.bincount(pos, minlength=n_bins).astype(np.float64)
+    result_ref = None if ref is None else np.bincount(pos, weights=ref, minlength=n_bins)
+    return result_val, result_ref, norm_array, n_outside
+
+
+if __name__ == '__main__':
+    pass
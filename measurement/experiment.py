@@ -696,6 +696,7 @@ class StepScan(Experiment):
         self.measurement_settings = {'averages': 2,
                                      'stage_positions': np.linspace(-1, 3, 10),
                                      'time_zero': -.5,
+                                     'lockin_buffer_samples': 0,
                                      }
 
     @property
@@ -744,6 +745,18 @@ class StepScan(Experiment):
         self.logger.info('Changed time zero to {}'.format(t0))
         self.measurement_settings['time_zero'] = t0
 
+    @property
+    def lockin_buffer_samples(self):
+        """ Samples averaged at each stage position, read from the lock-in data buffer. 0 reads a single point."""
+        return self.measurement_settings['lockin_buffer_samples']
+
+    @lockin_buffer_samples.setter
+    def lockin_buffer_samples(self, n):
+        assert isinstance(n, int), 'number of samples must be an integer'
+        assert n >= 0, 'cant take a negative number of samples!'
+        self.logger.info('Changed lock-in buffer samples to {}'.format(n))
+        self.measurement_settings['lockin_buffer_samples'] = n
+
 
 class StepScanWorker(Worker):
     """ Subclass of Worker, designed to perform step scan measurements.
@@ -773,6 +786,8 @@ class StepScanWorker(Worker):
         self.check_requirements()
         self.single_measurement_steps = len(self.stage_positions) * self.averages
         self.parameters_to_measure = ['X', 'Y']
+        if getattr(self, 'lockin_buffer_samples', 0):  # fail now rather than in the middle of the scan
+            self.lockin.buffer_channels(self.parameters_to_measure)
         self.logger.info('Initialized worker with single scan steps: {}'.format(self.single_measurement_steps))
 
     def check_requirements(self):
@@ -813,7 +828,11 @@ class StepScanWorker(Worker):
                     self.logger.debug('No readout of stage position. saving with nominal value {}'.format(pos))
                     real_pos = pos
 
-                result = self.lockin.measure(self.parameters_to_measure, return_dict=True)
+                if getattr(self, 'lockin_buffer_samples', 0):
+                    result = self.lockin.measure_buffered(self.parameters_to_measure, self.lockin_buffer_samples,
+                                                          return_dict=True)
+                else:
+                    result = self.lockin.measure(self.parameters_to_measure, return_dict=True)
 
                 result['pos'] = pos
                 result['real_pos'] = real_pos
@@ -20,379 +20,654 @@
 
 """
 
+import functools
+import itertools
 import logging
-# for experiment-like classes
-import multiprocessing as mp
-import os
-import sys
+import threading
 import time
 import traceback
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
-import h5py
-import nidaqmx
 import numpy as np
-import xarray as xr
-from PyQt5 import QtCore
-
-try:
-    from nidaqmx import stream_readers
-    from nidaqmx.constants import Edge, AcquisitionType
-except:
-    print('no nidaqmx package found, only simulations available')
-
-from scipy.optimize import curve_fit
-
-from instruments.cryostat import ITC503s as Cryostat
-from instruments.delaystage import Standa_8SMC5
-from utilities.math import sech2_fwhm, sin, gaussian_fwhm, gaussian, transient_1expdec, update_average
-from utilities.settings import parse_setting, parse_category, write_setting
-try:
-    # raise Exception
-    from measurement.cscripts.project import project, project_r0
-    print('Successfully loaded cython projector')
-
-except:
-    print('warning: failed loading cython projector, loading python instead')
-    from measurement.cscripts.projectPy import project, project_r0
+
+from utilities.math import sech2_fwhm, sin, gaussian_fwhm, gaussian, transient_1expdec, update_average, \
+    fit_sin_fast, sin_residual, sech2_fwhm_jac, gaussian_fwhm_jac, fit_lm_batch
+from utilities.data import settings_to_hdf
+from utilities.settings import parse_setting, parse_category, subscribe_settings, unsubscribe_settings
+from utilities.metrics import MetricsRegistry
+from utilities.misc import LazyModule
+from measurement.cscripts import load_projector
+from measurement.cscripts.projectNp import project_to_grid
+from measurement.processpool import FramePool, ProjectorProcessPool
+from measurement.rawstream import RawStreamFile, RawStreamRecorder
+
+# heavy dependencies are imported on first use, so that importing this module,
+# as for a simulation or a script, stays fast. nidaqmx, h5py, scipy.optimize,
+# the instruments and the Qt classes are imported where needed.
+xr = LazyModule('xarray')
+
+project, project_r0 = load_projector('cython')
+
+
+def __getattr__(name):
+    """ The Qt interface lives in measurement.fastscan_qt, imported on first use."""
+    if name in ('FastScanThreadManager', 'Runnable', 'RunnableSignals', 'FastScanProcessor'):
+        from measurement import fastscan_qt
+        return getattr(fastscan_qt, name)
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
 
 # -----------------------------------------------------------------------------
-#       thread management
+#       configuration
 # -----------------------------------------------------------------------------
 
-class FastScanThreadManager(QtCore.QObject):
-    """
-    This class manages the streamer processor and fitter workers for the fast
-    scan data acquisition and processing.
+class FastScanConfig(object):
+    """ Immutable snapshot of the fastscan settings.
 
+    Built once per acquisition start with from_settings, and handed to the
+    streamer, the projector and save_data, so per-frame code only looks up
+    attributes. Each snapshot with different settings gets a new version
+    number, which is stored with every projected curve and in the saved
+    files.
     """
-    newStreamerData = QtCore.pyqtSignal(np.ndarray)
-    newProcessedData = QtCore.pyqtSignal(xr.DataArray)
-    newFitResult = QtCore.pyqtSignal(dict)
-    newAverage = QtCore.pyqtSignal(xr.DataArray)
-    # acquisitionStopped = QtCore.pyqtSignal()
-    # finished = QtCore.pyqtSignal()
-    # newData = QtCore.pyqtSignal(np.ndarray)
-    error = QtCore.pyqtSignal(Exception)
+    __slots__ = ('version', 'simulate', 'n_samples', 'shaker_position_step', 'shaker_ps_per_step', 'shaker_gain',
+                 'acquisition_mode', 'dark_control', 'use_r0', 'n_processors', 'n_averages', 'projector_backend',
+                 'fixed_time_grid', 'shaker_amplitude', 'processing_backend', 'stream_queue_size',
+                 'stream_queue_policy', 'record_file', 'replay_file', 'replay_speed', 'projector_threads')
+    defaults = {'simulate': True,
+                'n_samples': 18000,
+                'shaker_position_step': 0.000152587890625,
+                'shaker_ps_per_step': .05,
+                'shaker_gain': 1,
+                'acquisition_mode': 'triggered',
+                'dark_control': True,
+                'use_r0': False,
+                'n_processors': 1,
+                'n_averages': 50,
+                'projector_backend': 'cython',
+                'fixed_time_grid': False,
+                'shaker_amplitude': 100,
+                'processing_backend': 'threads',
+                'stream_queue_size': 100,
+                'stream_queue_policy': 'drop_oldest',
+                'record_file': None,  # file where to record the raw streams, see RawStreamRecorder
+                'replay_file': None,  # recording to replay with acquisition_mode 'replay'
+                'replay_speed': 'original',  # 'original' or 'max'
+                'projector_threads': 1,  # threads of the cython_parallel backend, in each of the n_processors workers
+                }
+    _versions = itertools.count(1)
+    _last_from_settings = None  # last snapshot made by from_settings
+    _from_settings_lock = threading.Lock()
+
+    def __init__(self, version=None, **settings):
+        unknown = set(settings) - set(self.defaults)
+        if unknown:
+            raise TypeError('Unknown fastscan settings: {}'.format(', '.join(sorted(unknown))))
+        if version is None:
+            version = next(FastScanConfig._versions)
+        object.__setattr__(self, 'version', version)
+        for name, default in self.defaults.items():
+            object.__setattr__(self, name, settings.get(name, default))
+
+    @classmethod
+    def from_settings(cls):
+        """ Snapshot of the [fastscan] category of SETTINGS.ini.
+
+        If the settings did not change since the last call, the previous
+        snapshot is returned, so the version only changes with the values.
+        """
+        settings = parse_category('fastscan') or {}
+        settings = {k: v for k, v in settings.items() if k in cls.defaults and v is not None}
+        with cls._from_settings_lock:
+            last = cls._last_from_settings
+            if last is None or type(last) is not cls or last._settings() != dict(cls.defaults, **settings):
+                cls._last_from_settings = last = cls(**settings)
+            return last
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(**d)
+
+    def replace(self, **changes):
+        """ New snapshot, with a new version, where some settings are changed."""
+        settings = self._settings()
+        settings.update(changes)
+        return FastScanConfig(**settings)
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def _settings(self):
+        """ Settings of the snapshot, without the version."""
+        return {name: getattr(self, name) for name in self.defaults}
 
-    def __init__(self):
-        super().__init__()
+    @property
+    def shaker_time_step(self):
+        """ Shaker digital step in ps, see FastScanThreadManager.shaker_time_step"""
+        return self.shaker_ps_per_step / self.shaker_gain
 
-        self.logger = logging.getLogger('{}.FastScanThreadManager'.format(__name__))
-        self.logger.info('Created Thread Manager')
+    def __setattr__(self, name, value):
+        raise AttributeError('FastScanConfig is read only, use replace to change settings')
 
-        self.__stream_queue = mp.Queue()  # Queue where to store unprocessed streamer data
+    def __delattr__(self, name):
+        raise AttributeError('FastScanConfig is read only')
 
-        self.all_curves = None
-        self.running_average = None
-        self.streamer_average = None
-        self.n_streamer_averages = 0
+    def __reduce__(self):
+        return (FastScanConfig.from_dict, (self.as_dict(),))
 
-        self._calculate_autocorrelation = None
-        self.should_stop = False
-        self.streamerRunning = False
+    def __repr__(self):
+        return 'FastScanConfig({})'.format(', '.join('{}={!r}'.format(k, v) for k, v in self.as_dict().items()))
 
-        self.current_iteration = None
-        self.spos_fit_pars = None # initialize the fit parameters for shaker position
+# -----------------------------------------------------------------------------
+#       acquisition engine
+# -----------------------------------------------------------------------------
+
+class FastScanEngine(object):
+    """ Acquisition, projection and averaging of fast scan data, without Qt.
+
+    The streamer runs in its own thread and hands each frame to
+    on_streamer_data, which queues it for projection. Frames are projected by
+    a thread pool, or with the 'processes' backend by a ProjectorProcessPool,
+    and the results are added to the running average by on_projector_data.
+    The state shared by these threads is guarded by a lock.
+
+    Results are passed to the callbacks subscribed to each event, which are
+    called from the thread producing them:
+        'stream': copy of the raw streamer frame, as np.ndarray
+        'projected': projected curve, as xr.DataArray
+        'average': running average, as xr.DataArray
+        'fit': autocorrelation fit result, as dict
+        'metrics': MetricsRegistry snapshot, at most every metrics_interval
+        'error': exception raised while acquiring or processing
+        'finished': no arguments, the acquisition loop has ended
+        'calibration_progress': (n_done, n_points) of the shaker calibration
+        'calibration_point': dict of each shaker calibration point
+        'calibration': shaker calibration result, see ShakerCalibration.run
+
+    Example, from a script:
+        engine = FastScanEngine()
+        engine.start()
+        engine.wait_frames(500)
+        engine.stop()
+        engine.join()
+        engine.save_data('scan.h5')
+        engine.close()
+    """
+    events = ('stream', 'projected', 'average', 'fit', 'metrics', 'error', 'finished',
+              'calibration_progress', 'calibration_point', 'calibration')
 
-        self.cryo = Cryostat(parse_setting('instruments','cryostat_com'))
-        # self.delay_stage = StandaStage_8SMC5()
+    def __init__(self, config=None):
+        self.logger = logging.getLogger('{}.FastScanEngine'.format(__name__))
+        self.logger.info('Created FastScan engine')
 
-        self.timer = QtCore.QTimer()
-        self.timer.setInterval(1)
-        self.timer.timeout.connect(self.on_timer)
-        self.timer.start()
-        self.counter = 0
+        self._callbacks = {event: [] for event in self.events}
+        self._lock = threading.RLock()
+        self._changed = threading.Condition(self._lock)  # notified when frames are projected or acquisition ends
 
-        self.pool = QtCore.QThreadPool()
-        self.pool.setMaxThreadCount(self.n_processors)
+        self.__stream_queue = deque()  # Queue of (frame_pool, slot, data, t_queued) waiting to be projected
 
-        self.create_streamer()
+        self.averages = None  # RunningAverage of the projected curves
+        self.running_average = None
+        self.streamer_average = None
+        self.n_streamer_averages = 0
+
+        self.calculate_autocorrelation = False
+        self.streamer = None
+        self.streamer_thread = None
+        self.streamer_running = False
+        self.current_iteration = None  # index of the temperature measured by measure_temperature_series
+
+        self.spos_fit_pars = None  # initialize the fit parameters for shaker position
+        self.time_grid = None  # fixed (pos_min, n_bins) grid for projection, if used
+        self._cryo = None
+        self.delay_stage = None  # stage used by calibrate_shaker, the simulated one if None
+        self.calibration = None  # ShakerCalibration running or last run
+
+        self.thread_pool = None  # ThreadPoolExecutor projecting the frames, with the 'threads' backend
+        self.process_pool = None  # ProjectorProcessPool, with the 'processes' backend
+        self._fit_pool = ThreadPoolExecutor(max_workers=1)
+        self.fitter = AutocorrelationFitter()  # warm started fits of the running average
+        self._fit_pending = None  # latest curve waiting to be fitted
+        self._fit_running = False
+        self.n_projected = 0
+        self.n_projecting = 0  # frames submitted for projection, until their result has been handled
+        self.n_dropped = 0  # frames discarded because the stream queue was full
+        self.stream_slots = None  # semaphore blocking the streamer, with the 'block' queue policy
+        self.frame_pool = None  # FramePool the streamer acquires into
+        self._throughput_t0 = time.time()
+        self.configs = {}  # version: FastScanConfig, of all snapshots used
+        self.file_stream = None  # H5StreamWriter saving the frames during acquisition
+        self.metrics = MetricsRegistry()  # stage timings and frame counters
+        self.metrics_interval = 1.  # minimum time between 'metrics' callbacks, in s
+        self._metrics_t = 0.
+        self.config = FastScanConfig.from_settings() if config is None else config
+        subscribe_settings(self.on_setting_changed)
+
+    def subscribe(self, event, callback):
+        """ Call callback with the arguments of event, see the class docstring."""
+        if event not in self._callbacks:
+            raise ValueError('Unknown event {}, must be one of {}'.format(event, ', '.join(self.events)))
+        if callback not in self._callbacks[event]:
+            self._callbacks[event].append(callback)
+
+    def unsubscribe(self, event, callback):
+        if callback in self._callbacks.get(event, []):
+            self._callbacks[event].remove(callback)
+
+    def notify(self, event, *args):
+        """ Call the callbacks of event. A failing callback does not stop the others."""
+        for callback in list(self._callbacks[event]):
+            try:
+                callback(*args)
+            except Exception as e:
+                self.logger.warning('{} callback {} failed: {}'.format(event, callback, e))
+
+    # acquisition
 
-    def start_projector(self, stream_data):
-        """ Uses a thread to project stream data into pump-probe time scale.
+    def create_streamer(self):
+        """ Create the streamer, which acquires data from the ADC."""
+        self.streamer = FastScanStreamer(self.config,
+                                         on_data=self.on_streamer_data,
+                                         on_frame=functools.partial(self.on_streamer_frame, self.frame_pool),
+                                         on_error=self.on_error,
+                                         on_finished=self.on_streamer_finished)
+        if self.config.stream_queue_policy == 'block':
+            self.stream_slots = threading.Semaphore(self.config.stream_queue_size)
+        else:
+            self.stream_slots = None
+        self.streamer.backpressure = self.stream_slots
+        self.streamer.frame_pool = self.frame_pool
+        self.streamer.metrics = self.metrics
 
-        Launch a runnable thread from the pool to convert data from streamer
-        into the correct time scale.
+    def start(self, config=None):
+        """ Start the acquisition in the streamer thread.
 
         Args:
-            stream_data: np.array
-                data acquired by streamer.
+            config: FastScanConfig
+                settings of the acquisition. If None, they are read from
+                SETTINGS.ini.
         """
-        self.logger.debug('Projecting data with shape {}'.format(stream_data.shape))
-        runnable = Runnable(projector,
-                            stream_data=stream_data,
-                            spos_fit_pars=self.spos_fit_pars,
-                            use_dark_control=self.dark_control,
-                            adc_step=self.shaker_position_step,
-                            time_step=self.shaker_time_step,
-                            use_r0=self.use_r0,
-                            )
-
-        self.pool.start(runnable)
-        runnable.signals.result.connect(self.on_projector_data)
+        if self.streamer_running:
+            self.logger.warning('Acquisition already running')
+            return
+        if config is None:
+            config = FastScanConfig.from_settings()
+        if config.acquisition_mode == 'replay':  # frames must have the shape of the recording
+            n_samples = RawStreamFile(config.replay_file).n_samples
+            if n_samples != config.n_samples:
+                config = config.replace(n_samples=n_samples)
+        self.config = config
+        if self.averages is None:  # keep the grid of the data in memory
+            self.time_grid = None  # with fixed_time_grid, set from the first projected frame
+        shape = (len(FastScanStreamer.niChannel_order), config.n_samples)
+        n_slots = config.stream_queue_size + config.n_processors + 2  # queue, projectors and streamer
+        if config.processing_backend == 'processes':
+            self.start_process_pool(n_slots)
+            self.frame_pool = self.process_pool.frames
+        else:
+            self.stop_process_pool()
+            if self.thread_pool is None or self._n_threads != config.n_processors:
+                if self.thread_pool is not None:
+                    self.thread_pool.shutdown(wait=False)
+                self.thread_pool = ThreadPoolExecutor(max_workers=config.n_processors,
+                                                      thread_name_prefix='FastScanProjector')
+                self._n_threads = config.n_processors
+            if self.frame_pool is None or self.frame_pool.shape != (n_slots, *shape):
+                self.frame_pool = FramePool(n_slots, *shape)
+        self.create_streamer()
+        self.streamer_running = True
+        self.streamer_thread = threading.Thread(target=self.streamer.start_acquisition, name='FastScanStreamer',
+                                                daemon=True)
+        self.streamer_thread.start()
+        self.logger.info('FastScanStreamer started')
+        self.logger.debug('streamer settings: {}'.format(config))
 
-    def fit_autocorrelation(self, da):
-        """ Uses a thread to fit the autocorrelation function to the projected data."""
-        runnable = Runnable(fit_autocorrelation, da, expected_pulse_duration=.1)
-        self.pool.start(runnable)
-        # runnable.signals.result.connect(self.on_fit_result)
-        runnable.signals.result.connect(self.newFitResult.emit)
+    def stop(self):
+        """ Ask the streamer to stop. Returns at once, see join."""
+        if self.streamer is not None:
+            self.streamer.stop_acquisition()
 
-    def calibrate_shaker(self, iterations, integration):
+    def join(self, timeout=None):
+        """ Wait for the acquisition to end and the queued frames to be projected.
+
+        Returns:
+            False if timeout, in seconds, expired before, else True.
         """
-        Shaker calibration method.
+        t_end = None if timeout is None else time.time() + timeout
+        if self.streamer_thread is not None:
+            self.streamer_thread.join(timeout)
+        with self._changed:
+            while self.streamer_running or self.n_pending > 0:
+                if t_end is not None and time.time() > t_end:
+                    return False
+                self._changed.wait(.1)
+        return True
+
+    def wait_frames(self, n=None, timeout=None):
+        """ Wait until n frames have been projected since the last reset_data.
 
-        TODO: add description of shakercalib method.
         Args:
-            iterations:
-                number of full time scales to acquire.
-            integration:
-                number of shaker cycles to integrate on for each iteration.
+            n: int
+                number of frames. Defaults to n_averages.
+            timeout: float | None
+                maximum waiting time, in s.
         Returns:
-            plots the result of the calibration. Prints output result.
-
+            True if n frames were projected, False if the acquisition ended
+            or timeout expired before.
         """
-        assert not self.streamerRunning, 'Cannot run Shaker calibration while streamer is running'
-
-        import matplotlib.pyplot as plt
-        from scipy.optimize import curve_fit
+        n = self.config.n_averages if n is None else n
+        t_end = None if timeout is None else time.time() + timeout
+        with self._changed:
+            while self.n_projected < n:
+                if not self.streamer_running and self.n_pending == 0:
+                    return False
+                if t_end is not None and time.time() > t_end:
+                    return False
+                self._changed.wait(.1)
+        return True
+
+    def on_streamer_finished(self):
+        """ Called from the streamer thread when the acquisition loop has ended."""
+        self.logger.debug('streamer finished')
+        with self._changed:
+            self.streamer_running = False
+            self._changed.notify_all()
+        self.notify('finished')
+
+    def on_error(self, e):
+        with self._changed:
+            self._changed.notify_all()
+        self.notify('error', e)
+
+    def start_process_pool(self, n_slots=None):
+        """ Start the projector processes, unless they already run with the
+        current frame shape."""
+        shape = (len(FastScanStreamer.niChannel_order), self.config.n_samples)
+        if self.process_pool is not None:
+            if self.process_pool.shape == shape and n_slots in (None, self.process_pool.frames.n_slots):
+                return
+            self.stop_process_pool()
+        self.process_pool = ProjectorProcessPool(self.config.n_processors, *shape, n_slots=n_slots,
+                                                 on_result=self._on_pool_result,
+                                                 on_error=self._on_pool_error)
+
+    def stop_process_pool(self):
+        """ Stop the projector processes, if running."""
+        if self.process_pool is not None:
+            self.process_pool.shutdown()
+            self.process_pool = None
+
+    # processing
+
+    def on_streamer_frame(self, frame_pool, slot):
+        """ Handle streamer data acquired in a slot of its frame pool."""
+        self.on_streamer_data(frame_pool.view(slot), frame_pool, slot)
+
+    def on_streamer_data(self, streamer_data, frame_pool=None, slot=None):
+        """ Handle a frame from the streamer.
+
+        This updates the running average of raw data (streamer data) and adds
+        the data to the stream queue, ready to be projected.
+
+        If the queue is full, the oldest or the newest frame is dropped,
+        depending on stream_queue_policy. With the 'block' policy the
+        streamer waits instead, so the queue never overflows.
+
+        Frames from a frame pool are queued without copy, and their slot is
+        released once projected or dropped. The 'stream' callbacks, which may
+        use the frame later, as the GUI plotting it, get a copy.
+        """
+        if self._callbacks['stream']:
+            self.notify('stream', streamer_data.copy())
+        file_stream = self.file_stream  # outside the lock, so the writer can never stall the acquisition
+        if file_stream is not None and not file_stream.add_raw(streamer_data):
+            self.metrics.count('file_frames_dropped')
+        with self._lock:
+            if len(self.__stream_queue) >= self.config.stream_queue_size:
+                policy = self.config.stream_queue_policy
+                if policy == 'drop_newest':
+                    self.n_dropped += 1
+                    self.metrics.count('frames_dropped')
+                    self.release_frame(frame_pool, slot)
+                    self.logger.debug('stream queue full: dropped newest frame')
+                    return
+                elif policy == 'drop_oldest':
+                    self.release_frame(*self.__stream_queue.popleft()[:2])
+                    self.n_dropped += 1
+                    self.metrics.count('frames_dropped')
+                    self.logger.debug('stream queue full: dropped oldest frame')
+
+            if self.streamer_average is None:
+                self.streamer_average = streamer_data.copy()  # streamer_data is reused by the streamer
+                self.n_streamer_averages = 1
+            else:
+                self.n_streamer_averages += 1
+                self.streamer_average = update_average(streamer_data, self.streamer_average,
+                                                       self.n_streamer_averages)
 
-        # self.start_streamer()
-        write_setting(0, 'fastscan - simulation', 'center_position')
+            self.__stream_queue.append((frame_pool, slot, streamer_data, time.perf_counter()))
+            self.logger.debug('added data to stream queue, with shape {}'.format(streamer_data.shape))
+            self.dispatch_frames()
 
-        self.create_streamer()
+    def dispatch_frames(self):
+        """ Start projecting queued streamer data while projectors are free.
 
-        # stream = self.streamer.simulate_single_shot(integration)
-        stream = self.streamer.measure_single_shot(integration)
-
-        projected = project(stream, self.dark_control,
-                            self.shaker_position_step, 0.05)
-        min_ = projected.time.min()
-        max_ = projected.time.max()
-        print('\n - ')
-        calib_positions_ = np.linspace(min_ * .7, max_ * .7, iterations // 2)
-        calib_positions = np.concatenate((calib_positions_, calib_positions_[::-1]))
-        centers = []
-        # np.random.shuffle(calib_positions)
-        for pos in calib_positions:
-            print('\n - moving stage')
-
-            self.delay_stage.move_absolute(pos)
-            if parse_setting('fastscan', 'simulate'):
-                write_setting(pos, 'fastscan - simulation', 'center_position')
-
-            # stream = self.streamer.simulate_single_shot(integration)
-            stream = self.streamer.measure_single_shot(integration)
-            projected = project(stream, self.dark_control,
-                                self.shaker_position_step, 1)
-            res = fit_autocorrelation(projected)
-            print('\n - fitted, result it: {}'.format(res['popt'][1]))
-            centers.append(res['popt'][1])
-            # plt.plot(projected)
-        # plt.show()
-
-        steps = []
-        calib_steps = []
-        print('\n - calculating shift')
-
-        for i in range(len(centers) - 1):
-            dy = np.abs(centers[i] - centers[i + 1])
-            dx = np.abs(calib_positions[i] - calib_positions[i + 1])
-            if dx != 0:
-                steps.append(dy / dx)
-
-        mean = np.mean(steps)
-        std = np.std(steps)
-        good_steps = [x for x in steps if (np.abs(x - mean) < 2 * std)]
-
-        # correction_factor = np.mean(calib_steps)/np.mean(steps)
-
-        # write_setting('fastscan', 'shaker_ps_per_step', pos)
-        print('\n\n Shaker Calibration result: {} or {}'.format(1. / np.mean(steps), 1. / np.mean(good_steps)))
-
-        def lin(x, a, b):
-            return a * x + b
-
-        # plt.plot(calib_positions, centers, 'ob')
-
-        # try:
-        popt_, pcov_ = curve_fit(lin, centers, calib_positions)
-
-        cpos_fit = lin(np.array(centers), *popt_)
-        calib_pos_good = []
-        centers_good = []
-        for i in range(len(centers)):
-            std = np.std(calib_positions - cpos_fit)
-            if np.abs(calib_positions[i] - cpos_fit[i]) < 1.2 * std:
-                calib_pos_good.append(calib_positions[i])
-                centers_good.append(centers[i])
-        popt, pcov = curve_fit(lin, centers_good, calib_pos_good)
-
-        plt.plot(centers, calib_positions, 'o')
-        plt.plot(centers_good, calib_pos_good, '.')
-        x = np.linspace(min(centers), max(centers), 100)
-        plt.plot(x, lin(x, *popt))
-        # except:
-        #     pass
-        print('\n\n Shaker Calibration result:  {} | {}'.format(np.mean(good_steps), popt[0]))
-
-        plt.show()
-
-    @QtCore.pyqtSlot()
-    def on_timer(self):
-        """ Timer event.
-
-        This is used for multiple purpouses:
-         - to stop threads when they are supposed to
-         - to end an acqusition which has finite number of iterations
-         - to increase the counter for 'wait' function
-         - maybe other stuff too...
+        Called whenever new streamer data arrives and whenever a projection
+        finishes, so no polling is needed.
         """
-        if self.should_stop:
-            self.logger.debug('no data in queue, killing streamer')
-            self.streamer_thread.exit()
-            self.should_stop = False
-            self.streamerRunning = False
-        try:
-            if not self.__stream_queue.empty():
-                _to_project = self.__stream_queue.get()
-                self.start_projector(_to_project)
-
+        with self._lock:
+            while self.__stream_queue and self.projector_available:
+                frame_pool, slot, _to_project, t_queued = self.__stream_queue.popleft()
+                if not self.start_projector(_to_project, frame_pool, slot):
+                    self.__stream_queue.appendleft((frame_pool, slot, _to_project, t_queued))
+                    break
+                self.metrics.record('queue_wait', time.perf_counter() - t_queued)
+                if self.stream_slots is not None:
+                    self.stream_slots.release()
                 self.logger.debug('got stream from queue: {} elements remaining'.format(self.stream_qsize))
-        except Exception as e:
-            self.logger.debug('Queue error: {}'.format(e))
-
-        try:
-            self.qsize = self.__stream_queue.qsize()
-        except:
-            self.qsize = -1
-        # self.start_projector(_to_project)
 
-
-        try:
-            # print(self.all_curves.shape[0], self.n_averages, self.all_curves.shape[0]==self.n_averages, self.recording_iteration)
-            if self.all_curves.shape[0] == self.n_averages and self.recording_iteration:
-                self.logger.info('n of averages reached: ending iteration step')
-                self.end_iteration_step()
-        except AttributeError as e:
-            pass
-            # print(e)
-        self.counter += 1
-
-    def wait(self, n, timeout=1000):
-        """ Gui safe waiting function.
+    def start_projector(self, stream_data, frame_pool=None, slot=None):
+        """ Project stream data into pump-probe time scale, in a worker.
 
         Args:
-            n: int
-                number of clock cycles to wait
-            timeout: int
-                number of clock cycles after which the waiting will be terminated
-                notwithstanding n.
-        """
-        self.counter = 0
-        i = 0
-        while self.counter < n:
-            i += 1
-            if i > timeout:
-                break
-
-    def create_streamer(self):
-        """ Generate the streamer thread.
+            stream_data: np.array
+                data acquired by streamer.
+            frame_pool: FramePool
+                pool holding stream_data, if any. The slot is released once
+                the frame has been projected.
+            slot: int
+                slot of frame_pool holding stream_data.
 
-        This creates the thread which will acquire data from the ADC.
+        Returns:
+            False if the frame could not be submitted, else True.
         """
-        self.streamer_thread = QtCore.QThread()
-
-        self.streamer = FastScanStreamer()
-        self.streamer.newData[np.ndarray].connect(self.on_streamer_data)
-        self.streamer.error.connect(self.error.emit)
-        # self.streamer.finished.connect(self.on_streamer_finished)
-        self.streamer.moveToThread(self.streamer_thread)
-        self.streamer_thread.started.connect(self.streamer.start_acquisition)
-
-    @QtCore.pyqtSlot()
-    def start_streamer(self):
-        """ Start the acquisition by starting the streamer thread"""
-        self.should_stop = False
-        self.streamerRunning = True
-        self.create_streamer()
-        self.streamer_thread.start()
-        self.logger.info('FastScanStreamer started')
-        self.logger.debug('streamer settings: {}'.format(parse_category('fastscan')))
+        self.logger.debug('Projecting data with shape {}'.format(stream_data.shape))
+        kwargs = dict(spos_fit_pars=self.spos_fit_pars,
+                      time_grid=self.time_grid,
+                      config=self.config,
+                      )
+        if self.process_pool is not None:
+            if slot is not None and frame_pool is self.process_pool.frames:
+                self.process_pool.submit_slot(slot, **kwargs)  # released by the pool
+            elif self.process_pool.submit(stream_data, **kwargs):
+                self.release_frame(frame_pool, slot)
+            else:
+                return False
+            self.n_projecting += 1
+            return True
 
-    @QtCore.pyqtSlot()
-    def stop_streamer(self):
-        """ Stop the acquisition thread."""
-        self.logger.debug('\n\nFastScan Streamer is stopping.\n\n')
-        self.streamer.stop_acquisition()
-        self.should_stop = True
+        self.n_projecting += 1
+        self.thread_pool.submit(self._project, stream_data, frame_pool, slot, kwargs)
+        return True
 
-    @QtCore.pyqtSlot(np.ndarray)
-    def on_streamer_data(self, streamer_data):
-        """ Slot to handle streamer data.
+    def _project(self, stream_data, frame_pool, slot, kwargs):
+        """ Body of the projector threads."""
+        try:
+            try:
+                result = projector(stream_data, **kwargs)
+            finally:
+                self.release_frame(frame_pool, slot)
+            self.on_projector_data(result)
+        except Exception as e:
+            self.logger.warning('Projection failed:\n{}'.format(traceback.format_exc()))
+            self.notify('error', e)
+        finally:
+            self._projection_done()
 
-        Upon recieving streamer data from the streamer thread, this updates the
-        running average of raw data (streamer data) and adds the data to the
-        streamer data queue, ready to be processed by a processor thread.
-        """
-        self.newStreamerData.emit(streamer_data)
-        if self.streamer_average is None:
-            self.streamer_average = streamer_data
-            self.n_streamer_averages = 1
-        else:
-            self.n_streamer_averages += 1
-            self.streamer_average = update_average(streamer_data, self.streamer_average, self.n_streamer_averages)
+    def _on_pool_result(self, result):
+        """ Result callback of the process pool."""
+        try:
+            self.on_projector_data(result)
+        finally:
+            self._projection_done()
 
-        self.__stream_queue.put(streamer_data)
-        self.logger.debug('added data to stream queue, with shape {}'.format(streamer_data.shape))
-        # _to_project = self.__stream_queue.get()
-        # print('got stream from queue: {}'.format(_to_project.shape))
-        # self.start_projector(_to_project)
+    def _on_pool_error(self, e):
+        """ Error callback of the process pool, for a frame which failed."""
+        try:
+            self.on_error(e)
+        finally:
+            self._projection_done()
 
-    @QtCore.pyqtSlot(tuple)#xr.DataArray, list)
-    def on_projector_data(self, processed_dataarray_tuple):
-        """ Slot to handle processed data.
+    def _projection_done(self):
+        """ Count a projected frame as done, once its result was handled.
 
-        Processed data is first emitted to the main window for plotting etc...
-        Then, the running average of the pump-probe data is updated, and also
-        emitted. Finally, if the option 'self._calculate_autocorrelation' is on,
-        it launches the thread to calculate the autocorrelation function.
+        Only then join and wait_frames may return, so that the last frame is
+        in the running average. Then the next queued frame is dispatched.
+        """
+        with self._changed:
+            self.n_projecting -= 1
+            self._changed.notify_all()
+        self.dispatch_frames()
 
-        This emits data to the main window, so it can be plotted..."""
-        processed_dataarray, spos_fit_pars = processed_dataarray_tuple
+    @staticmethod
+    def release_frame(frame_pool, slot):
+        """ Give a streamer frame back to its pool, if it came from one."""
+        if slot is not None:
+            frame_pool.release(slot)
 
-        self.newProcessedData.emit(processed_dataarray)
-        self.spos_fit_pars = spos_fit_pars
-        t0 = time.time()
-        if self.all_curves is None:
-            self.all_curves = processed_dataarray
-            self.running_average = processed_dataarray.dropna('time')
+    def on_projector_data(self, processed_dataarray_tuple):
+        """ Handle a projected frame.
 
+        The projected curve is passed to the 'projected' callbacks. Then, the
+        running average of the pump-probe data is updated, and passed to the
+        'average' callbacks. Finally, if calculate_autocorrelation is on, the
+        autocorrelation function is fitted to the average.
+        """
+        processed_dataarray, spos_fit_pars, fit_time, fit_residual = processed_dataarray_tuple
+        self.logger.debug('shaker position fit in {:.2f} ms, residual {:.2E}'.format(fit_time * 1000, fit_residual))
+        self.metrics.record('sine_fit', fit_time)
+        if 'project_time' in processed_dataarray.attrs:
+            self.metrics.record('binning', processed_dataarray.attrs['project_time'])
+        self.metrics.count('frames_projected')
+        n_outside = processed_dataarray.attrs.get('n_outside', 0)
+        if n_outside:
+            self.metrics.count('samples_outside_grid', n_outside)
+            self.logger.debug('{} samples outside the fixed time grid'.format(n_outside))
+
+        if 'counts' in processed_dataarray.coords:  # fixed time grid: empty bins are NaN
+            self.notify('projected', processed_dataarray.dropna('time'))
         else:
-            self.all_curves = xr.concat([self.all_curves[-self.n_averages + 1:], processed_dataarray], 'avg')
-            self.running_average = self.all_curves.mean('avg').dropna('time')
-
-        self.newAverage.emit(self.running_average)
+            self.notify('projected', processed_dataarray)
+
+        with self._changed:
+            self.spos_fit_pars = spos_fit_pars
+            if self.time_grid is None and 'counts' in processed_dataarray.coords:  # use the grid of the first frame
+                time_axis = processed_dataarray.time.values
+                self.time_grid = (int(np.rint(time_axis[0] / self.config.shaker_time_step)), len(time_axis))
+            if self.averages is None:
+                self.averages = RunningAverage(self.config.n_averages, self.config.shaker_time_step)
+            self.averages.n_averages = self.config.n_averages
+            with self.metrics.timer('averaging'):
+                self.averages.add(processed_dataarray)
+                self.running_average = running_average = self.averages.average
+
+            self.n_projected += 1
+            if self.n_projected % 100 == 0:
+                t = time.time()
+                self.logger.info('Projection throughput: {:.2f} frames/s with {} backend'.format(
+                    100 / (t - self._throughput_t0), self.config.processing_backend))
+                self._throughput_t0 = t
+            self._changed.notify_all()
+
+        file_stream = self.file_stream
+        if file_stream is not None and not file_stream.add_frame(processed_dataarray, spos_fit_pars):
+            self.metrics.count('file_frames_dropped')
+
+        self.notify('average', running_average)
+        self.emit_metrics()
+
+        if self.calculate_autocorrelation:
+            self.fit_autocorrelation(running_average)
 
-        self.logger.debug('calculated average in {:.2f} ms'.format((time.time() - t0) * 1000))
+    def fit_autocorrelation(self, da):
+        """ Fit the autocorrelation function to da in a thread.
+
+        At most one fit runs at a time: a curve arriving while fitting
+        replaces the one waiting, if any, so only the latest is fitted. The
+        result is passed to the 'fit' callbacks, unless the curve did not
+        change enough since the last fit, see AutocorrelationFitter."""
+        with self._lock:
+            if self._fit_pending is not None:
+                self.metrics.count('fits_dropped')
+            self._fit_pending = da
+            if self._fit_running:
+                return
+            self._fit_running = True
+        self._fit_pool.submit(self._fit_autocorrelation)
+
+    def _fit_autocorrelation(self):
+        while True:
+            with self._lock:
+                da, self._fit_pending = self._fit_pending, None
+                if da is None:
+                    self._fit_running = False
+                    return
+            try:
+                with self.metrics.timer('fitting'):
+                    result = self.fitter.fit(da)
+            except Exception as e:
+                self.logger.warning('Autocorrelation fit failed: {}'.format(e))
+                self.notify('error', e)
+            else:
+                if result['cached']:
+                    self.metrics.count('fits_skipped')
+                else:
+                    self.notify('fit', result)
 
-        if self._calculate_autocorrelation:
-            self.fit_autocorrelation(self.running_average)
+    def fit_all_curves(self, model='sech2', n_processes=None):
+        """ Fit each single curve in the running average, see fit_autocorrelation_batch.
 
-    @QtCore.pyqtSlot(dict)
-    def on_fit_result(self, fitDict):
-        """ Slot to bounce the fit result signal."""
-        self.newFitResult.emit(fitDict)
+        Returns:
+            dict of popt, pcov, perr and converged arrays, one row per curve,
+            oldest first. None if no data was acquired.
+        """
+        curves = self.all_curves
+        if curves is None:
+            return None
+        with self.metrics.timer('batch_fitting'):
+            return fit_autocorrelation_batch(curves, model=model, n_processes=n_processes)
+
+    def emit_metrics(self, force=False):
+        """ Pass a metrics snapshot to the 'metrics' callbacks, unless one was
+        passed less than metrics_interval ago."""
+        t = time.time()
+        if force or t - self._metrics_t >= self.metrics_interval:
+            self._metrics_t = t
+            self.notify('metrics', self.metrics.snapshot())
+
+    # data
 
-    @QtCore.pyqtSlot()
     def reset_data(self):
-        """ Reset the data in memory, by reinitializing all data containers.
-        """
-        # TODO: add popup check window
-        self.running_average = None
-        self.all_curves = None
-        self.n_streamer_averages = None
-        self.streamer_average = None
+        """ Reset the data in memory, by reinitializing all data containers."""
+        with self._lock:
+            self.running_average = None
+            self.averages = None
+            self.n_streamer_averages = None
+            self.streamer_average = None
+            self.n_dropped = 0
+            self.n_projected = 0
+            self.fitter.reset()
+            self.metrics.reset()
 
     def save_data(self, filename, all_data=True):
         """ Save data contained in memory.
@@ -408,107 +683,151 @@ class FastScanThreadManager(QtCore.QObject):
             all_data:
                 if True, saves all projected data for each shaker loop measured,
                 otherwise only saves the avereage curve.
-        Returns:
-
         """
         if not '.h5' in filename:
             filename += '.h5'
 
-        if self.streamer_average is not None:
-
-            with h5py.File(filename, 'w') as f:
-
-                f.create_dataset('/raw/avg', data=self.streamer_average)
-                if all_data:
-                    f.create_dataset('/all_data/data', data=self.all_curves.values)
-                    f.create_dataset('/all_data/time_axis', data=self.all_curves.time)
-                f.create_dataset('/avg/data', data=self.running_average.values)
-                f.create_dataset('/avg/time_axis', data=self.running_average.time)
-
-                for k, v in parse_category('fastscan').items():
-                    if isinstance(v, bool):
-                        f.create_dataset('/settings/{}'.format(k), data=v, dtype=bool)
-                    else:
-                        f.create_dataset('/settings/{}'.format(k), data=v)
-
-
-        else:
-            self.logger.info('no data to save yet...')
-            # f.create_group('/settings')
+        with self._lock:  # take a consistent copy, and write it without blocking the acquisition
+            if self.streamer_average is None:
+                self.logger.info('no data to save yet...')
+                return
+            streamer_average = self.streamer_average.copy()
+            running_average = self.running_average
+            all_curves = self.all_curves if all_data else None
+            config = self.config
+            configs = dict(self.configs)
+
+        import h5py
+        with h5py.File(filename, 'w') as f:
+            f.create_dataset('/raw/avg', data=streamer_average)
+            if all_curves is not None:
+                f.create_dataset('/all_data/data', data=all_curves.values)
+                f.create_dataset('/all_data/time_axis', data=all_curves.time)
+                f.create_dataset('/all_data/config_version', data=all_curves.config_version)
+            f.create_dataset('/avg/data', data=running_average.values)
+            f.create_dataset('/avg/time_axis', data=running_average.time)
+
+            settings_to_hdf(f, '/settings', config.as_dict())
+            if all_curves is not None:
+                for version in np.unique(all_curves.config_version.values):
+                    version_config = configs.get(int(version))
+                    if version_config is not None:  # settings of each acquisition that produced the curves
+                        settings_to_hdf(f, '/configs/{}'.format(version), version_config.as_dict())
+
+    def start_file_stream(self, filename, raw=False, compression='gzip'):
+        """ Save every frame to file during acquisition.
+
+        Projected curves, and optionally the raw streams, are appended to an
+        HDF5 file from a background thread as they arrive, see H5StreamWriter.
+        Recording goes on, across acquisitions, until stop_file_stream.
 
-    def start_iterative_measurement(self, temperatures, savename):
-        """ Starts a temperature dependence scan series.
+        Args:
+            filename: path
+                path and file name of the h5 file. Adds .h5 extension if
+                missing. Frames are appended if the file exists.
+            raw: bool
+                if True, also save the raw streams.
+            compression: str | None
+                compression filter of the h5 datasets.
+        """
+        from measurement.h5stream import H5StreamWriter
+        self.stop_file_stream()
+        raw_shape = (len(FastScanStreamer.niChannel_order), self.config.n_samples) if raw else None
+        file_stream = H5StreamWriter(filename, raw_shape=raw_shape, compression=compression,
+                                     on_error=self.on_error)
+        file_stream.add_config(self.config)
+        with self._lock:
+            self.file_stream = file_stream
+
+    def stop_file_stream(self):
+        """ Write the remaining frames and close the stream file, if any."""
+        with self._lock:
+            file_stream, self.file_stream = self.file_stream, None
+        if file_stream is not None:
+            file_stream.close()
+
+    # temperature series
+
+    def measure_temperature_series(self, temperatures, savename, n_frames=None, tolerance=.1, config=None):
+        """ Measure and save a data set at each temperature.
+
+        For each temperature, waits for the cryostat to be stable, then
+        acquires n_frames frames from a clean state and saves them. Blocks
+        until the series is complete, so it is run from a script or a worker
+        thread. Stopping the acquisition aborts the series.
 
         Args:
             temperatures: list of float
                 list of temperatures at which to perform measurements.
             savename:
                 base name of the save file (and path) to which temperature info
-                will be appended. ex: c:\path\to\scan_folder\filename_T004,3K.h5
+                will be appended. ex: c:\\path\\to\\scan_folder\\filename_T004,3K.h5
+            n_frames: int
+                number of frames to acquire at each temperature. Defaults to
+                n_averages.
+            tolerance: float
+                temperature stability required before measuring, in K.
+            config: FastScanConfig
+                settings of the acquisitions. If None, they are read from
+                SETTINGS.ini at each temperature.
+        Returns:
+            list of the saved file names.
         """
-        assert True
-        self.temperatures = temperatures
-        self.iterative_measurement_name = savename
-        # self.start_streamer()
-        # self.wait(1000)
-        # self.save_data(savename) #TODO: remove
-        # self.stop_streamer()
-        # self.reset_data()
         self.logger.info('starting measurement loop')
-        self.current_iteration = 0
-        # self.stop_streamer()
+        saved = []
+        for i, temperature in enumerate(temperatures):
+            self.current_iteration = i
+            self.cryo.connect()
+            self.logger.info('Connected to Cryostat: setting temperature....')
+            self.cryo.set_temperature(temperature)
+            self.cryo.check_temp(tolerance=tolerance, sleep_time=1)
+            self.cryo.disconnect()
+            self.logger.info('Temperature stable, measuring interation {}, {}K'.format(i, temperature))
+
+            self.stop()
+            self.join()
+            self.reset_data()
+            self.start(config)
+            complete = self.wait_frames(n_frames)
+            self.stop()
+            self.join()
+            if not complete:
+                self.logger.warning('Acquisition stopped at iteration {}: aborting measurement loop'.format(i))
+                break
+            temp_string = '_{:0.2f}K'.format(float(temperature)).replace('.', ',')
+            self.save_data(savename + temp_string)
+            saved.append(savename + temp_string + '.h5')
+            self.logger.info('Iteration {} complete. Saved data as {}'.format(i, savename + temp_string))
+        else:
+            self.logger.info('Iterative mesasurement complete!!')
+        self.current_iteration = None
+        return saved
 
-        self.start_next_iteration()
+    def calibrate_shaker(self, n_points=20, integration=10, write=True):
+        """ Calibrate shaker_ps_per_step against the delay stage. Blocks until done.
 
-    @QtCore.pyqtSlot()
-    def start_next_iteration(self):
-        """
-        Initialize the next measurement iteration in the temperature dependence
-        scan series.
-        """
-        self.stop_streamer()
+        Progress and result are passed to the 'calibration_progress',
+        'calibration_point' and 'calibration' callbacks, see ShakerCalibration.
 
-        if self.current_iteration >= len(self.temperatures):
-            self.current_iteration = None
-            print('\n\n\n\nMEASUREMENT FINISHED\n\n\n')
-            self.logger.info('Iterative mesasurement complete!!')
-        else:
-            self.cryo.connect()
-            self.logger.info('Connected to Cryostat: setting temperature....')
-            self.cryo.set_temperature(self.temperatures[self.current_iteration])
-            runnable = Runnable(self.cryo.check_temp, tolerance=.1, sleep_time=1)
-            self.pool.start(runnable)
-            runnable.signals.finished.connect(self.measure_current_iteration)
-
-    @QtCore.pyqtSlot()
-    def measure_current_iteration(self):
-        """ Start the acquisition for the current measurement iteration."""
-        self.cryo.disconnect()
-        self.logger.info('Temperature stable, measuring interation {}, {}K'.format(self.current_iteration,
-                                                                                   self.temperatures[
-                                                                                       self.current_iteration]))
-        self.stop_streamer()
-        self.reset_data()
-        self.start_streamer()
-        self.recording_iteration = True
-
-    @QtCore.pyqtSlot()
-    def end_iteration_step(self):
-        """ Complete and finalize the current measurement iteration."""
-
-        self.logger.info('Stopping iteration')
-        self.recording_iteration = False
-
-        t = self.temperatures[self.current_iteration]
-        temp_string = '_{:0.2f}K'.format(float(t)).replace('.', ',')
-
-        savename = self.iterative_measurement_name+temp_string
-        self.logger.info('Iteration {} complete. Saved data as {}'.format(self.current_iteration,savename))
-        self.save_data(savename)
-
-        self.stop_streamer()
-        self.current_iteration += 1
-        self.start_next_iteration()
+        Args:
+            n_points: int
+                number of stage positions measured.
+            integration: int
+                number of shaker cycles averaged at each position.
+            write: bool
+                if True, store the result in the settings.
+        Returns:
+            dict of the calibration result, None if it failed or was stopped.
+        """
+        from measurement.shakercalibration import ShakerCalibration
+        if self.streamer_running:
+            raise RuntimeError('Cannot run the shaker calibration while the streamer is running')
+        self.calibration = ShakerCalibration(self.delay_stage, n_points, integration,
+                                             on_progress=functools.partial(self.notify, 'calibration_progress'),
+                                             on_point=functools.partial(self.notify, 'calibration_point'),
+                                             on_finished=functools.partial(self.notify, 'calibration'),
+                                             on_error=self.on_error)
+        return self.calibration.run(write)
 
     @staticmethod
     def check_temperature_stability(cryo, tolerance=.2, sleep_time=.1):
@@ -523,280 +842,337 @@ class FastScanThreadManager(QtCore.QObject):
                 diff = max([abs(x - cryo.temperature_target) for x in temp])
                 print(f'cryo stabilizing: delta={diff}')
 
-    @QtCore.pyqtSlot()
-    def close(self):
-        """ stop the streamer when closing this widget."""
-        self.stop_streamer()
+    def on_setting_changed(self, category, name, value):
+        """ Callback of settings updates.
 
-    ### Properties
+        Settings are otherwise only read when an acquisition starts. The
+        number of averages also applies to the running acquisition, with a
+        new config version.
+        """
+        if category == 'fastscan' and name == 'n_averages' and value != self.config.n_averages:
+            self.config = self.config.replace(n_averages=value)
+
+    def close(self, timeout=5):
+        """ Stop the acquisition and all workers."""
+        unsubscribe_settings(self.on_setting_changed)
+        self.stop()
+        if self.streamer_thread is not None:
+            self.streamer_thread.join(timeout)
+        self.stop_process_pool()
+        if self.thread_pool is not None:
+            self.thread_pool.shutdown(wait=True)
+            self.thread_pool = None
+        self._fit_pool.shutdown(wait=False)
+        self.stop_file_stream()
 
-    @property
-    def stream_qsize(self):
-        """ State of dark control. If True it's on."""
-        try:
-            val = self.__stream_queue.qsize()
-        except:
-            val = -1
-        return val
+    ### Properties
 
     @property
-    def dark_control(self):
-        """ State of dark control. If True it's on."""
-        return parse_setting('fastscan', 'dark_control')
+    def cryo(self):
+        """ Cryostat used by measure_temperature_series, connected on first use."""
+        if self._cryo is None:
+            from instruments.cryostat import ITC503s
+            self._cryo = ITC503s(parse_setting('instruments', 'cryostat_com'))
+        return self._cryo
 
-    @dark_control.setter
-    def dark_control(self, val):
-        assert isinstance(val, bool), 'dark control must be boolean.'
-        write_setting(val, 'fastscan', 'dark_control')
+    @cryo.setter
+    def cryo(self, cryo):
+        self._cryo = cryo
 
     @property
-    def use_r0(self):
-        """ Choose to output DR/R or DR. If True it's DR/R."""
-        return parse_setting('fastscan', 'use_r0')
-
-    @use_r0.setter
-    def use_r0(self, val):
-        assert isinstance(val, bool), 'use_r0 must be boolean.'
-        write_setting(val, 'fastscan', 'use_r0')
+    def all_curves(self):
+        """ DataArray of the curves in the running average, oldest first."""
+        if self.averages is None:
+            return None
+        return self.averages.curves
 
     @property
-    def n_processors(self):
-        """ Number of processors to use for workers."""
-        return parse_setting('fastscan', 'n_processors')
+    def config(self):
+        """ FastScanConfig of the current acquisition."""
+        return self._config
 
-    @n_processors.setter
-    def n_processors(self, val):
-        assert isinstance(val, int), 'dark control must be boolean.'
-        assert val < os.cpu_count(), 'Too many processors, cant be more than cpu count: {}'.format(os.cpu_count())
-        write_setting(val, 'fastscan', 'n_processors')
-        self.create_processors()
+    @config.setter
+    def config(self, config):
+        self._config = config
+        self.configs[config.version] = config
+        if self.file_stream is not None:
+            self.file_stream.add_config(config)
 
     @property
-    def n_averages(self):
-        """ Number of averages to keep in the running average memory."""
-        return parse_setting('fastscan', 'n_averages')
-
-    @n_averages.setter
-    def n_averages(self, val):
-        assert val > 0, 'cannot set below 1'
-        write_setting(val, 'fastscan', 'n_averages')
-        self._n_averages = val
-        self.logger.debug('n_averages set to {}'.format(val))
+    def stream_qsize(self):
+        """ Number of streamer frames waiting to be projected."""
+        return len(self.__stream_queue)
 
     @property
-    def n_samples(self):
-        """ Number of laser pulses to measure at each acquisition trigger pulse. """
-        return parse_setting('fastscan', 'n_samples')
-
-    @n_samples.setter
-    def n_samples(self, val):
-        assert val > 0, 'cannot set below 1'
-        write_setting(val, 'fastscan', 'n_samples')
-        self.logger.debug('n_samples set to {}'.format(val))
+    def n_pending(self):
+        """ Number of frames queued, being projected or being averaged."""
+        return self.stream_qsize + self.n_projecting
 
     @property
-    def shaker_gain(self):
-        """ Shaker position gain as in ScanDelay software."""
+    def projector_available(self):
+        """ False if all projector threads or processes are busy."""
+        if self.process_pool is not None:
+            return self.n_projecting < len(self.process_pool.processes)
+        return self.thread_pool is not None and self.n_projecting < self._n_threads
 
-        return parse_setting('fastscan', 'shaker_gain')
 
-    @shaker_gain.setter
-    def shaker_gain(self, val):
-        if isinstance(val, str): val = int(val)
-        assert val in [1, 10, 100], 'gain can be 1,10,100 only'
-        write_setting(val, 'fastscan', 'shaker_gain')
-        self.logger.debug('n_samples set to {}'.format(val))
-
-    @property
-    def shaker_position_step(self):
-        """ Shaker position ADC step size in v"""
-        return parse_setting('fastscan', 'shaker_position_step')
-
-    @property
-    def shaker_ps_per_step(self):
-        """ Shaker position ADC step size in ps"""
-        return parse_setting('fastscan', 'shaker_ps_per_step')
+# -----------------------------------------------------------------------------
+#       Running average
+# -----------------------------------------------------------------------------
 
-    @property
-    def shaker_time_step(self):
-        """ Shaker digital step in ps.
+class RunningAverage(object):
+    """ Running average of the last n_averages projected curves.
 
-        Takes into account ADC conversion and shaker gain to return the minimum
-        step between two points converted from the shaker analog position signal.
-        This also defines the time resolution of the measurement.
+    The curves are stored in a preallocated ring buffer, together with the
+    weight of each bin (the sample counts, with a fixed time grid, or 1 where
+    the curve is defined). The weighted sums over the buffer are updated
+    incrementally, so that adding a curve costs O(n_points) instead of
+    O(n_averages * n_points).
 
-        Returns: float
+    Curves do not need to share the same time axis, as long as their time
+    points lie on multiples of time_step. The buffer grows if a curve extends
+    beyond the positions seen so far.
+    """
 
-        """
-        return self.shaker_ps_per_step / self.shaker_gain
+    def __init__(self, n_averages, time_step):
+        self.time_step = time_step
+        self._n_averages = n_averages
+        self.pos_min = None
+        self.values = None  # ring buffer of the curves, shape (n_averages, n_bins)
+        self.weights = None
+        self.versions = np.full(n_averages, -1, dtype=np.int64)  # config version of each curve
+        self.sum = None  # sum of values*weights over the buffer
+        self.norm = None  # sum of weights over the buffer
+        self.index = 0  # slot of the next curve
+        self.n_frames = 0
 
     @property
-    def stage_position(self):
-        """ Position of the probe delay stage."""
-        return self.delay_stage.position_get()
+    def n_averages(self):
+        return self._n_averages
 
-    @stage_position.setter
-    def stage_position(self, val):
-        self.delay_stage.move_absolute(val)
+    @n_averages.setter
+    def n_averages(self, val):
+        """ Change the buffer length, keeping the most recent curves."""
+        if val == self._n_averages:
+            return
+        assert val > 0, 'cannot set below 1'
+        if self.values is not None:
+            order = self._order()[-val:]
+            values = np.full((val, self.values.shape[1]), np.nan)
+            weights = np.zeros_like(values)
+            values[:len(order)] = self.values[order]
+            weights[:len(order)] = self.weights[order]
+            versions = np.full(val, -1, dtype=np.int64)
+            versions[:len(order)] = self.versions[order]
+            self.values, self.weights, self.versions = values, weights, versions
+            self.n_frames = len(order)
+            self.index = self.n_frames % val
+            self._recalculate()
+        self._n_averages = val
 
+    @property
+    def shape(self):
+        if self.values is None:
+            return (0, 0)
+        return (self.n_frames, self.values.shape[1])
+
+    def _order(self):
+        """ Slots of the buffer in chronological order."""
+        if self.n_frames < self._n_averages:
+            return np.arange(self.n_frames)
+        return np.roll(np.arange(self._n_averages), -self.index)
+
+    def _recalculate(self):
+        """ Recompute the sums from the buffer, discarding rounding errors."""
+        self.sum = np.nansum(self.values * self.weights, axis=0)
+        self.norm = self.weights.sum(axis=0)
+
+    def _extend(self, pos_min, pos_max):
+        """ Extend the buffer to cover the positions in [pos_min, pos_max]."""
+        if self.values is None:
+            self.pos_min = pos_min
+            n_bins = pos_max - pos_min + 1
+            self.values = np.full((self._n_averages, n_bins), np.nan)
+            self.weights = np.zeros_like(self.values)
+            self.sum = np.zeros(n_bins)
+            self.norm = np.zeros(n_bins)
+            return
+        old_max = self.pos_min + self.values.shape[1] - 1
+        if pos_min >= self.pos_min and pos_max <= old_max:
+            return
+        new_min, new_max = min(pos_min, self.pos_min), max(pos_max, old_max)
+        start = self.pos_min - new_min
+        stop = start + self.values.shape[1]
+        values = np.full((self._n_averages, new_max - new_min + 1), np.nan)
+        weights = np.zeros_like(values)
+        values[:, start:stop] = self.values
+        weights[:, start:stop] = self.weights
+        self.values, self.weights, self.pos_min = values, weights, new_min
+        self._recalculate()
+
+    def add(self, da):
+        """ Add a projected curve to the running average.
 
-class RunnableSignals(QtCore.QObject):
-    """
-    Defines the signals available from a running worker thread.
-    Supported signals are:
-    finished
-        No data
-    error
-        `tuple` (exctype, value, traceback.format_exc() )
-    result
-        `object` data returned from processing, anything
-    progress
-        `int` indicating % progress
-    """
-    finished = QtCore.pyqtSignal()
-    error = QtCore.pyqtSignal(tuple)
-    result = QtCore.pyqtSignal(object)
-    progress = QtCore.pyqtSignal(int)
-
-
-class Runnable(QtCore.QRunnable):
-    '''
-    Worker thread
-    Inherits from QRunnable to handler worker thread setup, signals
-    and wrap-up.
-    :param callback: The function callback to run on this worker
-    :thread. Supplied args and
-    kwargs will be passed through to the runner.
-    :type callback: function
-    :param args: Arguments to pass to the callback function
-    :param kwargs: Keywords to pass to the callback function
-    :
-    '''
-
-    def __init__(self, fn, *args, **kwargs):
-        super(Runnable, self).__init__()
-        # Store constructor arguments (re-used for processing)
-        self.fn = fn
-        self.args = args
-        self.kwargs = kwargs
-        self.signals = RunnableSignals()
-        # Add the callback to our kwargs
-        # kwargs['progress_callback'] = self.signals.progress
-
-    @QtCore.pyqtSlot()
-    def run(self):
-        '''
-        Initialise the runner function with passed args, kwargs.
-        '''
-        # Retrieve args/kwargs here; and fire processing using them
-        try:
-            result = self.fn(*self.args, **self.kwargs)
-        except:
-            traceback.print_exc()
-            exctype, value = sys.exc_info()[:2]
-            self.signals.error.emit((exctype, value, traceback.format_exc()))
+        Args:
+            da: xr.DataArray
+                projected curve. If it has a 'counts' coordinate, this is used
+                as weight of each point. The 'config_version' attribute, if
+                any, is kept with the curve.
+        """
+        pos = np.rint(da.time.values / self.time_step).astype(np.int64)
+        values = np.asarray(da.values, dtype=np.float64)
+        if 'counts' in da.coords:
+            weights = np.asarray(da.counts.values, dtype=np.float64)
         else:
-            self.signals.result.emit(result)  # Return the result of the processing
-        finally:
-            self.signals.finished.emit()  # Done
-
+            weights = np.isfinite(values).astype(np.float64)
+        self._extend(pos[0], pos[-1])
 
-# -----------------------------------------------------------------------------
-#       Processor
-# -----------------------------------------------------------------------------
-# DEPRECATED:
-class FastScanProcessor(QtCore.QObject):
-    isReady = QtCore.pyqtSignal(int)
-    finished = QtCore.pyqtSignal()
-    newData = QtCore.pyqtSignal(xr.DataArray)
-    newFit = QtCore.pyqtSignal(dict)
-    error = QtCore.pyqtSignal(Exception)
-
-    def __init__(self, id):
-        super().__init__()
-        self.logger = logging.getLogger('{}.FastScanProcessor'.format(__name__))
-        self.logger.debug('Created FastScanProcessor: id={}'.format(id))
-        self.id = id
-
-    def initialize(self):
-        self.isReady.emit(self.id)
-
-    @QtCore.pyqtSlot()
-    def project(self, stream_data, use_dark_control=True):
-        """ project data from streamer format to 1d time trace
-
-        creates bins from digitizing the stage positions measured channel of the
-        stream data. Values from the signal channel are assigned to the corresponding
-        bin from the stage positions. if Dark Control is true, values where dc
-        is true are added, while where dark control is false, it is substracted.
-
-        :param stream_data:
-        :param use_dark_control:
-        :return:
-            xarray containing projected data and relative time scale.
+        slot = self.index
+        if self.n_frames == self._n_averages:  # remove the oldest curve
+            self.sum -= np.nan_to_num(self.values[slot] * self.weights[slot])
+            self.norm -= self.weights[slot]
+        else:
+            self.n_frames += 1
+        self.values[slot] = np.nan
+        self.weights[slot] = 0
+        idx = pos - self.pos_min
+        self.values[slot, idx] = values
+        self.weights[slot, idx] = weights
+        self.versions[slot] = da.attrs.get('config_version', -1)
+        self.sum[idx] += np.nan_to_num(values * weights)
+        self.norm[idx] += weights
+
+        self.index = (slot + 1) % self._n_averages
+        if self.index == 0:
+            self._recalculate()
 
-        """
-        time.sleep(5)
-        self.logger.debug('Processor ID:{} started processing data with shape {}'.format(self.id, stream_data.shape))
-        t0 = time.time()
-        adc_step = parse_setting('fastscan', 'shaker_position_step')
-        ps_per_step = parse_setting('fastscan', 'shaker_ps_per_step')  # ADC step size - corresponds to 25fs
-        ps_per_step *= parse_setting('fastscan', 'shaker_gain')  # correct for shaker gain factor
+    @property
+    def time(self):
+        return (self.pos_min + np.arange(self.values.shape[1])) * self.time_step
 
-        try:
-            result = project(stream_data, use_dark_control=use_dark_control,
-                             adc_step=adc_step, time_step=ps_per_step)
-            self.newData.emit(result)
+    @property
+    def average(self):
+        """ DataArray of the weighted average, without empty points."""
+        defined = self.norm > 0
+        return xr.DataArray(self.sum[defined] / self.norm[defined],
+                            coords={'time': self.time[defined]}, dims='time')
 
-            self.logger.debug('Projected {} points to a {} pts array, with {} nans in : {:.2f} ms'.format(
-                stream_data.shape[1], result.shape,
-                len(result) - len(result[np.isfinite(result)]),
-                1000 * (time.time() - t0)))
+    @property
+    def curves(self):
+        """ DataArray of all curves in the buffer, oldest first.
 
-        except Exception as e:
-            self.logger.warning(
-                'failed to project stream_data.\nERROR: {}'.format(e))
-            self.error.emit(e)
+        The 'config_version' coordinate gives the FastScanConfig version of
+        each curve, -1 if unknown.
+        """
+        order = self._order()
+        return xr.DataArray(self.values[order],
+                            coords={'time': self.time, 'config_version': ('avg', self.versions[order])},
+                            dims=('avg', 'time'))
 
-        time.sleep(0.002)
-        self.isReady.emit(self.id)
-        self.logger.debug('Processor ID:{} is ready for new stream_data'.format(self.id))
 
-    @QtCore.pyqtSlot()
-    def fit_sech2(self, da):
+AUTOCORRELATION_MODELS = {'sech2': (sech2_fwhm, sech2_fwhm_jac),
+                          'gaussian': (gaussian_fwhm, gaussian_fwhm_jac),
+                          }
 
-        try:
-            fitDict = fit_autocorrelation(da)
-            self.newFit.emit(fitDict)
-        except RuntimeError as e:
-            self.logger.critical('Fitting failed: Runtime error: {}'.format(e))
-        except Exception as e:
-            self.logger.critical('Fitting failed: {}'.format(e))
 
+def fit_autocorrelation(da, expected_pulse_duration=.1, p0=None, model='sech2'):
+    """ fits the given data to a sech2 pulse shape
 
-def fit_autocorrelation(da, expected_pulse_duration=.1):
-    """ fits the given data to a sech2 pulse shape"""
+    Args:
+        da: xr.DataArray
+            autocorrelation curve, with 'time' dimension.
+        expected_pulse_duration: float
+            initial guess of the fwhm, used if p0 is None.
+        p0: list | None
+            initial parameters [A, x0, fwhm, c], for example the result of
+            the previous fit. If None, they are estimated from the data.
+        model: str
+            'sech2' or 'gaussian', fitted with its analytic jacobian.
+    """
+    from scipy.optimize import curve_fit
+    function, jac = AUTOCORRELATION_MODELS[model]
     da_ = da.dropna('time')
+    x, y = da_.time.values, da_.values
 
-    xc = da_.time[np.argmax(da_.values)]
-    off = da_[da_.time - xc > .2].mean()
-    a = da_.max() - off
-
-    guess = [a, xc, expected_pulse_duration, off]
+    if p0 is None:
+        xc = x[np.argmax(y)]
+        tail = y[x - xc > .2]
+        off = tail.mean() if len(tail) else y.min()
+        p0 = [y.max() - off, xc, expected_pulse_duration, off]
     try:
-        popt, pcov = curve_fit(sech2_fwhm, da_.time, da_, p0=guess)
+        popt, pcov = curve_fit(function, x, y, p0=p0, jac=jac)
     except RuntimeError:
-        popt, pcov = [0, 0, 0, 0], np.zeros((4, 4))
+        popt, pcov = np.zeros(4), np.zeros((4, 4))
     fitDict = {'popt': popt,
                'pcov': pcov,
                'perr': np.sqrt(np.diag(pcov)),
-               'curve': xr.DataArray(sech2_fwhm(da_.time, *popt), coords={'time': da_.time}, dims='time')
+               'curve': xr.DataArray(function(x, *popt), coords={'time': x}, dims='time')
                }
     return fitDict
 
 
+class AutocorrelationFitter(object):
+    """ Repeated autocorrelation fits of a slowly changing curve.
+
+    Each fit starts from the parameters of the previous one, and falls back
+    to a fit from scratch if that does not converge. If the curve changed by
+    less than tolerance since the last fit, relative to its peak to peak
+    amplitude, the last result is returned again, with 'cached' set to True.
+    """
+
+    def __init__(self, model='sech2', expected_pulse_duration=.1, tolerance=1e-3):
+        self.logger = logging.getLogger('{}.AutocorrelationFitter'.format(__name__))
+        if model not in AUTOCORRELATION_MODELS:
+            raise ValueError('Unknown model {}, must be one of {}'.format(model, ', '.join(AUTOCORRELATION_MODELS)))
+        self.model = model
+        self.expected_pulse_duration = expected_pulse_duration
+        self.tolerance = tolerance
+        self.reset()
+
+    def reset(self):
+        """ Forget the last fit, so the next one starts from scratch."""
+        self.result = None
+        self._time = None
+        self._values = None
+
+    def changed(self, da):
+        """ True if da differs from the last fitted curve by more than tolerance."""
+        if self.result is None or not np.array_equal(self._time, da.time.values):
+            return True
+        values = da.values
+        defined = np.isfinite(values) & np.isfinite(self._values)
+        if not defined.any():
+            return True
+        diff = values[defined] - self._values[defined]
+        scale = np.ptp(values[defined]) or 1.
+        return np.sqrt(np.mean(diff ** 2)) / scale > self.tolerance
+
+    def fit(self, da):
+        """ Fit da, or return the last result if it did not change enough.
+
+        Returns:
+            dict as given by fit_autocorrelation, with the additional key
+            'cached'.
+        """
+        if not self.changed(da):
+            return dict(self.result, cached=True)
+        p0 = None
+        if self.result is not None and self.result['popt'][2] > 0:
+            p0 = self.result['popt']
+        result = fit_autocorrelation(da, self.expected_pulse_duration, p0=p0, model=self.model)
+        if p0 is not None and not np.any(result['popt']):
+            self.logger.debug('Warm started fit did not converge, fitting from scratch')
+            result = fit_autocorrelation(da, self.expected_pulse_duration, model=self.model)
+        result['cached'] = False
+        self.result = result
+        self._time = da.time.values.copy()
+        self._values = np.array(da.values, dtype=np.float64)
+        return result
+
+
 def fit_autocorrelation_wings(da, expected_pulse_duration=.1, wing_sep=.3, wing_ratio=.3):
     """ fits the given data to a sech2 pulse shape"""
+    from scipy.optimize import curve_fit
     da_ = da.dropna('time')
 
     xc = da_.time[np.argmax(da_.values)]
@@ -823,7 +1199,81 @@ def fit_autocorrelation_wings(da, expected_pulse_duration=.1, wing_sep=.3, wing_
     return fitDict
 
 
-def projector(stream_data, spos_fit_pars=None, use_dark_control=True, adc_step=0.000152587890625, time_step=.05, use_r0=True):
+def fit_autocorrelation_batch(curves, expected_pulse_duration=.1, model='sech2', p0=None, n_processes=None):
+    """ Fit all curves of a stack, as given by FastScanEngine.all_curves, at once.
+
+    The sech2 and gaussian models are fitted together by fit_lm_batch. The
+    'wings' model is fitted one curve at a time by fit_autocorrelation_wings,
+    in a process pool of n_processes workers if given.
+
+    Args:
+        curves: xr.DataArray
+            curves with dimensions ('avg', 'time'), on the same time grid.
+            Points not covered by a curve are nan.
+        expected_pulse_duration: float
+            initial guess of the fwhm, used if p0 is None.
+        model: str
+            'sech2', 'gaussian' or 'wings'.
+        p0: ndarray | None
+            initial parameters, of shape (n_curves, n_pars) or (n_pars,). If
+            None, they are estimated from each curve.
+        n_processes: int | None
+            number of worker processes for the 'wings' model.
+
+    Returns:
+        dict of arrays with one row per curve: 'popt', 'pcov', 'perr' and
+        'converged'.
+    """
+    if model == 'wings':
+        return _fit_autocorrelation_wings_batch(curves, expected_pulse_duration, n_processes)
+    function, jac = AUTOCORRELATION_MODELS[model]
+    x = curves.time.values
+    y = np.atleast_2d(curves.values)
+    if p0 is None:
+        defined = np.isfinite(y)
+        y_ = np.where(defined, y, -np.inf)
+        xc = x[np.argmax(y_, axis=1)]
+        tail = defined & (x[None, :] - xc[:, None] > .2)
+        n_tail = tail.sum(axis=1)
+        off = np.where(n_tail > 0, np.where(tail, y, 0).sum(axis=1) / np.maximum(n_tail, 1),
+                       np.where(defined, y, np.inf).min(axis=1))
+        p0 = np.stack((y_.max(axis=1) - off, xc, np.full(len(y), expected_pulse_duration), off), axis=1)
+    else:
+        p0 = np.broadcast_to(p0, (len(y), 4))
+    popt, pcov, converged = fit_lm_batch(function, jac, x, y, p0)
+    return {'popt': popt,
+            'pcov': pcov,
+            'perr': np.sqrt(np.diagonal(pcov, axis1=1, axis2=2)),
+            'converged': converged,
+            }
+
+
+def _fit_autocorrelation_wings_batch(curves, expected_pulse_duration=.1, n_processes=None):
+    n_pars = 6
+    popt = np.full((len(curves), n_pars), np.nan)
+    pcov = np.full((len(curves), n_pars, n_pars), np.nan)
+    fitted = np.flatnonzero(np.isfinite(curves.values).sum(axis=1) > n_pars)
+    das = [curves[i] for i in fitted]
+    fit = functools.partial(fit_autocorrelation_wings, expected_pulse_duration=expected_pulse_duration)
+    if n_processes:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(n_processes) as pool:
+            results = list(pool.map(fit, das, chunksize=max(1, len(das) // (4 * n_processes))))
+    else:
+        results = [fit(da) for da in das]
+    for i, result in zip(fitted, results):
+        popt[i] = result['popt']
+        pcov[i] = result['pcov']
+    return {'popt': popt,
+            'pcov': pcov,
+            'perr': np.sqrt(np.diagonal(pcov, axis1=1, axis2=2)),
+            'converged': np.any(popt != 0, axis=1) & np.all(np.isfinite(popt), axis=1),
+            }
+
+
+def projector(stream_data, spos_fit_pars=None, use_dark_control=True, adc_step=0.000152587890625, time_step=.05,
+              use_r0=True, backend='cython', n_threads=1, spos_fit='fast', max_fit_residual=.01, time_grid=None,
+              config=None):
     """
 
     Args:
@@ -837,11 +1287,50 @@ def projector(stream_data, spos_fit_pars=None, use_dark_control=True, adc_step=0
             :use_r0: bool | False
                 if to use 4th channel as r0 (static reflectivity from reference channel)
                 for obtaining dR/R
+            :backend: str | cython
+                implementation of the binning: cython, cython_parallel, numpy or python
+            :n_threads: int | 1
+                number of threads used by the cython_parallel backend. Frames
+                are already projected in parallel by the worker pool, so this
+                multiplies the number of threads running.
+            :spos_fit: str | fast
+                method for fitting the shaker position. 'fast' uses the closed
+                form estimator fit_sin_fast, 'curve_fit' the iterative scipy fit.
+            :max_fit_residual: float | .01
+                relative residual of the fast fit above which it falls back to
+                the scipy fit.
+            :time_grid: tuple | None
+                (pos_min, n_bins) fixed grid of shaker positions, in ADC steps,
+                as given by make_time_grid. If given, the output covers the whole
+                grid, including empty bins as NaN, and has a 'counts' coordinate
+                with the number of samples in each bin.
+            :config: FastScanConfig | None
+                settings snapshot. If given, it replaces use_dark_control,
+                adc_step, time_step, use_r0, backend and n_threads, and its
+                version is stored in the 'config_version' attribute of output.
+                If its fixed_time_grid is set and time_grid is None, the grid
+                is made around the fitted shaker offset.
     Returns:
-
+        output: xr.DataArray
+            projected data. Its 'project_time' attribute holds the time spent
+            binning, in seconds, and with a time grid, 'n_outside' the number
+            of samples outside the grid.
+        spos_fit_pars: ndarray
+            parameters of the shaker position sine fit
+        fit_time: float
+            time spent fitting the shaker position, in seconds
+        fit_residual: float
+            rms residual of the shaker position fit relative to its amplitude
     """
     assert isinstance(stream_data,np.ndarray)
     # assert stream_data.ndim >2, 'stream data must be 3 or 4 dimensional'
+    if config is not None:
+        use_dark_control = config.dark_control
+        adc_step = config.shaker_position_step
+        time_step = config.shaker_time_step
+        use_r0 = config.use_r0
+        backend = config.projector_backend
+        n_threads = config.projector_threads
 
     if stream_data.shape[0] == 4 and use_r0: # calculate dR/R only when required and when data for R0 is there
         use_r0 = True
@@ -862,10 +1351,41 @@ def projector(stream_data, spos_fit_pars=None, use_dark_control=True, adc_step=0
         guess = [g_amp, g_freq, g_phase, g_offset]
     else:
         guess = spos_fit_pars
-    popt, pcov = curve_fit(sin, x, spos_analog, p0=guess)
+    t0 = time.time()
+    popt, fit_residual = None, np.inf
+    if spos_fit == 'fast':
+        popt, fit_residual = fit_sin_fast(spos_analog, x, guess=spos_fit_pars)
+        if not fit_residual < max_fit_residual and spos_fit_pars is not None:  # retry without warm start
+            popt, fit_residual = fit_sin_fast(spos_analog, x)
+    if not fit_residual < max_fit_residual:
+        from scipy.optimize import curve_fit
+        popt, pcov = curve_fit(sin, x, spos_analog, p0=guess)
+        fit_residual = sin_residual(spos_analog, x, popt)
+    fit_time = time.time() - t0
     spos_fit_pars = popt
     spos = np.array(sin(x, *popt) / adc_step, dtype=int)
 
+    t0 = time.time()
+    if time_grid is None and config is not None and config.fixed_time_grid:
+        time_grid = make_time_grid(config.shaker_amplitude, time_step, center=popt[3] / adc_step)
+    if time_grid is not None:
+        pos_min, n_bins = time_grid
+        reference = stream_data[3] if use_r0 else None
+        result_val, result_ref, counts, n_outside = project_to_grid(spos, signal, dark_control, reference,
+                                                                    use_dark_control, pos_min, n_bins)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            result = result_val / counts
+            if use_r0:
+                result /= np.nanmean(result_ref / counts)
+        time_axis = np.arange(pos_min, pos_min + n_bins, 1) * time_step
+        output = xr.DataArray(result, coords={'time': time_axis, 'counts': ('time', counts)}, dims='time')
+        output.attrs['project_time'] = time.time() - t0
+        output.attrs['n_outside'] = n_outside
+        if config is not None:
+            output.attrs['config_version'] = config.version
+        return (output, spos_fit_pars, fit_time, fit_residual)
+
+    project, project_r0 = load_projector(backend, n_threads)
     if use_r0:
         reference = stream_data[3]
         result = project_r0(spos,signal,dark_control,reference, use_dark_control)
@@ -874,9 +1394,34 @@ def projector(stream_data, spos_fit_pars=None, use_dark_control=True, adc_step=0
 
     time_axis = np.arange(spos.min(), spos.max() + 1, 1) * time_step
     output = xr.DataArray(result, coords={'time': time_axis}, dims='time').dropna('time')
-    return (output, spos_fit_pars)
+    output.attrs['project_time'] = time.time() - t0
+    if config is not None:
+        output.attrs['config_version'] = config.version
+    return (output, spos_fit_pars, fit_time, fit_residual)
+
+def make_time_grid(shaker_amplitude, time_step, center=0, margin=.1):
+    """ Fixed grid of shaker positions covering the whole shaker scan.
+
+    Args:
+        shaker_amplitude: float
+            peak to peak amplitude of the shaker scan, in ps.
+        time_step: float
+            time corresponding to one ADC step of the shaker position, in ps.
+        center: float
+            center of the shaker scan, in ADC steps, as the offset of the
+            shaker position fit divided by the ADC step.
+        margin: float
+            relative extension of the grid on each side, to account for
+            amplitude fluctuations of the shaker.
+    Returns:
+        (pos_min, n_bins): first position and number of bins, in ADC steps.
+    """
+    half_range = int(np.ceil(shaker_amplitude * (1 + margin) / 2 / time_step))
+    return int(np.rint(center)) - half_range, 2 * half_range + 1
+
 
 def project_OLD(stream_data, use_dark_control=True, adc_step=0.000152587890625, time_step=.05, r0=True):
+    from scipy.optimize import curve_fit
     spos_analog = stream_data[0]
     x = np.arange(0, len(spos_analog), 1)
 
@@ -939,25 +1484,43 @@ def project_OLD(stream_data, use_dark_control=True, adc_step=0.000152587890625,
 #       Streamer
 # -----------------------------------------------------------------------------
 
-class FastScanStreamer(QtCore.QObject):
-    finished = QtCore.pyqtSignal()
-    newData = QtCore.pyqtSignal(np.ndarray)
-    error = QtCore.pyqtSignal(Exception)
+class FastScanStreamer(object):
+    """ Acquisition loop of the NI card, of the simulator or of a replay.
+
+    start_acquisition blocks until stop_acquisition is called, so it is run
+    in its own thread. Frames are handed to the callbacks, called from the
+    acquisition thread:
+        on_data(data): frame acquired in self.data, without frame_pool
+        on_frame(slot): frame acquired in a slot of frame_pool
+        on_error(exception)
+        on_finished(): the acquisition loop has ended
+    """
     niChannel_order = ['shaker_position','signal','dark_control','reference']
-    def __init__(self, ):
-        super().__init__()
+
+    def __init__(self, config=None, on_data=None, on_frame=None, on_error=None, on_finished=None):
         self.logger = logging.getLogger('{}.FastScanStreamer'.format(__name__))
         self.logger.info('Created FastScanStreamer')
 
+        self.config = FastScanConfig.from_settings() if config is None else config
         self.init_ni_channels()
 
         self.should_stop = True
+        self.backpressure = None  # semaphore limiting the frames in flight, see emit_data
+        self.frame_pool = None  # FramePool to acquire into, see acquire_buffer
+        self.recorder = None  # RawStreamRecorder, if config.record_file is set
+        self.metrics = None  # MetricsRegistry timing each frame, from acquire_buffer to emit_data
+        self._t_buffer = None
+        self.on_data = on_data
+        self.on_frame = on_frame
+        self.on_error = on_error
+        self.on_finished = on_finished
+
+    def emit_error(self, e):
+        if self.on_error is not None:
+            self.on_error(e)
 
     def init_ni_channels(self):
 
-        for k, v in parse_category('fastscan').items():
-            setattr(self, k, v)
-
         self.niChannels = {  # default channels
             'shaker_position': "Dev1/ai0",
             'signal': "Dev1/ai1",
@@ -980,30 +1543,100 @@ class FastScanStreamer(QtCore.QObject):
 #        except:
 #            self.logger.critical('failed reading trigger channels from SETTINGS, using default channels.')
 
-        self.data = np.zeros((len(self.niChannels), self.n_samples))
+        self.data = np.zeros((len(self.niChannels), self.config.n_samples))
 
 
-    @QtCore.pyqtSlot()
     def start_acquisition(self):
-        if self.simulate:
-            self.logger.info('Started streamer simulation in {} mode'.format(self.acquisition_mode))
-            self.measure_simulated()
-        else:
-            if self.acquisition_mode == 'continuous':
-                self.logger.info('Started NI continuous Streamer ')
-                self.measure_continuous()
+        """ Run the acquisition loop, and call on_finished once it ends."""
+        self.recorder = None
+        try:
+            if self.config.record_file and self.config.acquisition_mode != 'replay':
+                self.recorder = RawStreamRecorder(self.config.record_file, *self.data.shape)
+            if self.config.acquisition_mode == 'replay':
+                self.logger.info('Started streamer replay of {}'.format(self.config.replay_file))
+                self.measure_replay()
+            elif self.config.simulate:
+                self.logger.info('Started streamer simulation in {} mode'.format(self.config.acquisition_mode))
+                self.measure_simulated()
+            else:
+                if self.config.acquisition_mode == 'continuous':
+                    self.logger.info('Started NI continuous Streamer ')
+                    self.measure_continuous()
 
-            elif self.acquisition_mode == 'triggered':
-                self.logger.info('Started NI triggered Streamer ')
-                self.measure_triggered()
+                elif self.config.acquisition_mode == 'triggered':
+                    self.logger.info('Started NI triggered Streamer ')
+                    self.measure_triggered()
+        except Exception as e:
+            self.logger.warning('Error in streamer: \n{}'.format(e))
+            self.emit_error(e)
+        finally:
+            if self.recorder is not None:
+                self.recorder.close()
+                self.recorder = None
+            if self.on_finished is not None:
+                self.on_finished()
 
-    @QtCore.pyqtSlot()
     def stop_acquisition(self):
         self.logger.info('FastScanStreamer thread stopping.')
         self.should_stop = True
 
+    def acquire_buffer(self):
+        """ Get the buffer where to acquire the next frame.
+
+        With a frame_pool, this waits for a free slot, which is given back by
+        the receiver once the frame has been projected. Without, the single
+        self.data buffer is reused.
+
+        Returns:
+            slot, buffer: slot is None without frame_pool. buffer is None if
+            the acquisition was stopped while waiting.
+        """
+        if self.frame_pool is None:
+            self._t_buffer = time.perf_counter()
+            return None, self.data
+        while True:
+            slot = self.frame_pool.acquire(block=True, timeout=.1)
+            if slot is not None:
+                self._t_buffer = time.perf_counter()
+                return slot, self.frame_pool.view(slot)
+            if self.should_stop:
+                return None, None
+
+    def emit_data(self, data, slot=None):
+        """ Emit the acquired data.
+
+        If a backpressure semaphore is set, first wait until the receiver has
+        room for a new frame. Frames acquired in a frame_pool slot are passed
+        to on_frame, others to on_data.
+
+        Returns:
+            False if the acquisition was stopped while waiting, else True.
+        """
+        if self.metrics is not None:
+            if self._t_buffer is not None:  # time from acquire_buffer to here
+                self.metrics.record('acquisition', time.perf_counter() - self._t_buffer)
+                self._t_buffer = None
+            self.metrics.count('frames_acquired')
+        if self.recorder is not None:
+            self.recorder.add(data)
+        if self.backpressure is not None:
+            while not self.backpressure.acquire(timeout=.1):
+                if self.should_stop:
+                    if slot is not None:
+                        self.frame_pool.release(slot)
+                    return False
+        if slot is None:
+            if self.on_data is not None:
+                self.on_data(data)
+        elif self.on_frame is not None:
+            self.on_frame(slot)
+        return True
+
     def measure_continuous(self):
         try:
+            import nidaqmx
+            from nidaqmx import stream_readers
+            from nidaqmx.constants import Edge, AcquisitionType
             with nidaqmx.Task() as task:
 
                 self.reader = stream_readers.AnalogMultiChannelReader(task.in_stream)
@@ -1025,27 +1658,32 @@ class FastScanStreamer(QtCore.QObject):
                 while not self.should_stop:
                     i += 1
                     self.logger.debug('measuring cycle {}'.format(i))
-                    self.reader.read_many_sample(self.data, number_of_samples_per_channel=self.n_samples)
-                    self.logger.debug('Recieved data from NI card: mean axis 0 = {}'.format(self.data[0].mean()))
-                    self.newData.emit(self.data)
+                    slot, buffer = self.acquire_buffer()
+                    if buffer is None:
+                        break
+                    self.reader.read_many_sample(buffer, number_of_samples_per_channel=self.config.n_samples)
+                    self.logger.debug('Recieved data from NI card: mean axis 0 = {}'.format(buffer[0].mean()))
+                    self.emit_data(buffer, slot)
 
                 self.logger.warning('Acquisition stopped.')
-                self.finished.emit()
 
         except Exception as e:
             self.logger.warning('Error while starting streamer: \n{}'.format(e))
-            self.error.emit(e)
+            self.emit_error(e)
 
     def measure_triggered(self):
         """ Define tasks and triggers for NIcard.
 
         At each trigger signal from the shaker, it reads a number of samples
-        (self.n_samples) triggered by the laser pulses. It records the channels
+        (self.config.n_samples) triggered by the laser pulses. It records the channels
         given in self.niChannels.
-        The data is then emitted by the newData signal, and will have the shape
+        The data is then passed to emit_data, and will have the shape
         (number of channels, number of samples).
         """
         try:
+            import nidaqmx
+            from nidaqmx import stream_readers
+            from nidaqmx.constants import Edge, AcquisitionType
             with nidaqmx.Task() as task:
                 loaded_channels = 0
                 for chan in self.niChannel_order:
@@ -1060,28 +1698,62 @@ class FastScanStreamer(QtCore.QObject):
                 self.logger.debug('added {} tasks'.format(loaded_channels))
                 task.triggers.start_trigger.cfg_dig_edge_start_trig(trigger_source=self.niTriggers['shaker_trigger'],
                                                                     trigger_edge=Edge.RISING)
-                task.timing.cfg_samp_clk_timing(100000, samps_per_chan=self.n_samples,
+                task.timing.cfg_samp_clk_timing(100000, samps_per_chan=self.config.n_samples,
                                                 source=self.niTriggers['laser_trigger'],
                                                 active_edge=Edge.RISING,
                                                 sample_mode=AcquisitionType.FINITE)  # external clock chanel
+                # rearm on each shaker trigger, so the task is started only once
+                task.triggers.start_trigger.retriggerable = True
+                self.reader = stream_readers.AnalogMultiChannelReader(task.in_stream)
+                task.start()
 
                 self.should_stop = False
                 i = 0
                 while not self.should_stop:
                     i += 1
                     self.logger.debug('measuring cycle {}'.format(i))
-                    self.data = np.array(task.read(number_of_samples_per_channel=self.n_samples))
+                    slot, buffer = self.acquire_buffer()
+                    if buffer is None:
+                        break
+                    self.reader.read_many_sample(buffer, number_of_samples_per_channel=self.config.n_samples)
 
-                    self.newData.emit(self.data)
+                    self.emit_data(buffer, slot)
 
                 self.logger.warning('Acquisition stopped.')
-                self.finished.emit()
         except Exception as e:
             self.logger.warning('Error while starting streamer: \n{}'.format(e))
-            self.error.emit(e)
+            self.emit_error(e)
+
+    def measure_replay(self):
+        """ Emit the frames of a raw stream recording, as if acquired.
+
+        With replay_speed 'original' the frames are emitted with the timing
+        they were recorded with, with 'max' as fast as they are taken.
+        """
+        recording = RawStreamFile(self.config.replay_file)
+        if recording.shape != self.data.shape:
+            raise ValueError('Recording {} has frames of shape {}, expected {}'.format(
+                recording.filename, recording.shape, self.data.shape))
+        original_speed = self.config.replay_speed == 'original'
+        self.should_stop = False
+        t_start = time.time()
+        for i in range(len(recording)):
+            if self.should_stop:
+                break
+            slot, buffer = self.acquire_buffer()
+            if buffer is None:
+                break
+            buffer[...] = recording[i]
+            if original_speed:
+                time.sleep(max(recording.timestamps[i] - recording.timestamps[0] - (time.time() - t_start), 0))
+            self.emit_data(buffer, slot)
+        self.logger.info('Replay of {} ended after {} frames in {:.2f} s'.format(
+            recording.filename, i + 1 if len(recording) else 0, time.time() - t_start))
 
     def measure_single_shot(self, n):
         try:
+            import nidaqmx
+            from nidaqmx.constants import Edge, AcquisitionType
             with nidaqmx.Task() as task:
                 for k,v in self.niChannels: # add all channels to be recorded
                     task.ai_channels.add_ai_voltage_chan(v)
@@ -1089,7 +1761,7 @@ class FastScanStreamer(QtCore.QObject):
 
                 task.triggers.start_trigger.cfg_dig_edge_start_trig(trigger_source="/Dev1/PFI1",
                                                                     trigger_edge=Edge.RISING)
-                task.timing.cfg_samp_clk_timing(100000, samps_per_chan=self.n_samples,
+                task.timing.cfg_samp_clk_timing(100000, samps_per_chan=self.config.n_samples,
                                                 source="/Dev1/PFI0",
                                                 active_edge=Edge.RISING,
                                                 sample_mode=AcquisitionType.FINITE)  # external clock chanel
@@ -1099,120 +1771,154 @@ class FastScanStreamer(QtCore.QObject):
                 data = np.zeros((n, *self.data.shape))
                 for i in range(n):
                     self.logger.debug('measuring cycle {}'.format(i))
-                    data[i, ...] = np.array(task.read(number_of_samples_per_channel=self.n_samples))
+                    data[i, ...] = np.array(task.read(number_of_samples_per_channel=self.config.n_samples))
                 return (data.mean(axis=0))
 
         except Exception as e:
             self.logger.warning('Error while starting streamer: \n{}'.format(e))
-            self.error.emit(e)
+            self.emit_error(e)
 
-    def simulate_single_shot(self, n):
-        self.should_stop = False
-        i = 0
+    def make_simulator(self):
+        """ StreamSimulator with the parameters of [fastscan - simulation]."""
         sim_parameters = parse_category('fastscan - simulation')
         fit_parameters = [sim_parameters['amplitude'],
                           sim_parameters['center_position'],
                           sim_parameters['fwhm'],
                           sim_parameters['offset']
                           ]
-        step = parse_setting('fastscan', 'shaker_position_step')
-        ps_per_step = parse_setting('fastscan', 'shaker_ps_per_step')  # ADC step size - corresponds to 25fs
-        ps_per_step *= parse_setting('fastscan', 'shaker_gain')  # correct for shaker gain factor
+        step = self.config.shaker_position_step
+        ps_per_step = self.config.shaker_ps_per_step  # ADC step size - corresponds to 25fs
+        ps_per_step *= self.config.shaker_gain  # correct for shaker gain factor
+        return StreamSimulator(self.config.n_samples,
+                               function=sim_parameters['function'],
+                               args=fit_parameters,
+                               amplitude=sim_parameters['shaker_amplitude'],
+                               mode=self.config.acquisition_mode,
+                               step=step,
+                               ps_per_step=ps_per_step,
+                               seed=sim_parameters.get('seed'),
+                               )
+
+    def simulate_single_shot(self, n):
+        self.should_stop = False
+        simulator = self.make_simulator()
 
         data = np.zeros((n, *self.data.shape))
         for i in range(n):
             self.logger.debug('measuring cycle {}'.format(i))
-            data[i, ...] = simulate_measure(self.data,
-                                            function=sim_parameters['function'],
-                                            args=fit_parameters,
-                                            amplitude=sim_parameters['shaker_amplitude'],
-                                            mode=self.acquisition_mode,
-                                            step=step,
-                                            ps_per_step=ps_per_step,
-                                            )
+            data[i, ...] = simulator.measure(self.data)
 
         return (data.mean(axis=0))
 
     def measure_simulated(self):
+        """ Emit simulated frames.
+
+        The 'speed' simulation setting is the frame rate relative to the real
+        acquisition, of n_samples/273000 s per frame. 0 or 'max' emits frames
+        as fast as they are taken.
+        """
         self.should_stop = False
         i = 0
-        sim_parameters = parse_category('fastscan - simulation')
-        fit_parameters = [sim_parameters['amplitude'],
-                          sim_parameters['center_position'],
-                          sim_parameters['fwhm'],
-                          sim_parameters['offset']
-                          ]
-        step = parse_setting('fastscan', 'shaker_position_step')
-        ps_per_step = parse_setting('fastscan', 'shaker_ps_per_step')  # ADC step size - corresponds to 25fs
-        ps_per_step *= parse_setting('fastscan', 'shaker_gain')  # correct for shaker gain factor
+        simulator = self.make_simulator()
+        speed = parse_category('fastscan - simulation').get('speed', 1)
+        if speed in (0, 'max', None):
+            frame_time = 0
+        else:
+            frame_time = self.config.n_samples / 273000 / speed
+        t_start = time.time()
 
         while not self.should_stop:
             i += 1
             self.logger.debug('simulating measurement cycle #{}'.format(i))
+            slot, buffer = self.acquire_buffer()
+            if buffer is None:
+                break
             t0 = time.time()
-
-            self.data = simulate_measure(self.data,
-                                         function=sim_parameters['function'],
-                                         args=fit_parameters,
-                                         amplitude=sim_parameters['shaker_amplitude'],
-                                         mode=self.acquisition_mode,
-                                         step=step,
-                                         ps_per_step=ps_per_step,
-                                         )
+            simulator.measure(buffer)
             dt = time.time() - t0
-            time.sleep(max(self.n_samples / 273000 - dt, 0))
-            self.newData.emit(self.data)
+            if frame_time > 0:  # keep to the schedule, without accumulating delays
+                time.sleep(max(t_start + i * frame_time - time.time(), 0))
+            self.emit_data(buffer, slot)
             self.logger.debug(
                 'simulated data in {:.2f} ms - real would take {:.2f} - '
                 'outputting array of shape {}'.format(dt * 1000,
-                                                      self.n_samples / 273,
-                                                      self.data.shape))
+                                                      self.config.n_samples / 273,
+                                                      buffer.shape))
 
 
-def simulate_measure(data, function='sech2_fwhm', args=[.5, -2, .085, 1],
-                     amplitude=10, mode='triggered',
-                     step=0.000152587890625, ps_per_step=.05):
-    args_ = args[:]
-
-    if function == 'gauss_fwhm':
-        f = gaussian_fwhm
-        args_[1] *= step / ps_per_step  # transform ps to voltage
-        args_[2] *= step / ps_per_step  # transform ps to voltage
-    elif function == 'gaussian':
-        f = gaussian
-        args_[1] *= step / ps_per_step  # transform ps to voltage
-        args_[2] *= step / ps_per_step  # transform ps to voltage
-        args_.pop(0)
-        args_.pop(-1)
-    elif function == 'sech2_fwhm':
-        f = sech2_fwhm
-        args_[1] *= step / ps_per_step  # transform ps to voltage
-        args_[2] *= step / ps_per_step  # transform ps to voltage
-    elif function == 'transient_1expdec':
-        f = transient_1expdec
-        args_ = [2, 20, 1, 1, .01, -10]
-        args_[1] *= step / ps_per_step  # transform ps to voltage
-        args_[2] *= step / ps_per_step  # transform ps to voltage
-        args_[5] *= step / ps_per_step  # transform ps to voltage
-    else:
-        raise NotImplementedError('no funcion called {}, please use gauss or sech2'.format(function))
-    #########
-    n = np.arange(len(data[0]))
-    noise = np.random.rand(len(n))
-    if mode == 'continuous':
-        phase = noise[0] * 2 * np.pi
-    else:
-        phase = 0
-    amplitude = amplitude * step / ps_per_step * (1 + .02 * np.random.uniform(-1, 1))
+class StreamSimulator(object):
+    """ Generates simulated streamer frames.
 
-    data[0, :] = np.cos(2 * np.pi * n / 30000 + phase) * amplitude / 2  # in volt
+    The shaker position waveform is computed once, over one shaker period
+    plus a frame, and each frame takes a window of it: in 'continuous' mode
+    starting at a random phase, in 'triggered' mode always at the trigger.
+    Noise comes from a numpy Generator, so a seed makes the frames
+    reproducible.
+    """
 
-    data[1, 1::2] = data[0, 1::2] / 3
-    data[1, ::2] = f(data[0, ::2], *args_) + noise[::2] + data[0, ::2] / 3
-    data[2, ::2] = True
-    data[2, 1::2] = False
+    def __init__(self, n_samples, function='sech2_fwhm', args=[.5, -2, .085, 1], amplitude=10, mode='triggered',
+                 step=0.000152587890625, ps_per_step=.05, seed=None, period=30000):
+        args_ = list(args)
+        if function == 'gauss_fwhm':
+            f = gaussian_fwhm
+            args_[1] *= step / ps_per_step  # transform ps to voltage
+            args_[2] *= step / ps_per_step  # transform ps to voltage
+        elif function == 'gaussian':
+            f = gaussian
+            args_[1] *= step / ps_per_step  # transform ps to voltage
+            args_[2] *= step / ps_per_step  # transform ps to voltage
+            args_.pop(0)
+            args_.pop(-1)
+        elif function == 'sech2_fwhm':
+            f = sech2_fwhm
+            args_[1] *= step / ps_per_step  # transform ps to voltage
+            args_[2] *= step / ps_per_step  # transform ps to voltage
+        elif function == 'transient_1expdec':
+            f = transient_1expdec
+            args_ = [2, 20, 1, 1, .01, -10]
+            args_[1] *= step / ps_per_step  # transform ps to voltage
+            args_[2] *= step / ps_per_step  # transform ps to voltage
+            args_[5] *= step / ps_per_step  # transform ps to voltage
+        else:
+            raise NotImplementedError('no funcion called {}, please use gauss or sech2'.format(function))
+        self.function = f
+        self.args = args_
+        self.n_samples = n_samples
+        self.mode = mode
+        self.period = period
+        self.amplitude = amplitude * step / ps_per_step  # in volt
+        self.rng = np.random.default_rng(seed)
+
+        # unit amplitude shaker position, for any starting phase
+        self.waveform = np.cos(2 * np.pi * np.arange(period + n_samples) / period) / 2
+        self.dark_control = np.zeros(n_samples)
+        self.dark_control[::2] = True
+
+    def measure(self, data):
+        """ Fill data, of shape (n_channels, n_samples), with a simulated frame.
 
-    return data
+        Returns:
+            data
+        """
+        n = self.n_samples
+        start = self.rng.integers(self.period) if self.mode == 'continuous' else 0
+        amplitude = self.amplitude * (1 + .02 * self.rng.uniform(-1, 1))
+
+        spos = data[0]
+        np.multiply(self.waveform[start:start + n], amplitude, out=spos)
+        data[1, 1::2] = spos[1::2] / 3
+        data[1, ::2] = self.function(spos[::2], *self.args) + self.rng.random((n + 1) // 2) + spos[::2] / 3
+        data[2] = self.dark_control
+        return data
+
+
+def simulate_measure(data, function='sech2_fwhm', args=[.5, -2, .085, 1],
+                     amplitude=10, mode='triggered',
+                     step=0.000152587890625, ps_per_step=.05, seed=None):
+    """ Fill data with a single simulated frame, see StreamSimulator."""
+    simulator = StreamSimulator(data.shape[1], function=function, args=args, amplitude=amplitude, mode=mode,
+                                step=step, ps_per_step=ps_per_step, seed=seed)
+    return simulator.measure(data)
 
 
 if __name__ == '__main__':
@@ -36,7 +36,7 @@ from pyqtgraph.Qt import QtCore as pQtCore, QtGui as pQtGui
 from scipy.signal import butter, filtfilt
 
 from utilities.settings import parse_category, parse_setting, write_setting
-from measurement.fastscan import FastScanThreadManager
+from measurement.fastscan_qt import FastScanThreadManager
 
 
 class FastScanMainWindow(QMainWindow):
@@ -68,6 +68,7 @@ class FastScanMainWindow(QMainWindow):
 
         self.fps_l = []
         self.streamer_qsize = 0
+        self.metrics = None  # last snapshot emitted by the data manager
 
         self.main_clock = QtCore.QTimer()
         self.main_clock.setInterval(50)
@@ -180,6 +181,15 @@ class FastScanMainWindow(QMainWindow):
         savebox_layout.addWidget(self.save_data_button, 2, 1, 2, 2)
         self.save_data_button.clicked.connect(self.save_data)
 
+        self.file_stream_cb = QCheckBox('Stream to file')
+        self.file_stream_cb.setToolTip(
+            'If Checked, saves every projected curve to <name>_stream.h5 while measuring.')
+        savebox_layout.addWidget(self.file_stream_cb, 3, 0)
+        self.file_stream_cb.clicked.connect(self.toggle_file_stream)
+        self.file_stream_raw_cb = QCheckBox('with raw data')
+        self.file_stream_raw_cb.setToolTip('If Checked, also saves the raw streams when streaming to file.')
+        savebox_layout.addWidget(self.file_stream_raw_cb, 4, 0)
+
         # self.autosave_checkbox = QCheckBox('autosave')
         # savebox_layout.addWidget(self.autosave_checkbox,3,0)
         # self.autosave_timeout = QDoubleSpinBox()
@@ -188,7 +198,7 @@ class FastScanMainWindow(QMainWindow):
         # savebox_layout.addWidget(self.autosave_timeout,3,2)
 
         self.datasize_label = QLabel('data Size')
-        savebox_layout.addWidget(self.datasize_label, 4, 0, 3, 2)
+        savebox_layout.addWidget(self.datasize_label, 5, 0, 3, 2)
         # self.fps_label = QLabel('data Size')
         # savebox_layout.addWidget(self.fps_label, 6, 0, 3, 2)
 
@@ -376,7 +386,7 @@ class FastScanMainWindow(QMainWindow):
         # self.main_clock.setInterval(self.autosave_timeout.value())
         try:
             streamer_shape = self.data_manager.streamer_average.shape
-            projected_shape = self.data_manager.all_curves.shape
+            projected_shape = self.data_manager.averages.shape
         except AttributeError:
             streamer_shape = projected_shape = (0, 0)
         try:
@@ -387,13 +397,22 @@ class FastScanMainWindow(QMainWindow):
             fps = 0
 
 
-        string = 'Data Size :\n streamer: {} - {:10.3f} Kb\n projected: {} - {:10.3f} Kb\n Streams queued: {}\n Cycles per Second [Hz]: {:10.3f}       '.format(
+        string = 'Data Size :\n streamer: {} - {:10.3f} Kb\n projected: {} - {:10.3f} Kb\n Streams queued: {}\n' \
+                 ' Streams pending: {}\n Streams dropped: {}\n Streams processed: {}\n' \
+                 ' Cycles per Second [Hz]: {:10.3f}       '.format(
             streamer_shape, np.prod(streamer_shape) / (1024),
             projected_shape, np.prod(projected_shape) / (1024),
             self.data_manager.stream_qsize,
+            self.data_manager.n_pending,
+            self.data_manager.n_dropped,
+            self.data_manager.n_projected,
             fps,
 
         )
+        if self.metrics is not None:
+            string += '\n Stage latency p50 | p95 [ms]:'
+            for stage, summary in self.metrics['stages'].items():
+                string += '\n  {}: {:.2f} | {:.2f}'.format(stage, summary['p50_ms'], summary['p95_ms'])
         self.datasize_label.setText(string)
 
 
@@ -404,6 +423,9 @@ class FastScanMainWindow(QMainWindow):
         manager.newStreamerData.connect(self.on_streamer_data)
         manager.newFitResult.connect(self.on_fit_result)
         manager.newAverage.connect(self.on_avg_data)
+        manager.newMetrics.connect(self.on_metrics)
+        manager.shakerCalibrationProgress.connect(self.on_shaker_calib_progress)
+        manager.shakerCalibrationFinished.connect(self.on_shaker_calib_finished)
         manager.error.connect(self.on_thread_error)
 
         manager_thread = QtCore.QThread()
@@ -419,11 +441,20 @@ class FastScanMainWindow(QMainWindow):
         write_setting(self.radio_simulate.isChecked(), 'fastscan', 'dark_control')
 
     def toggle_calculate_autocorrelation(self):
-        self.data_manager._calculate_autocorrelation = self.calculate_autocorrelation_box.isChecked()
+        self.data_manager.calculate_autocorrelation = self.calculate_autocorrelation_box.isChecked()
 
     def on_shaker_calib(self):
         self.data_manager.calibrate_shaker(self.shaker_calib_iterations.value(), self.shaker_calib_integration.value())
 
+    @QtCore.pyqtSlot(int, int)
+    def on_shaker_calib_progress(self, n_done, n_points):
+        self.status_bar.showMessage('Shaker calibration: {}/{} points'.format(n_done, n_points))
+
+    @QtCore.pyqtSlot(dict)
+    def on_shaker_calib_finished(self, result):
+        self.status_bar.showMessage('Shaker calibration: {:.5g} +- {:.2g} ps per step'.format(
+            result['shaker_ps_per_step'], result['shaker_ps_per_step_err']))
+
     @QtCore.pyqtSlot(xr.DataArray)
     def on_processed_data(self, data_array):
         try:
@@ -436,8 +467,9 @@ class FastScanMainWindow(QMainWindow):
             # self.fps_label.setText('Cycles (Hz): {:.2f}'.format(fps))
         except:
             self.processor_tick = time.time()
-        self.apply_filter(data_array)
-        self.visual_widget.plot_last_curve(data_array)
+        with self.data_manager.metrics.timer('plotting'):
+            self.apply_filter(data_array)
+            self.visual_widget.plot_last_curve(data_array)
         self.logger.debug('recieved processed data as {}'.format(type(data_array)))
 
     @QtCore.pyqtSlot(dict)
@@ -451,8 +483,13 @@ class FastScanMainWindow(QMainWindow):
 
     @QtCore.pyqtSlot(xr.DataArray)
     def on_avg_data(self, da):
-        self.apply_filter(da)
-        self.visual_widget.plot_avg_curve(da)
+        with self.data_manager.metrics.timer('plotting'):
+            self.apply_filter(da)
+            self.visual_widget.plot_avg_curve(da)
+
+    @QtCore.pyqtSlot(dict)
+    def on_metrics(self, snapshot):
+        self.metrics = snapshot
 
     def on_streamer_data(self, data):
         self.visual_widget.plot_stream_curve(data)
@@ -477,6 +514,7 @@ class FastScanMainWindow(QMainWindow):
     def reset_data(self):
         self.status_bar.showMessage('Data reset')
         self.fps_l = []
+        self.metrics = None
         self.data_manager.reset_data()
 
     def set_n_samples(self, var):
@@ -494,6 +532,15 @@ class FastScanMainWindow(QMainWindow):
         self.data_manager.save_data(filepath, all_data=self.save_all_cb.isChecked())
         self.status_bar.showMessage('Successfully saved data as {}'.format(filepath))
 
+    def toggle_file_stream(self):
+        if self.file_stream_cb.isChecked():
+            filepath = os.path.join(self.save_dir_ledit.text(), self.save_name_ledit.text() + '_stream')
+            self.data_manager.start_file_stream(filepath, raw=self.file_stream_raw_cb.isChecked())
+            self.status_bar.showMessage('Streaming data to {}.h5'.format(filepath))
+        else:
+            self.data_manager.stop_file_stream()
+            self.status_bar.showMessage('Stopped streaming data to file')
+
     @QtCore.pyqtSlot(Exception)
     def on_thread_error(self, e):
         self.logger.critical('Thread error: {}'.format(e))
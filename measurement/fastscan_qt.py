@@ -0,0 +1,540 @@
+# -*- coding: utf-8 -*-
+"""
+
+@author: Steinn Ymir Agustsson
+
+    Copyright (C) 2018 Steinn Ymir Agustsson
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+import logging
+import os
+import sys
+import time
+import traceback
+
+import numpy as np
+import xarray as xr
+from PyQt5 import QtCore
+
+from utilities.settings import parse_setting, write_setting
+from measurement.cscripts import PROJECTOR_BACKENDS
+from measurement.fastscan import FastScanEngine, fit_autocorrelation, project
+
+
+# -----------------------------------------------------------------------------
+#       thread management
+# -----------------------------------------------------------------------------
+
+class FastScanThreadManager(QtCore.QObject):
+    """
+    Qt interface of the FastScanEngine.
+
+    The engine callbacks are forwarded as signals, so that connected slots
+    run in their own thread, as the GUI. Settings are exposed as properties.
+    """
+    newStreamerData = QtCore.pyqtSignal(np.ndarray)
+    newProcessedData = QtCore.pyqtSignal(xr.DataArray)
+    newFitResult = QtCore.pyqtSignal(dict)
+    newAverage = QtCore.pyqtSignal(xr.DataArray)
+    newMetrics = QtCore.pyqtSignal(dict)  # MetricsRegistry.snapshot, at most every engine.metrics_interval
+    acquisitionStopped = QtCore.pyqtSignal()
+    shakerCalibrationProgress = QtCore.pyqtSignal(int, int)  # points done, total
+    shakerCalibrationPoint = QtCore.pyqtSignal(dict)
+    shakerCalibrationFinished = QtCore.pyqtSignal(dict)
+    error = QtCore.pyqtSignal(Exception)
+
+    def __init__(self, engine=None):
+        super().__init__()
+
+        self.logger = logging.getLogger('{}.FastScanThreadManager'.format(__name__))
+        self.logger.info('Created Thread Manager')
+
+        self.engine = FastScanEngine() if engine is None else engine
+        self.engine.subscribe('stream', self.newStreamerData.emit)
+        self.engine.subscribe('projected', self.newProcessedData.emit)
+        self.engine.subscribe('fit', self.newFitResult.emit)
+        self.engine.subscribe('average', self.newAverage.emit)
+        self.engine.subscribe('metrics', self.newMetrics.emit)
+        self.engine.subscribe('finished', self.acquisitionStopped.emit)
+        self.engine.subscribe('calibration_progress', self.shakerCalibrationProgress.emit)
+        self.engine.subscribe('calibration_point', self.shakerCalibrationPoint.emit)
+        self.engine.subscribe('calibration', self.shakerCalibrationFinished.emit)
+        self.engine.subscribe('error', self.error.emit)
+
+        self.pool = QtCore.QThreadPool()  # runs the blocking engine calls
+
+    @QtCore.pyqtSlot()
+    def start_streamer(self, config=None):
+        """ Start the acquisition, see FastScanEngine.start."""
+        self.engine.start(config)
+
+    @QtCore.pyqtSlot()
+    def stop_streamer(self):
+        """ Stop the acquisition thread."""
+        self.logger.debug('\n\nFastScan Streamer is stopping.\n\n')
+        self.engine.stop()
+
+    def create_streamer(self):
+        self.engine.create_streamer()
+
+    def fit_autocorrelation(self, da):
+        """ Fit the autocorrelation function in a thread, the result is emitted by newFitResult."""
+        self.engine.fit_autocorrelation(da)
+
+    @QtCore.pyqtSlot()
+    def reset_data(self):
+        """ Reset the data in memory, by reinitializing all data containers.
+        """
+        # TODO: add popup check window
+        self.engine.reset_data()
+
+    def save_data(self, filename, all_data=True):
+        """ Save data contained in memory, see FastScanEngine.save_data."""
+        self.engine.save_data(filename, all_data)
+
+    def start_file_stream(self, filename, raw=False, compression='gzip'):
+        """ Save every frame to file during acquisition, see FastScanEngine.start_file_stream."""
+        self.engine.start_file_stream(filename, raw, compression)
+
+    def stop_file_stream(self):
+        self.engine.stop_file_stream()
+
+    def start_iterative_measurement(self, temperatures, savename):
+        """ Starts a temperature dependence scan series in a worker thread.
+
+        See FastScanEngine.measure_temperature_series.
+        """
+        runnable = Runnable(self.engine.measure_temperature_series, temperatures, savename)
+        self.pool.start(runnable)
+
+    def wait(self, n, timeout=1000):
+        """ Gui safe waiting function.
+
+        Runs the event loop while waiting, so signals keep being handled.
+
+        Args:
+            n: int
+                number of milliseconds to wait
+            timeout: int
+                number of milliseconds after which the waiting will be terminated
+                notwithstanding n.
+        """
+        loop = QtCore.QEventLoop()
+        QtCore.QTimer.singleShot(min(n, timeout), loop.quit)
+        loop.exec_()
+
+    def calibrate_shaker(self, iterations, integration):
+        """ Shaker calibration, in a worker thread.
+
+        Measures the autocorrelation at iterations delay stage positions, and
+        stores the calibrated shaker_ps_per_step in the settings, see
+        FastScanEngine.calibrate_shaker. Progress is emitted by
+        shakerCalibrationProgress and shakerCalibrationPoint, the result by
+        shakerCalibrationFinished.
+
+        Args:
+            iterations:
+                number of delay stage positions to measure.
+            integration:
+                number of shaker cycles to integrate on for each iteration.
+        """
+        if self.streamerRunning:
+            self.logger.warning('Cannot run Shaker calibration while streamer is running')
+            return
+        runnable = Runnable(self.engine.calibrate_shaker, iterations, integration)
+        self.pool.start(runnable)
+
+    def stop_shaker_calibration(self):
+        if self.engine.calibration is not None:
+            self.engine.calibration.stop()
+
+    def close(self):
+        """ stop the streamer when closing this widget."""
+        self.engine.close()
+
+    ### Properties
+
+    @property
+    def config(self):
+        """ FastScanConfig of the current acquisition."""
+        return self.engine.config
+
+    @property
+    def metrics(self):
+        return self.engine.metrics
+
+    @property
+    def streamer(self):
+        return self.engine.streamer
+
+    @property
+    def streamerRunning(self):
+        return self.engine.streamer_running
+
+    @property
+    def averages(self):
+        return self.engine.averages
+
+    @property
+    def running_average(self):
+        return self.engine.running_average
+
+    @property
+    def streamer_average(self):
+        return self.engine.streamer_average
+
+    @property
+    def all_curves(self):
+        """ DataArray of the curves in the running average, oldest first."""
+        return self.engine.all_curves
+
+    @property
+    def n_projected(self):
+        return self.engine.n_projected
+
+    @property
+    def n_dropped(self):
+        """ Number of frames discarded because the stream queue was full."""
+        return self.engine.n_dropped
+
+    @property
+    def stream_qsize(self):
+        """ Number of streamer frames waiting to be projected."""
+        return self.engine.stream_qsize
+
+    @property
+    def n_pending(self):
+        """ Number of frames queued or being projected."""
+        return self.engine.n_pending
+
+    @property
+    def calculate_autocorrelation(self):
+        """ If True, fit the autocorrelation function to each new average."""
+        return self.engine.calculate_autocorrelation
+
+    @calculate_autocorrelation.setter
+    def calculate_autocorrelation(self, val):
+        self.engine.calculate_autocorrelation = val
+
+    @property
+    def stream_queue_size(self):
+        """ Maximum number of streamer frames waiting to be projected."""
+        size = parse_setting('fastscan', 'stream_queue_size')
+        return 100 if size is None else size
+
+    @property
+    def stream_queue_policy(self):
+        """ What to do when the stream queue is full: drop_oldest, drop_newest or block."""
+        policy = parse_setting('fastscan', 'stream_queue_policy')
+        return 'drop_oldest' if policy is None else policy
+
+    @stream_queue_policy.setter
+    def stream_queue_policy(self, val):
+        assert val in ('drop_oldest', 'drop_newest', 'block'), 'policy must be drop_oldest, drop_newest or block'
+        write_setting(val, 'fastscan', 'stream_queue_policy')
+
+    @property
+    def processing_backend(self):
+        """ Where frames are projected: 'threads' (QThreadPool) or 'processes'."""
+        backend = parse_setting('fastscan', 'processing_backend')
+        return 'threads' if backend is None else backend
+
+    @processing_backend.setter
+    def processing_backend(self, val):
+        assert val in ('threads', 'processes'), 'processing backend must be threads or processes'
+        write_setting(val, 'fastscan', 'processing_backend')
+
+    @property
+    def dark_control(self):
+        """ State of dark control. If True it's on."""
+        return parse_setting('fastscan', 'dark_control')
+
+    @dark_control.setter
+    def dark_control(self, val):
+        assert isinstance(val, bool), 'dark control must be boolean.'
+        write_setting(val, 'fastscan', 'dark_control')
+
+    @property
+    def use_r0(self):
+        """ Choose to output DR/R or DR. If True it's DR/R."""
+        return parse_setting('fastscan', 'use_r0')
+
+    @use_r0.setter
+    def use_r0(self, val):
+        assert isinstance(val, bool), 'use_r0 must be boolean.'
+        write_setting(val, 'fastscan', 'use_r0')
+
+    @property
+    def projector_backend(self):
+        """ Implementation used to bin the stream data: cython, cython_parallel, numpy or python."""
+        backend = parse_setting('fastscan', 'projector_backend')
+        return 'cython' if backend is None else backend
+
+    @projector_backend.setter
+    def projector_backend(self, val):
+        assert val in PROJECTOR_BACKENDS, 'projector backend must be one of {}'.format(PROJECTOR_BACKENDS)
+        write_setting(val, 'fastscan', 'projector_backend')
+
+    @property
+    def n_processors(self):
+        """ Number of processors to use for workers."""
+        return parse_setting('fastscan', 'n_processors')
+
+    @n_processors.setter
+    def n_processors(self, val):
+        assert isinstance(val, int), 'dark control must be boolean.'
+        assert val < os.cpu_count(), 'Too many processors, cant be more than cpu count: {}'.format(os.cpu_count())
+        write_setting(val, 'fastscan', 'n_processors')
+        self.create_processors()
+
+    @property
+    def projector_threads(self):
+        """ Threads of the cython_parallel backend, in each projector worker."""
+        n_threads = parse_setting('fastscan', 'projector_threads')
+        return 1 if n_threads is None else n_threads
+
+    @projector_threads.setter
+    def projector_threads(self, val):
+        assert isinstance(val, int) and val > 0, 'projector_threads must be a positive integer.'
+        assert val * self.n_processors <= os.cpu_count(), \
+            'Too many threads, n_processors * projector_threads cant be more than cpu count: {}'.format(os.cpu_count())
+        write_setting(val, 'fastscan', 'projector_threads')
+
+    @property
+    def n_averages(self):
+        """ Number of averages to keep in the running average memory."""
+        return parse_setting('fastscan', 'n_averages')
+
+    @n_averages.setter
+    def n_averages(self, val):
+        assert val > 0, 'cannot set below 1'
+        write_setting(val, 'fastscan', 'n_averages')
+        self._n_averages = val
+        self.logger.debug('n_averages set to {}'.format(val))
+
+    @property
+    def n_samples(self):
+        """ Number of laser pulses to measure at each acquisition trigger pulse. """
+        return parse_setting('fastscan', 'n_samples')
+
+    @n_samples.setter
+    def n_samples(self, val):
+        assert val > 0, 'cannot set below 1'
+        write_setting(val, 'fastscan', 'n_samples')
+        self.logger.debug('n_samples set to {}'.format(val))
+
+    @property
+    def shaker_gain(self):
+        """ Shaker position gain as in ScanDelay software."""
+
+        return parse_setting('fastscan', 'shaker_gain')
+
+    @shaker_gain.setter
+    def shaker_gain(self, val):
+        if isinstance(val, str): val = int(val)
+        assert val in [1, 10, 100], 'gain can be 1,10,100 only'
+        write_setting(val, 'fastscan', 'shaker_gain')
+        self.logger.debug('n_samples set to {}'.format(val))
+
+    @property
+    def shaker_amplitude(self):
+        """ Peak to peak amplitude of the shaker scan, in ps."""
+        return parse_setting('fastscan', 'shaker_amplitude')
+
+    @property
+    def fixed_time_grid(self):
+        """ If True, project all frames on the same time grid."""
+        return parse_setting('fastscan', 'fixed_time_grid')
+
+    @property
+    def shaker_position_step(self):
+        """ Shaker position ADC step size in v"""
+        return parse_setting('fastscan', 'shaker_position_step')
+
+    @property
+    def shaker_ps_per_step(self):
+        """ Shaker position ADC step size in ps"""
+        return parse_setting('fastscan', 'shaker_ps_per_step')
+
+    @property
+    def shaker_time_step(self):
+        """ Shaker digital step in ps.
+
+        Takes into account ADC conversion and shaker gain to return the minimum
+        step between two points converted from the shaker analog position signal.
+        This also defines the time resolution of the measurement.
+
+        Returns: float
+
+        """
+        return self.shaker_ps_per_step / self.shaker_gain
+
+    @property
+    def delay_stage(self):
+        """ Delay stage used by the shaker calibration, None to use the simulated one."""
+        return self.engine.delay_stage
+
+    @delay_stage.setter
+    def delay_stage(self, stage):
+        self.engine.delay_stage = stage
+
+    @property
+    def stage_position(self):
+        """ Position of the probe delay stage."""
+        return self.delay_stage.position_get()
+
+    @stage_position.setter
+    def stage_position(self, val):
+        self.delay_stage.move_absolute(val)
+
+
+
+class RunnableSignals(QtCore.QObject):
+    """
+    Defines the signals available from a running worker thread.
+    Supported signals are:
+    finished
+        No data
+    error
+        `tuple` (exctype, value, traceback.format_exc() )
+    result
+        `object` data returned from processing, anything
+    progress
+        `int` indicating % progress
+    """
+    finished = QtCore.pyqtSignal()
+    error = QtCore.pyqtSignal(tuple)
+    result = QtCore.pyqtSignal(object)
+    progress = QtCore.pyqtSignal(int)
+
+
+class Runnable(QtCore.QRunnable):
+    '''
+    Worker thread
+    Inherits from QRunnable to handler worker thread setup, signals
+    and wrap-up.
+    :param callback: The function callback to run on this worker
+    :thread. Supplied args and
+    kwargs will be passed through to the runner.
+    :type callback: function
+    :param args: Arguments to pass to the callback function
+    :param kwargs: Keywords to pass to the callback function
+    :
+    '''
+
+    def __init__(self, fn, *args, **kwargs):
+        super(Runnable, self).__init__()
+        # Store constructor arguments (re-used for processing)
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.signals = RunnableSignals()
+        # Add the callback to our kwargs
+        # kwargs['progress_callback'] = self.signals.progress
+
+    @QtCore.pyqtSlot()
+    def run(self):
+        '''
+        Initialise the runner function with passed args, kwargs.
+        '''
+        # Retrieve args/kwargs here; and fire processing using them
+        try:
+            result = self.fn(*self.args, **self.kwargs)
+        except:
+            traceback.print_exc()
+            exctype, value = sys.exc_info()[:2]
+            self.signals.error.emit((exctype, value, traceback.format_exc()))
+        else:
+            self.signals.result.emit(result)  # Return the result of the processing
+        finally:
+            self.signals.finished.emit()  # Done
+
+
+# -----------------------------------------------------------------------------
+#       Processor
+# -----------------------------------------------------------------------------
+# DEPRECATED:
+class FastScanProcessor(QtCore.QObject):
+    isReady = QtCore.pyqtSignal(int)
+    finished = QtCore.pyqtSignal()
+    newData = QtCore.pyqtSignal(xr.DataArray)
+    newFit = QtCore.pyqtSignal(dict)
+    error = QtCore.pyqtSignal(Exception)
+
+    def __init__(self, id):
+        super().__init__()
+        self.logger = logging.getLogger('{}.FastScanProcessor'.format(__name__))
+        self.logger.debug('Created FastScanProcessor: id={}'.format(id))
+        self.id = id
+
+    def initialize(self):
+        self.isReady.emit(self.id)
+
+    @QtCore.pyqtSlot()
+    def project(self, stream_data, use_dark_control=True):
+        """ project data from streamer format to 1d time trace
+
+        creates bins from digitizing the stage positions measured channel of the
+        stream data. Values from the signal channel are assigned to the corresponding
+        bin from the stage positions. if Dark Control is true, values where dc
+        is true are added, while where dark control is false, it is substracted.
+
+        :param stream_data:
+        :param use_dark_control:
+        :return:
+            xarray containing projected data and relative time scale.
+
+        """
+        time.sleep(5)
+        self.logger.debug('Processor ID:{} started processing data with shape {}'.format(self.id, stream_data.shape))
+        t0 = time.time()
+        adc_step = parse_setting('fastscan', 'shaker_position_step')
+        ps_per_step = parse_setting('fastscan', 'shaker_ps_per_step')  # ADC step size - corresponds to 25fs
+        ps_per_step *= parse_setting('fastscan', 'shaker_gain')  # correct for shaker gain factor
+
+        try:
+            result = project(stream_data, use_dark_control=use_dark_control,
+                             adc_step=adc_step, time_step=ps_per_step)
+            self.newData.emit(result)
+
+            self.logger.debug('Projected {} points to a {} pts array, with {} nans in : {:.2f} ms'.format(
+                stream_data.shape[1], result.shape,
+                len(result) - len(result[np.isfinite(result)]),
+                1000 * (time.time() - t0)))
+
+        except Exception as e:
+            self.logger.warning(
+                'failed to project stream_data.\nERROR: {}'.format(e))
+            self.error.emit(e)
+
+        time.sleep(0.002)
+        self.isReady.emit(self.id)
+        self.logger.debug('Processor ID:{} is ready for new stream_data'.format(self.id))
+
+    @QtCore.pyqtSlot()
+    def fit_sech2(self, da):
+
+        try:
+            fitDict = fit_autocorrelation(da)
+            self.newFit.emit(fitDict)
+        except RuntimeError as e:
+            self.logger.critical('Fitting failed: Runtime error: {}'.format(e))
+        except Exception as e:
+            self.logger.critical('Fitting failed: {}'.format(e))
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+"""
+
+@author: Steinn Ymir Agustsson
+
+    Copyright (C) 2018 Steinn Ymir Agustsson
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+import logging
+import queue
+import threading
+import time
+
+import h5py
+import numpy as np
+import xarray as xr
+
+from utilities.data import settings_to_hdf
+
+
+class H5StreamWriter(object):
+    """ Append FastScan frames to an HDF5 file from a background thread.
+
+    Projected curves do not all have the same time axis, so they are stored
+    one after the other in the 1d datasets /frames/values, /frames/time and
+    /frames/counts, and /frames/index holds the start and length of each
+    curve. Raw streams, if enabled, are appended to /raw/streams, with shape
+    (n_frames, n_channels, n_samples).
+
+    All datasets are chunked and resizable. Frames are collected in memory
+    and written, then flushed, every chunk_frames frames, so memory use does
+    not grow with the length of the run. A crash loses the frames not yet
+    flushed: those waiting in the queue, up to queue_size, and up to one
+    chunk being collected. The file is opened in append mode, so writing
+    can continue in an existing stream file.
+
+    Adding never blocks, as frames come from the acquisition threads: if
+    the queue is full, the frame is dropped and counted in n_dropped. Once
+    writing failed, new frames are ignored.
+    """
+
+    def __init__(self, filename, raw_shape=None, chunk_frames=32, compression='gzip', queue_size=256,
+                 on_error=None):
+        """
+        Args:
+            filename: str
+                path of the h5 file. Adds .h5 extension if missing.
+            raw_shape: tuple | None
+                (n_channels, n_samples) of the raw streams. If None, raw
+                streams are not stored.
+            chunk_frames: int
+                number of frames written at once.
+            compression: str | None
+                h5py compression filter of the datasets, as 'gzip' or 'lzf'.
+            queue_size: int
+                maximum number of frames waiting to be written. Frames added
+                when the queue is full are dropped.
+            on_error: callable
+                called with the exception if writing fails.
+        """
+        self.logger = logging.getLogger('{}.H5StreamWriter'.format(__name__))
+        if not filename.endswith('.h5'):
+            filename += '.h5'
+        self.filename = filename
+        self.raw_shape = raw_shape
+        self.chunk_frames = chunk_frames
+        self.compression = compression
+        self.on_error = on_error
+        self.n_frames = 0  # projected frames written to file
+        self.n_raw = 0  # raw streams written to file
+        self.n_dropped = 0  # frames and raw streams dropped because the queue was full
+        self.error = None  # exception which stopped the writer, if any
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._frames = []
+        self._raw = []
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        self.logger.info('Streaming frames to {}'.format(self.filename))
+
+    @property
+    def store_raw(self):
+        return self.raw_shape is not None
+
+    def _put(self, item):
+        """ Queue an item without blocking.
+
+        Returns:
+            False if the item was dropped, because the queue is full or
+            writing failed, else True.
+        """
+        if self.error is not None:
+            return False
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self.n_dropped += 1
+            self.logger.debug('Stream file queue full: dropped {}'.format(item[0]))
+            return False
+        return True
+
+    def add_frame(self, da, spos_fit_pars=None):
+        """ Queue a projected curve for writing.
+
+        Args:
+            da: xr.DataArray
+                projected curve, as given by projector.
+            spos_fit_pars: ndarray
+                shaker position fit parameters of the frame.
+        Returns:
+            False if the frame was dropped, else True.
+        """
+        if self.error is not None:
+            return False
+        values = np.asarray(da.values, dtype=np.float64)
+        if 'counts' in da.coords:
+            counts = np.asarray(da.counts.values, dtype=np.float64)
+        else:
+            counts = np.isfinite(values).astype(np.float64)
+        if spos_fit_pars is None:
+            spos_fit_pars = np.full(4, np.nan)
+        return self._put(('frame', values, np.asarray(da.time.values, dtype=np.float64), counts,
+                          np.asarray(spos_fit_pars, dtype=np.float64), da.attrs.get('config_version', -1),
+                          time.time()))
+
+    def add_raw(self, stream_data):
+        """ Queue a copy of a raw stream for writing, if raw streams are stored.
+
+        Returns:
+            False if the stream was dropped, else True.
+        """
+        if not self.store_raw:
+            return True
+        if self.error is not None:
+            return False
+        if stream_data.shape != tuple(self.raw_shape):
+            self.logger.warning('raw stream of shape {} not saved in file of {} streams'.format(
+                stream_data.shape, self.raw_shape))
+            return False
+        return self._put(('raw', np.array(stream_data, dtype=np.float64), time.time()))
+
+    def add_config(self, config):
+        """ Queue a FastScanConfig, written in /configs/<version>."""
+        return self._put(('config', config))
+
+    def close(self):
+        """ Write the remaining frames and close the file."""
+        if self.error is None:
+            self._queue.put(None)
+        self._thread.join()
+        self.logger.info('Stream file {} closed: {} frames, {} raw streams, {} dropped'.format(
+            self.filename, self.n_frames, self.n_raw, self.n_dropped))
+
+    def _run(self):
+        try:
+            with h5py.File(self.filename, 'a') as f:
+                self._create_datasets(f)
+                while True:
+                    item = self._queue.get()
+                    if item is None:
+                        break
+                    kind = item[0]
+                    if kind == 'frame':
+                        self._frames.append(item[1:])
+                        if len(self._frames) >= self.chunk_frames:
+                            self._write_frames(f)
+                    elif kind == 'raw':
+                        self._raw.append(item[1:])
+                        if len(self._raw) >= self.chunk_frames:
+                            self._write_raw(f)
+                    elif kind == 'config':
+                        self._write_config(f, item[1])
+                self._write_frames(f)
+                self._write_raw(f)
+        except Exception as e:
+            self.error = e
+            self.logger.critical('Failed writing stream file {}: {}'.format(self.filename, e))
+            while True:  # frames added from now on are ignored
+                try:
+                    self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            if self.on_error is not None:
+                self.on_error(e)
+
+    def _dataset(self, f, name, shape, dtype=np.float64, chunks=None):
+        """ Get or create a resizable dataset, growing along the first axis."""
+        if name in f:
+            return f[name]
+        if chunks is None:
+            chunks = (self.chunk_frames,) + tuple(shape[1:])
+        return f.create_dataset(name, shape=shape, maxshape=(None,) + tuple(shape[1:]), dtype=dtype,
+                                chunks=chunks, compression=self.compression)
+
+    def _create_datasets(self, f):
+        self._dataset(f, '/frames/values', (0,), chunks=(16384,))
+        self._dataset(f, '/frames/time', (0,), chunks=(16384,))
+        self._dataset(f, '/frames/counts', (0,), chunks=(16384,))
+        self._dataset(f, '/frames/index', (0, 2), dtype=np.int64)
+        self._dataset(f, '/frames/spos_fit_pars', (0, 4))
+        self._dataset(f, '/frames/config_version', (0,), dtype=np.int64)
+        self._dataset(f, '/frames/timestamp', (0,))
+        if self.store_raw:
+            self._dataset(f, '/raw/streams', (0,) + tuple(self.raw_shape), chunks=(1,) + tuple(self.raw_shape))
+            self._dataset(f, '/raw/timestamp', (0,))
+        self.n_frames = len(f['/frames/index'])
+        self.n_raw = len(f['/raw/timestamp']) if self.store_raw else 0
+
+    @staticmethod
+    def _append(dataset, data):
+        start = dataset.shape[0]
+        dataset.resize(start + len(data), axis=0)
+        dataset[start:] = data
+        return start
+
+    def _write_frames(self, f):
+        if not self._frames:
+            return
+        values, time_axis, counts, spos_fit_pars, versions, timestamps = zip(*self._frames)
+        lengths = np.array([len(v) for v in values], dtype=np.int64)
+        start = self._append(f['/frames/values'], np.concatenate(values))
+        self._append(f['/frames/time'], np.concatenate(time_axis))
+        self._append(f['/frames/counts'], np.concatenate(counts))
+        starts = start + np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        self._append(f['/frames/index'], np.stack([starts, lengths], axis=1))
+        self._append(f['/frames/spos_fit_pars'], np.stack(spos_fit_pars))
+        self._append(f['/frames/config_version'], np.array(versions, dtype=np.int64))
+        self._append(f['/frames/timestamp'], np.array(timestamps))
+        self.n_frames += len(self._frames)
+        self._frames = []
+        f.flush()
+
+    def _write_raw(self, f):
+        if not self._raw:
+            return
+        streams, timestamps = zip(*self._raw)
+        self._append(f['/raw/streams'], np.stack(streams))
+        self._append(f['/raw/timestamp'], np.array(timestamps))
+        self.n_raw += len(self._raw)
+        self._raw = []
+        f.flush()
+
+    @staticmethod
+    def _write_config(f, config):
+        group = '/configs/{}'.format(config.version)
+        if group not in f:
+            settings_to_hdf(f, group, config.as_dict())
+
+
+def read_frames(filename):
+    """ Read the projected curves of a stream file.
+
+    Returns:
+        list of xr.DataArray, one per frame, with 'counts' coordinate and
+        'config_version' attribute.
+    """
+    with h5py.File(filename, 'r') as f:
+        values = f['/frames/values'][()]
+        time_axis = f['/frames/time'][()]
+        counts = f['/frames/counts'][()]
+        index = f['/frames/index'][()]
+        versions = f['/frames/config_version'][()]
+    frames = []
+    for (start, length), version in zip(index, versions):
+        s = slice(start, start + length)
+        frames.append(xr.DataArray(values[s], coords={'time': time_axis[s], 'counts': ('time', counts[s])},
+                                   dims='time', attrs={'config_version': int(version)}))
+    return frames
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+"""
+
+@author: Steinn Ymir Agustsson
+
+    Copyright (C) 2018 Steinn Ymir Agustsson
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+import logging
+import multiprocessing as mp
+import queue
+import threading
+import traceback
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from utilities.misc import LazyModule
+
+xr = LazyModule('xarray')  # imported on first use
+
+
+def _attach_shared_memory(name):
+    """ Attach to existing shared memory, leaving its cleanup to the owner.
+
+    Before python 3.13 attaching always registers the block with the resource
+    tracker, which spawned workers share with the owner, so the owner's
+    unlink still clears it.
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
+
+
+class FramePool(object):
+    """ Pool of preallocated stream frames.
+
+    Each slot holds one frame of shape (n_channels, n_samples). Slots are
+    handed out with acquire and given back with release once the frame has
+    been consumed, so that frames are never overwritten while in use and no
+    new arrays are allocated during acquisition.
+    """
+
+    def __init__(self, n_slots, n_channels, n_samples):
+        self.shape = (n_slots, n_channels, n_samples)
+        self.frames = self._allocate()
+        self._free = queue.Queue()
+        for slot in range(n_slots):
+            self._free.put(slot)
+
+    def _allocate(self):
+        return np.zeros(self.shape, dtype=np.float64)
+
+    @property
+    def n_slots(self):
+        return self.shape[0]
+
+    @property
+    def n_free(self):
+        return self._free.qsize()
+
+    def acquire(self, block=False, timeout=None):
+        """ Get the index of a free slot, or None if none is available."""
+        try:
+            return self._free.get(block=block, timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def release(self, slot):
+        self._free.put(slot)
+
+    def view(self, slot):
+        """ ndarray view on the frame in the given slot."""
+        return self.frames[slot]
+
+    def close(self):
+        self.frames = None
+
+
+class SharedFramePool(FramePool):
+    """ FramePool in shared memory.
+
+    Only slot indices need to be sent between processes. Worker processes
+    attach to the pool created by the main process by passing its name.
+    """
+
+    def __init__(self, n_slots, n_channels, n_samples, name=None):
+        self.owner = name is None
+        self._name = name
+        super().__init__(n_slots, n_channels, n_samples)
+
+    def _allocate(self):
+        if self.owner:
+            size = int(np.prod(self.shape)) * np.dtype(np.float64).itemsize
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            self.shm = _attach_shared_memory(self._name)
+        return np.ndarray(self.shape, dtype=np.float64, buffer=self.shm.buf)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def close(self):
+        super().close()
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def _write_result(buffer, result):
+    """ Write a projected curve in a flat frame buffer.
+
+    Returns the length of the curve, whether it had counts and its attributes,
+    or None if it does not fit in the buffer.
+    """
+    output = result[0]
+    n = len(output)
+    has_counts = 'counts' in output.coords
+    if (2 + has_counts) * n > len(buffer):
+        return None
+    buffer[:n] = output.values
+    buffer[n:2 * n] = output.time.values
+    if has_counts:
+        buffer[2 * n:3 * n] = output.counts.values
+    return n, has_counts, dict(output.attrs)
+
+
+def _read_result(buffer, n, has_counts, attrs):
+    """ Rebuild the projected curve written by _write_result."""
+    coords = {'time': buffer[n:2 * n].copy()}
+    if has_counts:
+        coords['counts'] = ('time', buffer[2 * n:3 * n].copy())
+    return xr.DataArray(buffer[:n].copy(), coords=coords, dims='time', attrs=attrs)
+
+
+def projector_worker(shm_name, shape, tasks, results):
+    """ Worker process projecting the frames found in shared memory.
+
+    Receives (slot, kwargs) from the tasks queue and runs projector on the
+    frame in that slot. The projected curve is written back in the same slot,
+    and (slot, length, has_counts, attrs, spos_fit_pars, fit_time,
+    fit_residual) is put on the results queue. Curves too large for the slot are sent
+    through the queue instead, with length None.
+    """
+    from measurement.fastscan import projector
+
+    pool = SharedFramePool(*shape, name=shm_name)
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            slot, kwargs = task
+            try:
+                result = projector(pool.view(slot), **kwargs)
+                flat = pool.view(slot).reshape(-1)
+                written = _write_result(flat, result)
+                if written is None:
+                    results.put((slot, None, result[0]) + tuple(result[1:]))
+                else:
+                    results.put((slot,) + written + tuple(result[1:]))
+            except Exception:
+                results.put((slot, 'error', traceback.format_exc()))
+    finally:
+        pool.close()
+
+
+class ProjectorProcessPool(object):
+    """ Pool of worker processes projecting frames from a SharedFramePool.
+
+    Frames are written in a free slot of the pool and submitted by index. The
+    workers write the projected curve back in the slot, so no array is
+    pickled. A collector thread rebuilds the results, frees the slots and
+    calls on_result with the same tuple returned by projector, or on_error
+    if the projection failed. A frame counts in n_pending until its
+    callback has returned.
+    """
+
+    def __init__(self, n_processes, n_channels, n_samples, n_slots=None, on_result=None, on_error=None):
+        self.logger = logging.getLogger('{}.ProjectorProcessPool'.format(__name__))
+        if n_slots is None:
+            n_slots = 2 * n_processes
+        self.frames = SharedFramePool(n_slots, n_channels, n_samples)
+        self.on_result = on_result
+        self.on_error = on_error
+
+        ctx = mp.get_context('spawn')
+        self._tasks = ctx.Queue()
+        self._results = ctx.Queue()
+        self.processes = [ctx.Process(target=projector_worker,
+                                      args=(self.frames.name, self.frames.shape, self._tasks, self._results),
+                                      daemon=True)
+                          for _ in range(n_processes)]
+        for p in self.processes:
+            p.start()
+        self.n_pending = 0
+        self._lock = threading.Lock()
+        self._collector = threading.Thread(target=self._collect, daemon=True)
+        self._collector.start()
+        self.logger.info('Started {} projector processes with {} shared slots'.format(n_processes, n_slots))
+
+    @property
+    def shape(self):
+        """ (n_channels, n_samples) of the frames handled by the pool."""
+        return self.frames.shape[1:]
+
+    def submit(self, stream_data, **kwargs):
+        """ Copy a frame in a free slot and queue it for projection.
+
+        Returns:
+            True if the frame was queued, False if no slot was free.
+        """
+        slot = self.frames.acquire()
+        if slot is None:
+            return False
+        self.frames.view(slot)[...] = stream_data
+        self.submit_slot(slot, **kwargs)
+        return True
+
+    def submit_slot(self, slot, **kwargs):
+        """ Queue a slot, already filled with a frame, for projection."""
+        with self._lock:
+            self.n_pending += 1
+        self._tasks.put((slot, kwargs))
+
+    def _collect(self):
+        while True:
+            message = self._results.get()
+            if message is None:
+                break
+            slot, n = message[:2]
+            try:
+                try:
+                    if n == 'error':
+                        result = None
+                    elif n is None:
+                        result = (message[2],) + tuple(message[3:])
+                    else:
+                        output = _read_result(self.frames.view(slot).reshape(-1), n, *message[2:4])
+                        result = (output,) + tuple(message[4:])
+                finally:
+                    self.frames.release(slot)  # the result was copied out of the slot
+                if result is None:
+                    self.logger.warning('projection failed:\n{}'.format(message[2]))
+                    if self.on_error is not None:
+                        self.on_error(RuntimeError(message[2]))
+                elif self.on_result is not None:
+                    self.on_result(result)
+            except Exception:
+                self.logger.warning('handling the projection result failed:\n{}'.format(traceback.format_exc()))
+            finally:  # pending until handled, so n_pending == 0 means all results are in
+                with self._lock:
+                    self.n_pending -= 1
+
+    def shutdown(self):
+        """ Stop the workers and free the shared memory."""
+        for _ in self.processes:
+            self._tasks.put(None)
+        for p in self.processes:
+            p.join(timeout=5)
+            if p.is_alive():
+                p.terminate()
+        self._results.put(None)
+        self._collector.join(timeout=5)
+        self.frames.close()
+        self.logger.info('Projector processes stopped')
+
+
+if __name__ == '__main__':
+    pass
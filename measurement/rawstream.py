@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+
+@author: Steinn Ymir Agustsson
+
+    Copyright (C) 2018 Steinn Ymir Agustsson
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+import json
+import logging
+import os
+import time
+
+import numpy as np
+
+RAW_DTYPE = np.float64
+
+
+def _raw_paths(filename):
+    """ Paths of the frames, timestamps and header files of a recording."""
+    base = os.path.splitext(filename)[0] if filename.endswith('.raw') else filename
+    return base + '.raw', base + '.times', base + '.json'
+
+
+class RawStreamRecorder(object):
+    """ Record raw streamer frames to a memory-mappable file.
+
+    Frames are appended as float64 to <filename>.raw, in C order, and their
+    acquisition time to <filename>.times. The frame shape is stored in
+    <filename>.json. Recording into an existing file with the same frame
+    shape appends to it. The number of frames is given by the file size, so
+    a recording interrupted by a crash stays readable.
+    """
+
+    def __init__(self, filename, n_channels, n_samples):
+        self.logger = logging.getLogger('{}.RawStreamRecorder'.format(__name__))
+        self.shape = (n_channels, n_samples)
+        raw_path, times_path, header_path = _raw_paths(filename)
+        if os.path.isfile(header_path):
+            with open(header_path) as f:
+                header = json.load(f)
+            if tuple(header['shape']) != self.shape:
+                raise ValueError('{} holds frames of shape {}, cannot record frames of shape {}'.format(
+                    raw_path, tuple(header['shape']), self.shape))
+        else:
+            with open(header_path, 'w') as f:
+                json.dump({'shape': self.shape, 'dtype': np.dtype(RAW_DTYPE).str}, f)
+        self.filename = raw_path
+        self._frames = open(raw_path, 'ab')
+        self._times = open(times_path, 'ab')
+        self.n_frames = 0
+        self.logger.info('Recording raw streams to {}'.format(raw_path))
+
+    def add(self, stream_data):
+        """ Append a frame to the recording."""
+        if stream_data.shape != self.shape:
+            raise ValueError('frame of shape {} does not fit a recording of shape {}'.format(
+                stream_data.shape, self.shape))
+        self._frames.write(np.ascontiguousarray(stream_data, dtype=RAW_DTYPE).tobytes())
+        self._times.write(np.array([time.time()], dtype=np.float64).tobytes())
+        self.n_frames += 1
+
+    def close(self):
+        self._frames.close()
+        self._times.close()
+        self.logger.info('Recorded {} raw streams to {}'.format(self.n_frames, self.filename))
+
+
+class RawStreamFile(object):
+    """ Read access to a recording made by RawStreamRecorder.
+
+    frames is a read only memory map of shape (n_frames, n_channels,
+    n_samples), so recordings larger than memory can be replayed.
+    """
+
+    def __init__(self, filename):
+        raw_path, times_path, header_path = _raw_paths(filename)
+        with open(header_path) as f:
+            header = json.load(f)
+        self.filename = raw_path
+        self.shape = tuple(header['shape'])
+        dtype = np.dtype(header['dtype'])
+        frame_size = int(np.prod(self.shape)) * dtype.itemsize
+        n_frames = os.path.getsize(raw_path) // frame_size  # ignore a partially written last frame
+        self.timestamps = np.fromfile(times_path, dtype=np.float64)
+        n_frames = min(n_frames, len(self.timestamps))
+        self.timestamps = self.timestamps[:n_frames]
+        if n_frames > 0:
+            self.frames = np.memmap(raw_path, dtype=dtype, mode='r', shape=(n_frames,) + self.shape)
+        else:
+            self.frames = np.zeros((0,) + self.shape, dtype=dtype)
+
+    @property
+    def n_channels(self):
+        return self.shape[0]
+
+    @property
+    def n_samples(self):
+        return self.shape[1]
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __getitem__(self, item):
+        return self.frames[item]
+
+
+if __name__ == '__main__':
+    pass
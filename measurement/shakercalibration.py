@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+"""
+
+@author: Steinn Ymir Agustsson
+
+    Copyright (C) 2018 Steinn Ymir Agustsson
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from measurement.fastscan import FastScanConfig, FastScanStreamer, fit_autocorrelation, projector
+from utilities.settings import parse_setting, write_setting
+
+
+def fit_calibration_line(positions, centers, threshold=3.5):
+    """ Robust linear fit of the autocorrelation centers against the stage positions.
+
+    The line is first estimated by the Theil-Sen estimator, the median of
+    the slopes between all pairs of points, which is not affected by a few
+    outliers. Points further than threshold robust standard deviations
+    (1.4826 times the median absolute deviation of the residuals) from it
+    are rejected, and the line is fitted again by least squares on the
+    remaining ones.
+
+    Args:
+        positions: array
+            stage positions, in ps.
+        centers: array
+            fitted autocorrelation centers, in ps of the shaker time axis.
+        threshold: float
+            rejection threshold, in robust standard deviations.
+    Returns:
+        dict with 'slope' and 'intercept' of centers = slope * positions + intercept,
+        'slope_err', and 'inliers', the bool mask of the points used.
+    """
+    x = np.asarray(positions, dtype=np.float64)
+    y = np.asarray(centers, dtype=np.float64)
+    if len(x) < 3:
+        raise ValueError('At least 3 calibration points are needed, got {}'.format(len(x)))
+    i, j = np.triu_indices(len(x), k=1)
+    dx = x[j] - x[i]
+    valid = dx != 0
+    slope = np.median((y[j] - y[i])[valid] / dx[valid])
+    intercept = np.median(y - slope * x)
+
+    residuals = y - slope * x - intercept
+    sigma = 1.4826 * np.median(np.abs(residuals - np.median(residuals)))
+    if sigma > 0:
+        inliers = np.abs(residuals) <= threshold * sigma
+    else:
+        inliers = np.ones(len(x), dtype=bool)
+
+    xi, yi = x[inliers], y[inliers]
+    if len(xi) >= 3 and np.ptp(xi) > 0:
+        slope, intercept = np.polyfit(xi, yi, 1)
+    residuals = yi - slope * xi - intercept
+    dof = len(xi) - 2
+    if dof > 0:
+        slope_err = np.sqrt(np.sum(residuals ** 2) / dof / np.sum((xi - xi.mean()) ** 2))
+    else:
+        slope_err = np.nan
+    return {'slope': float(slope), 'intercept': float(intercept), 'slope_err': float(slope_err), 'inliers': inliers}
+
+
+class SimulatedStage(object):
+    """ Delay stage of the simulation, moving the simulated pulse center."""
+
+    def move_absolute(self, position):
+        write_setting(position, 'fastscan - simulation', 'center_position')
+
+    def position_get(self):
+        return parse_setting('fastscan - simulation', 'center_position')
+
+
+class ShakerCalibration(object):
+    """ Calibration of the shaker time axis against the delay stage.
+
+    The stage is moved over a range of positions, forth and back, and the
+    autocorrelation is measured at each. The center of the fitted peak
+    shifts with the stage position, by a factor slope which is 1 when
+    shaker_ps_per_step is right, so the calibrated value is
+    shaker_ps_per_step / slope.
+
+    The result is not written when the slope is not determined well enough,
+    as when the pulse does not move with the stage: its relative error must
+    be below max_slope_error and at least min_inliers points must remain
+    after outlier rejection.
+
+    Moving the stage and acquiring the next point overlaps with projecting
+    and fitting the previous one, which run in a worker thread. Progress is
+    passed to the callbacks, called from the thread producing it:
+        on_progress(n_done, n_points)
+        on_point(point): dict of index, position, center, fwhm and popt
+        on_finished(result): dict as returned by run
+        on_error(exception)
+    """
+
+    def __init__(self, delay_stage=None, n_points=20, integration=10, range_fraction=.7, threshold=3.5,
+                 max_slope_error=.05, min_inliers=5, config=None, on_progress=None, on_point=None,
+                 on_finished=None, on_error=None):
+        """
+        Args:
+            delay_stage: DelayStage
+                stage delaying the probe, moved in ps. When simulating, the
+                simulated pulse center is moved with it, or alone if None.
+            n_points: int
+                number of calibration points, half of them measured moving
+                forth, and half moving back.
+            integration: int
+                number of shaker cycles averaged at each point.
+            range_fraction: float
+                fraction of the shaker time range covered by the stage.
+            threshold: float
+                outlier rejection threshold, see fit_calibration_line.
+            max_slope_error: float
+                largest relative error of the slope accepted.
+            min_inliers: int
+                least number of points accepted by the line fit.
+            config: FastScanConfig
+                settings of the acquisition. Defaults to the current settings.
+        """
+        self.logger = logging.getLogger('{}.ShakerCalibration'.format(__name__))
+        self.config = FastScanConfig.from_settings() if config is None else config
+        if delay_stage is None and not self.config.simulate:
+            raise ValueError('A delay stage is needed to calibrate the shaker')
+        self.delay_stage = delay_stage
+        self.stages = [] if delay_stage is None else [delay_stage]  # stages moved to each position
+        if self.config.simulate and not isinstance(delay_stage, SimulatedStage):
+            self.stages.append(SimulatedStage())
+        self.n_points = n_points
+        self.integration = integration
+        self.range_fraction = range_fraction
+        self.threshold = threshold
+        self.max_slope_error = max_slope_error
+        self.min_inliers = max(min_inliers, 3)
+        self.on_progress = on_progress
+        self.on_point = on_point
+        self.on_finished = on_finished
+        self.on_error = on_error
+
+        self.points = []
+        self.result = None
+        self._should_stop = threading.Event()
+
+    def stop(self):
+        """ Stop after the current point, without writing the result."""
+        self._should_stop.set()
+
+    def run(self, write=True):
+        """ Measure all points and fit the calibration. Blocks until done.
+
+        Args:
+            write: bool
+                if True, store the calibrated shaker_ps_per_step in the settings.
+        Returns:
+            dict of 'shaker_ps_per_step', its error 'shaker_ps_per_step_err',
+            the line fit as given by fit_calibration_line, and 'points'.
+            None if stopped or failed.
+        """
+        self._should_stop.clear()
+        self.points = []
+        self.result = None
+        start_positions = [stage.position_get() for stage in self.stages]
+        try:
+            self._measure_points()
+            if self._should_stop.is_set():
+                self.logger.info('Shaker calibration stopped')
+                return None
+            self.result = self.calibrate(write)
+        except Exception as e:
+            self.logger.critical('Shaker calibration failed: {}'.format(e))
+            if self.on_error is not None:
+                self.on_error(e)
+            return None
+        finally:
+            for stage, position in zip(self.stages, start_positions):
+                stage.move_absolute(position)
+        if self.on_finished is not None:
+            self.on_finished(self.result)
+        return self.result
+
+    def calibration_positions(self, projected):
+        """ Stage positions, forth and back, over range_fraction of the time axis of projected."""
+        t_min = float(projected.time.min()) * self.range_fraction
+        t_max = float(projected.time.max()) * self.range_fraction
+        positions = np.linspace(t_min, t_max, max(self.n_points // 2, 2))
+        return np.concatenate((positions, positions[::-1]))
+
+    def calibrate(self, write=True):
+        """ Fit the measured points and compute shaker_ps_per_step.
+
+        Raises:
+            RuntimeError if too few points were fitted or the slope is not
+            determined well enough, in which case nothing is written.
+        """
+        good = [p for p in self.points if p['center'] is not None]
+        if len(good) < self.min_inliers:
+            raise RuntimeError('Autocorrelation fit failed on {} of {} points'.format(
+                len(self.points) - len(good), len(self.points)))
+        line = fit_calibration_line([p['position'] for p in good], [p['center'] for p in good], self.threshold)
+        slope = abs(line['slope'])
+        n_inliers = int(line['inliers'].sum())
+        if n_inliers < self.min_inliers:
+            raise RuntimeError('Only {} of {} calibration points are on the line fit, at least {} are needed'.format(
+                n_inliers, len(good), self.min_inliers))
+        if not slope > 0 or not line['slope_err'] / slope <= self.max_slope_error:
+            raise RuntimeError('Calibration slope {:.3g} +- {:.2g} is not determined well enough: '
+                               'does the pulse move with the stage?'.format(line['slope'], line['slope_err']))
+        ps_per_step = self.config.shaker_ps_per_step / slope
+        result = dict(line,
+                      shaker_ps_per_step=float(ps_per_step),
+                      shaker_ps_per_step_err=float(ps_per_step * line['slope_err'] / slope),
+                      points=good)
+        self.logger.info('Shaker calibration: shaker_ps_per_step = {:.5g} +- {:.2g}, {} of {} points used'.format(
+            ps_per_step, result['shaker_ps_per_step_err'], n_inliers, len(good)))
+        if write:
+            write_setting(float(ps_per_step), 'fastscan', 'shaker_ps_per_step')
+        return result
+
+    def _measure_points(self):
+        errors = []
+        streamer = FastScanStreamer(self.config, on_error=errors.append)
+        acquire = streamer.simulate_single_shot if self.config.simulate else streamer.measure_single_shot
+
+        def measure(integration):
+            stream = acquire(integration)
+            if stream is None:
+                raise errors[-1] if errors else RuntimeError('Acquisition failed')
+            return stream
+
+        projected = projector(measure(self.integration), config=self.config)[0]
+        positions = self.calibration_positions(projected)
+
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            futures = []
+            for index, position in enumerate(positions):
+                if self._should_stop.is_set():
+                    break
+                for stage in self.stages:
+                    stage.move_absolute(position)
+                stream = measure(self.integration)
+                futures.append(pool.submit(self._analyse, index, position, stream, len(positions)))
+            for future in futures:
+                future.result()  # raise errors of the worker
+
+    def _analyse(self, index, position, stream, n_points):
+        """ Project and fit one point, in the worker thread."""
+        with np.errstate(over='ignore'):
+            projected = projector(stream, config=self.config)[0]
+            popt = fit_autocorrelation(projected)['popt']
+        t = projected.time.values
+        fitted = np.any(popt != 0) and t.min() <= popt[1] <= t.max()
+        point = {'index': index,
+                 'position': float(position),
+                 'center': float(popt[1]) if fitted else None,  # None if the fit failed
+                 'fwhm': float(popt[2]) if fitted else None,
+                 'popt': popt,
+                 }
+        self.points.append(point)
+        if self.on_point is not None:
+            self.on_point(point)
+        if self.on_progress is not None:
+            self.on_progress(len(self.points), n_points)
+        return point
+
+
+if __name__ == '__main__':
+    pass
@@ -18,17 +18,31 @@
     You should have received a copy of the GNU General Public License
     along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+Builds the cython projector, measurement.cscripts.project, in place:
+
+    python setup.py build_ext --inplace
+
+This needs cython, numpy and a C compiler with OpenMP support. Without the
+compiled module, load_projector falls back to the numpy projector.
 """
 from distutils.core import setup, Extension
 from Cython.Build import cythonize
 # import py2exe
 import numpy
 import os
+import sys
 
+# OpenMP is required by the parallel (prange) projector
+if sys.platform == 'win32':
+    openmp_args = ['/openmp']
+else:
+    openmp_args = ['-fopenmp']
 
 extensions = [
     Extension("measurement.cscripts.project", [os.path.join("measurement", "cscripts", "project.pyx")],
-        include_dirs=[numpy.get_include()]),
+        include_dirs=[numpy.get_include()],
+        extra_compile_args=openmp_args,
+        extra_link_args=openmp_args if sys.platform != 'win32' else []),
 ]
 
 setup(
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the triggered read path of FastScanStreamer.
+
+Runs FastScanStreamer.measure_triggered, which reads each frame with
+AnalogMultiChannelReader.read_many_sample into a FramePool slot, against a
+mocked nidaqmx whose reader copies data already in memory. This measures
+the python side of the acquisition loop, from acquire_buffer to on_frame,
+without the card. For reference, the previous path, np.array(task.read(...))
+on each trigger, is timed on the same mocked task.
+
+    python tests/benchmark_acquisition.py [n_samples] [n_frames]
+
+@author: Steinn Ymir Agustsson
+"""
+import os
+import sys
+import time
+import types
+from unittest import mock
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class MockTask(object):
+    """ Stand-in for a multi channel nidaqmx.Task, holding one frame of data."""
+
+    def __init__(self, n_samples):
+        self.ai_channels = mock.Mock()
+        self.triggers = mock.Mock()
+        self.timing = mock.Mock()
+        self.in_stream = self
+        self.source = np.random.default_rng(0).random((4, n_samples))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def start(self):
+        pass
+
+    def read(self, number_of_samples_per_channel):
+        return self.source[:, :number_of_samples_per_channel].tolist()
+
+
+class MockReader(object):
+    """ Stand-in for stream_readers.AnalogMultiChannelReader on a MockTask."""
+
+    def __init__(self, in_stream):
+        self.source = in_stream.source
+
+    def read_many_sample(self, data, number_of_samples_per_channel):
+        np.copyto(data, self.source[:, :number_of_samples_per_channel])
+        return number_of_samples_per_channel
+
+
+def mock_nidaqmx(n_samples):
+    """ Modules to patch in sys.modules, replacing nidaqmx."""
+    nidaqmx = types.ModuleType('nidaqmx')
+    nidaqmx.Task = lambda: MockTask(n_samples)
+    nidaqmx.stream_readers = types.ModuleType('nidaqmx.stream_readers')
+    nidaqmx.stream_readers.AnalogMultiChannelReader = MockReader
+    nidaqmx.constants = types.ModuleType('nidaqmx.constants')
+    nidaqmx.constants.Edge = mock.Mock()
+    nidaqmx.constants.AcquisitionType = mock.Mock()
+    return {'nidaqmx': nidaqmx,
+            'nidaqmx.stream_readers': nidaqmx.stream_readers,
+            'nidaqmx.constants': nidaqmx.constants}
+
+
+def time_streamer(n_samples, n_frames, n_slots=8):
+    """ Seconds per frame of FastScanStreamer.measure_triggered, frames released at once."""
+    from measurement.fastscan import FastScanConfig, FastScanStreamer
+    from measurement.processpool import FramePool
+
+    config = FastScanConfig(simulate=False, acquisition_mode='triggered', n_samples=n_samples)
+    streamer = FastScanStreamer(config)
+    streamer.frame_pool = FramePool(n_slots, len(FastScanStreamer.niChannel_order), n_samples)
+    received = []
+
+    def on_frame(slot):
+        received.append(slot)
+        streamer.frame_pool.release(slot)
+        if len(received) == n_frames:
+            streamer.stop_acquisition()
+
+    streamer.on_frame = on_frame
+    streamer.on_error = lambda e: print('streamer error: {}'.format(e))
+    with mock.patch.dict(sys.modules, mock_nidaqmx(n_samples)):
+        t0 = time.perf_counter()
+        streamer.measure_triggered()
+        t = time.perf_counter() - t0
+    assert len(received) == n_frames, 'streamer stopped after {} frames'.format(len(received))
+    return t / n_frames
+
+
+def time_task_read(n_samples, n_frames):
+    """ Seconds per frame reading with np.array(task.read(...)), the path replaced by read_many_sample."""
+    task = MockTask(n_samples)
+    t0 = time.perf_counter()
+    for _ in range(n_frames):
+        np.array(task.read(number_of_samples_per_channel=n_samples))
+    return (time.perf_counter() - t0) / n_frames
+
+
+def main(n_samples=18000, n_frames=200):
+    t_streamer = time_streamer(n_samples, n_frames)
+    t_task = time_task_read(n_samples, n_frames)
+    print('frames of 4 x {} samples, {} frames'.format(n_samples, n_frames))
+    print('measure_triggered: {:8.3f} ms/frame'.format(t_streamer * 1000))
+    print('task.read:         {:8.3f} ms/frame'.format(t_task * 1000))
+    print('speedup:           {:8.1f}x'.format(t_task / t_streamer))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,399 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of the FastScan pipeline stages.
+
+Times the simulation, the shaker position fit, the projection backends, the
+running average, the autocorrelation fit and saving, for a range of
+n_samples and n_averages. Results are written to a JSON file, which can be
+compared with the results of a previous run:
+
+    python tests/benchmarks.py -o new.json
+    python tests/benchmarks.py -o new.json --baseline old.json
+
+Stages are selected by name with -k, as in -k project. Startup cost is
+timed by importing the main modules in a fresh interpreter, and
+--import-profile lists the slowest imports of a module, from python -X
+importtime:
+
+    python tests/benchmarks.py -k import
+    python tests/benchmarks.py --import-profile measurement.fastscan
+
+@author: Steinn Ymir Agustsson
+"""
+import argparse
+import datetime
+import functools
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+N_SAMPLES = (6000, 18000, 60000)
+N_AVERAGES = (50, 500)
+IMPORTS = ('measurement.fastscan', 'measurement.fastscan_qt', 'utilities.units', 'FastScan')
+
+BENCHMARKS = []
+
+
+def benchmark(fn):
+    """ Register a benchmark generator.
+
+    The function yields (name, params, setup) tuples, where setup() returns
+    the callable to time, so that setup costs are not measured.
+    """
+    BENCHMARKS.append(fn)
+    return fn
+
+
+def time_it(fn, min_time=.2, max_repeat=1000):
+    """ Call fn repeatedly for at least min_time seconds.
+
+    Returns:
+        dict with the number of calls and the min, median and mean time per
+        call, in ms.
+    """
+    fn()  # warm up
+    times = []
+    t_start = time.perf_counter()
+    while len(times) < max_repeat and (time.perf_counter() - t_start < min_time or len(times) < 3):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    times = np.array(times) * 1000
+    return {'n': len(times), 'min_ms': times.min(), 'median_ms': np.median(times), 'mean_ms': times.mean()}
+
+
+def simulated_frame(n_samples, seed=0):
+    from measurement.fastscan import StreamSimulator
+    data = np.zeros((4, n_samples))
+    StreamSimulator(n_samples, seed=seed).measure(data)
+    data[3] = 1 + .01 * np.random.default_rng(seed).normal(size=n_samples)
+    return data
+
+
+def projected_curves(n_curves, n_samples=18000, seed=0):
+    """ Projected curves of simulated frames, with the continuous mode phase jitter."""
+    from measurement.fastscan import StreamSimulator, projector
+    simulator = StreamSimulator(n_samples, mode='continuous', seed=seed)
+    data = np.zeros((4, n_samples))
+    curves = []
+    for _ in range(min(n_curves, 20)):
+        simulator.measure(data)
+        data[3] = 1
+        curves.append(projector(data, backend='numpy')[0])
+    return [curves[i % len(curves)] for i in range(n_curves)]
+
+
+@benchmark
+def bench_simulate():
+    from measurement.fastscan import StreamSimulator, simulate_measure
+    for n_samples in N_SAMPLES:
+        def setup(n_samples=n_samples):
+            simulator = StreamSimulator(n_samples, seed=0)
+            data = np.zeros((4, n_samples))
+            return lambda: simulator.measure(data)
+
+        yield 'simulate.StreamSimulator', {'n_samples': n_samples}, setup
+
+        def setup(n_samples=n_samples):
+            data = np.zeros((4, n_samples))
+            return lambda: simulate_measure(data, seed=0)
+
+        yield 'simulate.simulate_measure', {'n_samples': n_samples}, setup
+
+
+@benchmark
+def bench_sine_fit():
+    from scipy.optimize import curve_fit
+    from utilities.math import fit_sin_fast, sin
+
+    for n_samples in N_SAMPLES:
+        def setup(n_samples=n_samples):
+            spos = simulated_frame(n_samples)[0]
+            return spos, np.arange(n_samples)
+
+        def cold(n_samples=n_samples):
+            spos, x = setup(n_samples)
+            return lambda: fit_sin_fast(spos, x)
+
+        def warm(n_samples=n_samples):
+            spos, x = setup(n_samples)
+            popt, _ = fit_sin_fast(spos, x)
+            return lambda: fit_sin_fast(spos, x, guess=popt)
+
+        def scipy(n_samples=n_samples):
+            spos, x = setup(n_samples)
+            guess = [spos.max() - spos.min(), 15000 / np.pi, 0, (spos.max() - spos.min()) / 5]
+            return lambda: curve_fit(sin, x, spos, p0=guess)
+
+        yield 'sine_fit.fast_cold', {'n_samples': n_samples}, cold
+        yield 'sine_fit.fast_warm', {'n_samples': n_samples}, warm
+        yield 'sine_fit.curve_fit', {'n_samples': n_samples}, scipy
+
+
+@benchmark
+def bench_project():
+    from measurement.cscripts import PROJECTOR_BACKENDS, load_projector
+    from utilities.math import fit_sin_fast, sin
+
+    loaded = {}
+    for backend in sorted(PROJECTOR_BACKENDS, key=lambda b: b.startswith('cython')):
+        functions = load_projector(backend, n_threads=os.cpu_count())
+        if functions in loaded.values():  # cython not compiled, fell back to numpy
+            continue
+        loaded[backend] = functions
+
+    for backend, (project, project_r0) in loaded.items():
+        for n_samples in N_SAMPLES:
+            if backend == 'python' and n_samples > N_SAMPLES[0]:
+                continue  # pure python reference is only timed on small frames
+
+            def setup(n_samples=n_samples):
+                data = simulated_frame(n_samples)
+                x = np.arange(n_samples)
+                popt, _ = fit_sin_fast(data[0], x)
+                spos = np.array(sin(x, *popt) / 0.000152587890625, dtype=int)
+                return spos, data
+
+            def bench(n_samples=n_samples, project=project):
+                spos, data = setup(n_samples)
+                return lambda: project(spos, data[1], data[2], True)
+
+            def bench_r0(n_samples=n_samples, project_r0=project_r0):
+                spos, data = setup(n_samples)
+                return lambda: project_r0(spos, data[1], data[2], data[3], True)
+
+            yield 'project.project', {'backend': backend, 'n_samples': n_samples}, bench
+            yield 'project.project_r0', {'backend': backend, 'n_samples': n_samples}, bench_r0
+
+
+@benchmark
+def bench_projector():
+    from measurement.fastscan import make_time_grid, projector
+    for n_samples in N_SAMPLES:
+        def setup(n_samples=n_samples):
+            data = simulated_frame(n_samples)
+            return lambda: projector(data, backend='numpy')
+
+        def setup_grid(n_samples=n_samples):
+            data = simulated_frame(n_samples)
+            grid = make_time_grid(100, .05)
+            return lambda: projector(data, backend='numpy', time_grid=grid)
+
+        yield 'projector.full', {'n_samples': n_samples}, setup
+        yield 'projector.time_grid', {'n_samples': n_samples}, setup_grid
+
+
+@benchmark
+def bench_running_average():
+    from measurement.fastscan import RunningAverage
+    for n_averages in N_AVERAGES:
+        def setup(n_averages=n_averages):
+            curves = projected_curves(2 * n_averages)
+            average = RunningAverage(n_averages, .05)
+            for da in curves:
+                average.add(da)
+            state = {'i': 0}
+
+            def add():
+                average.add(curves[state['i'] % len(curves)])
+                state['i'] += 1
+
+            return add
+
+        def setup_average(n_averages=n_averages):
+            average = RunningAverage(n_averages, .05)
+            for da in projected_curves(n_averages):
+                average.add(da)
+            return lambda: average.average
+
+        yield 'running_average.add', {'n_averages': n_averages}, setup
+        yield 'running_average.average', {'n_averages': n_averages}, setup_average
+
+
+@benchmark
+def bench_fit_autocorrelation():
+    from measurement.fastscan import RunningAverage, fit_autocorrelation
+    for n_averages in N_AVERAGES[:1]:
+        def setup(n_averages=n_averages, warm=False):
+            average = RunningAverage(n_averages, .05)
+            for da in projected_curves(n_averages):
+                average.add(da)
+            da = average.average
+            p0 = fit_autocorrelation(da)['popt'] if warm else None
+            return lambda: fit_autocorrelation(da, p0=p0)
+
+        yield 'fit_autocorrelation', {'n_averages': n_averages}, setup
+        yield 'fit_autocorrelation.warm', {'n_averages': n_averages}, functools.partial(setup, warm=True)
+
+
+@benchmark
+def bench_fit_batch():
+    from measurement.fastscan import RunningAverage, fit_autocorrelation, fit_autocorrelation_batch
+    for n_averages in N_AVERAGES:
+        def setup(n_averages=n_averages, batch=True):
+            average = RunningAverage(n_averages, .05)
+            for da in projected_curves(n_averages):
+                average.add(da)
+            curves = average.curves
+            if batch:
+                return lambda: fit_autocorrelation_batch(curves)
+            return lambda: [fit_autocorrelation(curves[i]) for i in range(n_averages)]
+
+        yield 'fit_batch', {'n_averages': n_averages}, setup
+        yield 'fit_batch.loop', {'n_averages': n_averages}, functools.partial(setup, batch=False)
+
+
+@benchmark
+def bench_save_data():
+    from measurement.fastscan import FastScanEngine, RunningAverage
+    engine = None
+    for n_averages in N_AVERAGES:
+        def setup(n_averages=n_averages):
+            nonlocal engine
+            if engine is None:
+                engine = FastScanEngine()
+            engine.averages = RunningAverage(n_averages, .05)
+            for da in projected_curves(n_averages):
+                engine.averages.add(da)
+            engine.running_average = engine.averages.average
+            engine.streamer_average = simulated_frame(18000)
+            filename = os.path.join(tempfile.mkdtemp(), 'benchmark.h5')
+            return lambda: engine.save_data(filename)
+
+        yield 'save_data', {'n_averages': n_averages}, setup
+
+
+def import_times(module):
+    """ Import module in a fresh interpreter, with python -X importtime.
+
+    Returns:
+        dict of the cumulative import time, in ms, of each module imported.
+    Raises:
+        ImportError if module cannot be imported.
+    """
+    out = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module], cwd=ROOT,
+                         capture_output=True, text=True)
+    if out.returncode != 0:
+        raise ImportError(out.stderr.strip().splitlines()[-1])
+    times = {}
+    for line in out.stderr.splitlines():
+        if line.startswith('import time:'):
+            _, cumulative, name = line.split('|')
+            if cumulative.strip().isdigit():  # skip the header
+                times[name.strip()] = int(cumulative) / 1000
+    return times
+
+
+@benchmark
+def bench_import():
+    for module in IMPORTS:
+        try:
+            import_times(module)
+        except ImportError as e:
+            print('skipping import of {}: {}'.format(module, e))
+            continue
+
+        def setup(module=module):
+            return lambda: subprocess.run([sys.executable, '-c', 'import ' + module], cwd=ROOT, check=True,
+                                          stdout=subprocess.DEVNULL)
+
+        yield 'import', {'module': module}, setup  # includes the interpreter startup
+
+
+def import_profile(module, n=20):
+    """ Print the n slowest imports of module, with their cumulative time."""
+    times = import_times(module)
+    print('{:10s} {}'.format('ms', 'module'))
+    for name, t in sorted(times.items(), key=lambda item: -item[1])[:n]:
+        print('{:10.1f} {}'.format(t, name))
+
+
+def run(select=None, min_time=.2):
+    """ Run the registered benchmarks whose name contains select."""
+    results = []
+    for bench in BENCHMARKS:
+        for name, params, setup in bench():
+            if select is not None and select not in name:
+                continue
+            result = {'name': name, 'params': params}
+            result.update(time_it(setup(), min_time=min_time))
+            results.append(result)
+            print('{:30s} {:45s} {:10.3f} ms  (n={})'.format(name, json.dumps(params), result['median_ms'],
+                                                             result['n']))
+    return results
+
+
+def key(result):
+    return result['name'] + json.dumps(result['params'], sort_keys=True)
+
+
+def compare(results, baseline, tolerance=1.2):
+    """ Print the median time of each benchmark relative to a baseline.
+
+    Returns:
+        list of the names of the benchmarks slower than tolerance times the
+        baseline.
+    """
+    base = {key(r): r for r in baseline['results']}
+    slower = []
+    print('\n{:30s} {:45s} {:>10s} {:>10s} {:>7s}'.format('benchmark', 'params', 'base ms', 'new ms', 'ratio'))
+    for r in results:
+        b = base.get(key(r))
+        if b is None:
+            continue
+        ratio = r['median_ms'] / b['median_ms']
+        flag = '  <-- slower' if ratio > tolerance else ''
+        if flag:
+            slower.append(key(r))
+        print('{:30s} {:45s} {:10.3f} {:10.3f} {:7.2f}{}'.format(r['name'], json.dumps(r['params']),
+                                                                 b['median_ms'], r['median_ms'], ratio, flag))
+    return slower
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-o', '--output', default='benchmarks.json', help='JSON file for the results')
+    parser.add_argument('-b', '--baseline', help='JSON results of a previous run to compare with')
+    parser.add_argument('-k', dest='select', help='only run benchmarks whose name contains this')
+    parser.add_argument('--min-time', type=float, default=.2, help='minimum time spent on each benchmark, in s')
+    parser.add_argument('--tolerance', type=float, default=1.2,
+                        help='slowdown relative to the baseline reported as regression')
+    parser.add_argument('--import-profile', metavar='MODULE', help='list the slowest imports of MODULE and exit')
+    args = parser.parse_args(argv)
+
+    if args.import_profile is not None:
+        import_profile(args.import_profile)
+        return 0
+
+    import numpy
+    meta = {'date': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'numpy': numpy.__version__,
+            'platform': platform.platform(),
+            'processor': platform.processor(),
+            'cpu_count': os.cpu_count(),
+            }
+    results = run(args.select, args.min_time)
+    with open(args.output, 'w') as f:
+        json.dump({'meta': meta, 'results': results}, f, indent=2)
+    print('\nResults written to {}'.format(args.output))
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        slower = compare(results, baseline, args.tolerance)
+        return 1 if slower else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+"""
+Shared fixtures of the tests.
+
+@author: Steinn Ymir Agustsson
+"""
+import os
+import shutil
+
+import pytest
+
+from utilities import settings
+
+DEFAULT_SETTINGS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'utilities',
+                                'defaultSETTINGS.ini')
+
+
+@pytest.fixture
+def settings_file(tmp_path, monkeypatch):
+    """ SETTINGS.ini made from utilities/defaultSETTINGS.ini in a temporary folder, used as default settings."""
+    path = str(tmp_path / 'SETTINGS.ini')
+    shutil.copyfile(DEFAULT_SETTINGS, path)
+    monkeypatch.setattr(settings, '_default_settings_file', path)
+    yield path
+    settings.flush_settings()
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the headless FastScanEngine, on simulated data.
+
+@author: Steinn Ymir Agustsson
+"""
+import time
+
+import numpy as np
+import pytest
+
+from measurement.fastscan import FastScanConfig, FastScanEngine
+
+
+@pytest.fixture
+def engine(settings_file):
+    engine = FastScanEngine(make_config())
+    yield engine
+    engine.close()
+
+
+def make_config(**settings):
+    defaults = dict(simulate=True, n_samples=2000, n_processors=2, projector_backend='numpy')
+    defaults.update(settings)
+    return FastScanConfig(**defaults)
+
+
+def test_stream_frames_are_copies(engine):
+    frames = []
+    engine.subscribe('stream', frames.append)
+    engine.start(engine.config)
+    assert engine.wait_frames(10, timeout=60)
+    engine.stop()
+    assert engine.join(60)
+    assert len(frames) >= 10
+    for frame in frames:
+        assert not np.shares_memory(frame, engine.frame_pool.frames)
+
+
+@pytest.mark.parametrize('backend', ['threads', 'processes'])
+def test_join_waits_for_averaging(engine, backend):
+    frames = []
+    engine.subscribe('stream', frames.append)
+    engine.subscribe('projected', lambda da: time.sleep(.05))  # slow consumer, after the projection
+    engine.start(make_config(processing_backend=backend, stream_queue_policy='block'))
+    assert engine.wait_frames(10, timeout=60)
+    engine.stop()
+    assert engine.join(60)
+    assert engine.n_projected == len(frames)
+    assert engine.n_pending == 0
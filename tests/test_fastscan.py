@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the RunningAverage and FastScanConfig of measurement.fastscan.
+
+@author: Steinn Ymir Agustsson
+"""
+import multiprocessing
+import pickle
+
+import numpy as np
+import pytest
+import xarray as xr
+
+from measurement.fastscan import FastScanConfig, FastScanEngine, RunningAverage
+from utilities.settings import flush_settings, write_setting
+
+TIME_STEP = .05
+
+
+def make_curves(n_curves=12, seed=0):
+    """ Projected curves on ragged time axes, multiples of TIME_STEP, with some NaNs."""
+    rng = np.random.default_rng(seed)
+    curves = []
+    for i in range(n_curves):
+        start = rng.integers(-30, -10)
+        pos = np.arange(start, start + rng.integers(40, 60))
+        values = rng.normal(size=len(pos))
+        values[rng.random(len(pos)) < .1] = np.nan
+        curves.append(xr.DataArray(values, coords={'time': pos * TIME_STEP}, dims='time'))
+    return curves
+
+
+def naive_average(curves):
+    """ Mean of the curves over their common time axis, ignoring NaNs and empty points."""
+    mean = xr.concat(curves, 'avg', join='outer').mean('avg', skipna=True)
+    return mean.dropna('time')
+
+
+def assert_average_equal(average, curves):
+    expected = naive_average(curves)
+    np.testing.assert_allclose(average.time.values, expected.time.values)
+    np.testing.assert_allclose(average.values, expected.values, rtol=1e-10)
+
+
+@pytest.mark.parametrize('n_averages', [1, 3, 5, 20])
+def test_running_average_matches_naive_mean(n_averages):
+    curves = make_curves()
+    running = RunningAverage(n_averages, TIME_STEP)
+    for i, curve in enumerate(curves):
+        running.add(curve)
+        assert_average_equal(running.average, curves[max(0, i + 1 - n_averages):i + 1])
+    assert running.shape[0] == min(n_averages, len(curves))
+
+
+def test_running_average_curves_oldest_first():
+    curves = make_curves(7)
+    running = RunningAverage(4, TIME_STEP)
+    for curve in curves:
+        running.add(curve)
+    buffered = running.curves
+    for stored, curve in zip(buffered, curves[-4:]):
+        np.testing.assert_array_equal(stored.sel(time=curve.time.values, method='nearest').values, curve.values)
+
+
+@pytest.mark.parametrize('shrink_at, new_n_averages', [(2, 2), (7, 3), (9, 1)])
+def test_running_average_shrink_mid_run(shrink_at, new_n_averages):
+    curves = make_curves()
+    running = RunningAverage(6, TIME_STEP)
+    n_averages = 6
+    for i, curve in enumerate(curves):
+        if i == shrink_at:
+            running.n_averages = n_averages = new_n_averages
+            assert_average_equal(running.average, curves[max(0, i - n_averages):i])
+        running.add(curve)
+        assert_average_equal(running.average, curves[max(0, i + 1 - n_averages):i + 1])
+
+
+def test_config_is_read_only():
+    config = FastScanConfig(n_samples=1000)
+    with pytest.raises(AttributeError):
+        config.n_samples = 2000
+    with pytest.raises(AttributeError):
+        config.new_setting = 1
+    with pytest.raises(AttributeError):
+        del config.n_samples
+    assert config.n_samples == 1000
+    changed = config.replace(n_samples=2000)
+    assert changed.n_samples == 2000 and changed.version != config.version
+    with pytest.raises(TypeError):
+        FastScanConfig(no_such_setting=1)
+
+
+def test_config_version_changes_with_values(settings_file):
+    config = FastScanConfig.from_settings()
+    assert config.n_samples == 18000
+    assert FastScanConfig.from_settings().version == config.version
+
+    write_setting(20000, 'fastscan', 'n_samples')
+    changed = FastScanConfig.from_settings()
+    assert changed.n_samples == 20000 and changed.version > config.version
+    flush_settings()
+    assert FastScanConfig.from_settings().version == changed.version
+
+    write_setting(18000, 'fastscan', 'n_samples')
+    assert FastScanConfig.from_settings().version > changed.version
+
+
+def test_config_pickle():
+    config = FastScanConfig(n_samples=1000, record_file='scan.raw')
+    copy = pickle.loads(pickle.dumps(config))
+    assert copy.as_dict() == config.as_dict()
+    with pytest.raises(AttributeError):
+        copy.n_samples = 1
+
+    # as sent to the spawned workers of ProjectorProcessPool
+    with multiprocessing.get_context('spawn').Pool(1) as pool:
+        assert pool.apply(FastScanConfig.as_dict, (config,)) == config.as_dict()
+
+
+def test_save_data_writes_configs(settings_file, tmp_path):
+    import h5py
+    first = FastScanConfig(n_samples=1000, n_averages=4)
+    second = first.replace(dark_control=False)
+    engine = FastScanEngine(first)
+    try:
+        engine.config = second
+        engine.averages = RunningAverage(4, first.shaker_time_step)
+        for i, config in enumerate([first, first, second]):
+            curve = make_curves(1, seed=i)[0]
+            curve.attrs['config_version'] = config.version
+            engine.averages.add(curve)
+        engine.running_average = engine.averages.average
+        engine.streamer_average = np.zeros((3, 1000))
+        engine.save_data(str(tmp_path / 'scan'), all_data=True)
+    finally:
+        engine.close()
+
+    with h5py.File(str(tmp_path / 'scan.h5'), 'r') as f:
+        assert sorted(f['/configs']) == sorted([str(first.version), str(second.version)])
+        assert list(f['/all_data/config_version'][()]) == [first.version, first.version, second.version]
+        assert f['/configs/{}/dark_control'.format(first.version)][()]
+        assert not f['/configs/{}/dark_control'.format(second.version)][()]
+        assert f['/configs/{}/version'.format(second.version)][()] == second.version
+        assert f['/settings/version'][()] == second.version
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+Parity tests between the batched and the single curve autocorrelation fits.
+
+@author: Steinn Ymir Agustsson
+"""
+import numpy as np
+import pytest
+import xarray as xr
+
+from measurement.fastscan import fit_autocorrelation, fit_autocorrelation_batch
+from utilities.math import gaussian_fwhm, gaussian_fwhm_jac, sech2_fwhm, sech2_fwhm_jac
+
+
+def make_curves(function, n_curves=20, seed=0):
+    """ Noisy autocorrelation curves of varying duration, with missing points."""
+    rng = np.random.default_rng(seed)
+    x = np.arange(-40, 41) * .05
+    fwhm = .12 + .02 * rng.normal(size=(n_curves, 1))
+    y = function(x, 1, .1, fwhm, .05) + rng.normal(0, .02, (n_curves, len(x)))
+    y[:5, :10] = np.nan  # curves not covering the whole grid
+    y[7] = np.nan  # empty curve
+    return xr.DataArray(y, coords={'time': x}, dims=('avg', 'time'))
+
+
+@pytest.mark.parametrize('function, jac', [(sech2_fwhm, sech2_fwhm_jac), (gaussian_fwhm, gaussian_fwhm_jac)])
+def test_jacobian(function, jac):
+    x = np.linspace(-3, 3, 301)
+    pars = np.array([1.3, .2, .4, .1])
+    numeric = np.empty((len(x), 4))
+    for i in range(4):
+        step = np.zeros(4)
+        step[i] = 1e-6
+        numeric[:, i] = (function(x, *(pars + step)) - function(x, *(pars - step))) / 2e-6
+    np.testing.assert_allclose(jac(x, *pars), numeric, atol=1e-7)
+
+
+@pytest.mark.parametrize('model, function', [('sech2', sech2_fwhm), ('gaussian', gaussian_fwhm)])
+def test_batch_parity(model, function):
+    curves = make_curves(function)
+    result = fit_autocorrelation_batch(curves, model=model)
+    assert result['popt'].shape == result['perr'].shape == (len(curves), 4)
+    assert np.all(np.isnan(result['popt'][7]))
+    assert not result['converged'][7]
+    for i in np.flatnonzero(result['converged']):
+        expected = fit_autocorrelation(curves[i], model=model)
+        np.testing.assert_allclose(result['popt'][i], expected['popt'], rtol=1e-4, atol=1e-6)
+        np.testing.assert_allclose(result['perr'][i], expected['perr'], rtol=1e-2)
+    assert result['converged'].sum() == len(curves) - 1
+    assert fit_autocorrelation_batch(curves[8:], model=model)['converged'].all()
+
+
+def test_calibration_line_outliers():
+    from measurement.shakercalibration import fit_calibration_line
+    rng = np.random.default_rng(0)
+    positions = np.concatenate((np.linspace(-20, 20, 10), np.linspace(20, -20, 10)))
+    centers = .9 * positions + 1 + rng.normal(0, .05, len(positions))
+    centers[[3, 12]] += [5, -8]  # failed fits
+    result = fit_calibration_line(positions, centers)
+    assert not result['inliers'][3] and not result['inliers'][12]
+    assert abs(result['slope'] - .9) < 3 * result['slope_err']
+    assert abs(result['intercept'] - 1) < .1
+
+
+class RecordingStage(object):
+    def __init__(self):
+        self.positions = [0.]
+
+    def move_absolute(self, position):
+        self.positions.append(position)
+
+    def position_get(self):
+        return self.positions[-1]
+
+
+def make_calibration(centers, simulate=False, **kwargs):
+    from measurement.fastscan import FastScanConfig
+    from measurement.shakercalibration import ShakerCalibration
+    calibration = ShakerCalibration(RecordingStage(), config=FastScanConfig(simulate=simulate), **kwargs)
+    positions = np.linspace(-20, 20, len(centers))
+    calibration.points = [{'position': p, 'center': c} for p, c in zip(positions, centers)]
+    return calibration
+
+
+def test_calibration_refuses_bad_slope(monkeypatch):
+    from measurement import shakercalibration
+    written = []
+    monkeypatch.setattr(shakercalibration, 'write_setting', lambda *args: written.append(args))
+    rng = np.random.default_rng(0)
+    flat = make_calibration(1 + rng.normal(0, .05, 20))  # pulse not moving with the stage
+    with pytest.raises(RuntimeError):
+        flat.calibrate(write=True)
+    few = make_calibration(.9 * np.linspace(-20, 20, 4) + 1)
+    with pytest.raises(RuntimeError):
+        few.calibrate(write=True)
+    assert not written
+
+    good = make_calibration(.9 * np.linspace(-20, 20, 20) + 1 + rng.normal(0, .05, 20))
+    result = good.calibrate(write=True)
+    assert result['shaker_ps_per_step'] == pytest.approx(good.config.shaker_ps_per_step / .9, rel=1e-2)
+    assert written == [(result['shaker_ps_per_step'], 'fastscan', 'shaker_ps_per_step')]
+
+
+def test_calibration_moves_simulated_pulse_with_stage():
+    from measurement.shakercalibration import SimulatedStage
+    calibration = make_calibration([], simulate=True)
+    assert calibration.stages[0] is calibration.delay_stage
+    assert isinstance(calibration.stages[1], SimulatedStage)
+    assert len(make_calibration([], simulate=False).stages) == 1
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the HDF5 stream writer.
+
+@author: Steinn Ymir Agustsson
+"""
+import threading
+
+import numpy as np
+import xarray as xr
+
+from measurement.h5stream import H5StreamWriter, read_frames
+
+
+def make_frame(n=50):
+    return xr.DataArray(np.arange(n, dtype=np.float64), coords={'time': np.arange(n) * .05}, dims='time')
+
+
+def test_write_and_read(tmp_path):
+    writer = H5StreamWriter(str(tmp_path / 'stream'), chunk_frames=4)
+    for _ in range(10):
+        assert writer.add_frame(make_frame())
+    writer.close()
+    frames = read_frames(str(tmp_path / 'stream.h5'))
+    assert len(frames) == 10 and writer.n_dropped == 0
+    np.testing.assert_array_equal(frames[3].values, make_frame().values)
+
+
+def test_full_queue_drops_frames(tmp_path):
+    release = threading.Event()
+    writer = H5StreamWriter(str(tmp_path / 'stream'), chunk_frames=1, queue_size=4)
+    write_frames = writer._write_frames
+
+    def slow_write_frames(f):
+        release.wait(10)
+        write_frames(f)
+
+    writer._write_frames = slow_write_frames
+    added = [writer.add_frame(make_frame()) for _ in range(20)]  # must not block
+    assert not all(added)
+    assert writer.n_dropped == added.count(False)
+    release.set()
+    writer.close()
+    assert writer.n_frames == added.count(True)
+
+
+def test_failed_writer_ignores_frames(tmp_path):
+    errors = []
+    writer = H5StreamWriter(str(tmp_path / 'stream'), chunk_frames=1, queue_size=4, on_error=errors.append)
+
+    def failing_write_frames(f):
+        raise OSError('disk full')
+
+    writer._write_frames = failing_write_frames
+    writer.add_frame(make_frame())
+    writer._thread.join(10)
+    assert len(errors) == 1
+    assert not writer.add_frame(make_frame())
+    writer.close()
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the SR830 lock-in amplifier driver, on a fake serial port.
+
+@author: Steinn Ymir Agustsson
+"""
+import numpy as np
+import pytest
+
+from instruments.lockinamplifier import SR830
+
+
+class FakeSerial(object):
+    """ Serial port of the Prologix adapter.
+
+    Each '++read eoi' moves the next of the queued answers to the input
+    buffer, from where readline and read take it. An answer can be a list of
+    lines, as a batched query answered in more than one line.
+    """
+
+    def __init__(self, answers=()):
+        self.answers = list(answers)
+        self.input_buffer = []
+        self.written = []
+        self.timeout = 1
+        self.is_open = True
+
+    def isOpen(self):
+        return self.is_open
+
+    def write(self, data):
+        command = data.decode('utf-8').strip()
+        self.written.append(command)
+        if command == '++read eoi' and self.answers:
+            answer = self.answers.pop(0)
+            self.input_buffer += answer if isinstance(answer, list) else [answer]
+
+    def readline(self):
+        return self.input_buffer.pop(0) if self.input_buffer else b''
+
+    def read(self, n_bytes):
+        return self.input_buffer.pop(0)[:n_bytes] if self.input_buffer else b''
+
+    def reset_input_buffer(self):
+        self.input_buffer = []
+
+    def close(self):
+        self.is_open = False
+
+    @property
+    def commands(self):
+        """ Commands sent to the lock-in, without those to the adapter."""
+        return [c for c in self.written if not c.startswith('++')]
+
+
+def settings_answer(lockin, **values):
+    """ Answer of the lock-in to the query of all settings, with the local values changed by values."""
+    answers = []
+    for setting in lockin._settings:
+        value = values.get(setting, lockin._settings[setting]['value'])
+        answers.append(lockin._encode(setting, value).split(' ')[1])
+    return ';'.join(answers)
+
+
+@pytest.fixture
+def lockin():
+    lockin = SR830()
+    lockin.ser = FakeSerial()
+    lockin._connected = True
+    lockin.should_sync = False
+    return lockin
+
+
+def test_read_buffer(lockin):
+    values = np.array([1.5, -2.25, 3e-6, 0, 7.125], dtype='<f4')
+    lockin._buffer_channels = lockin.buffer_channels(['X', 'Theta'])
+    lockin.ser.answers = [b'5\n', values.tobytes()]
+    result = lockin.read_buffer('Theta')
+    assert lockin.ser.commands == ['SPTS?', 'TRCB?2,0,5']
+    assert result.dtype == np.float64
+    np.testing.assert_array_equal(result, values)
+
+    lockin.ser.answers = [values[:2].tobytes()]
+    with pytest.raises(IOError):  # fewer bytes than points
+        lockin.read_buffer('X', 1, 3)
+
+
+def test_buffer_channels(lockin):
+    assert lockin.buffer_channels(['X', 'Y']) == {'X': 1, 'Y': 2}
+    with pytest.raises(ValueError):
+        lockin.buffer_channels(['X', 'R'])  # same display channel
+    with pytest.raises(ValueError):
+        lockin.buffer_channels(['Reference Frequency'])
+
+
+def test_refresh(lockin):
+    lockin.ser.answers = [(settings_answer(lockin, time_constant=3., phase=12.5) + '\n').encode('utf-8')]
+    lockin.refresh()
+    assert lockin.ser.commands == [';'.join(lockin._settings[s]['cmd'] + '?' for s in lockin._settings)]
+    assert lockin.time_constant == 3.
+    assert lockin.phase == 12.5
+    assert len(lockin.ser.commands) == 1  # getters do not query the device
+
+
+def test_refresh_falls_back_to_single_queries(lockin):
+    answer = settings_answer(lockin, sensitivity=1e-3).split(';')
+    split_answer = [(';'.join(answer[:3]) + '\n').encode('utf-8'), (';'.join(answer[3:]) + '\n').encode('utf-8')]
+    lockin.ser.answers = [split_answer] + [(a + '\n').encode('utf-8') for a in answer]
+    lockin.refresh()
+    assert len(lockin.ser.commands) == 1 + len(lockin._settings)
+    assert lockin.sensitivity == 1e-3
+    assert lockin.ser.input_buffer == []
+
+
+def test_set_setting_while_disconnected(lockin):
+    lockin._connected = False
+    lockin.time_constant = 1.
+    lockin.phase = 45.
+    assert lockin.ser.written == []
+    assert lockin.should_sync and lockin._unsynced == {'time_constant', 'phase'}
+    assert lockin.time_constant == 1.
+
+    lockin._connected = True
+    lockin.ser.answers = [(settings_answer(lockin) + '\n').encode('utf-8')]
+    assert lockin.sync()
+    assert lockin.ser.commands[0] == 'PHAS 45.0;OFLT 10'
+    assert not lockin.should_sync and not lockin._unsynced
+    assert lockin.time_constant == 1. and lockin.phase == 45.
+
+    lockin.sensitivity = 1e-3  # connected: written at once
+    assert lockin.ser.commands[-1] == 'SENS 17'
+    assert not lockin._unsynced
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the stage timers and counters of utilities.metrics.
+
+@author: Steinn Ymir Agustsson
+"""
+import json
+import threading
+
+import numpy as np
+import pytest
+
+from utilities.metrics import MetricsRegistry
+
+
+def test_stage_aggregation():
+    metrics = MetricsRegistry()
+    durations = np.arange(1, 101) / 1000  # 1 to 100 ms
+    for duration in durations:
+        metrics.record('binning', duration)
+    stage = metrics.snapshot()['stages']['binning']
+    assert stage['count'] == 100
+    assert stage['mean_ms'] == pytest.approx(50.5)
+    assert stage['max_ms'] == pytest.approx(100)
+    assert stage['p50_ms'] == pytest.approx(np.percentile(durations, 50) * 1000)
+    assert stage['p95_ms'] == pytest.approx(np.percentile(durations, 95) * 1000)
+    assert stage['p99_ms'] == pytest.approx(np.percentile(durations, 99) * 1000)
+    assert stage['rate_hz'] > 0
+
+
+def test_percentiles_over_window():
+    metrics = MetricsRegistry(window=10)
+    for duration in [1.] * 50 + [.001] * 10:
+        metrics.record('fit', duration)
+    stage = metrics.snapshot()['stages']['fit']
+    assert stage['count'] == 60  # totals keep all durations
+    assert stage['max_ms'] == pytest.approx(1000)
+    assert stage['p99_ms'] == pytest.approx(1)  # percentiles only the last 10
+
+
+def test_timer_and_counters():
+    metrics = MetricsRegistry()
+    with metrics.timer('projection'):
+        pass
+    with pytest.raises(RuntimeError):
+        with metrics.timer('projection'):
+            raise RuntimeError()  # timed anyway
+    metrics.count('frames')
+    metrics.count('frames', 4)
+    metrics.count('dropped', 0)
+    snapshot = metrics.snapshot()
+    assert snapshot['stages']['projection']['count'] == 2
+    assert snapshot['counters'] == {'frames': 5, 'dropped': 0}
+
+
+def test_thread_safe_updates():
+    metrics = MetricsRegistry()
+    start = threading.Barrier(8)
+
+    def work():
+        start.wait()
+        for _ in range(2000):
+            metrics.count('frames')
+            metrics.record('stage', .001)
+            metrics.snapshot()
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    snapshot = metrics.snapshot()
+    assert snapshot['counters']['frames'] == 16000
+    assert snapshot['stages']['stage']['count'] == 16000
+    assert snapshot['stages']['stage']['mean_ms'] == pytest.approx(1)
+
+
+def test_snapshot_and_reset():
+    metrics = MetricsRegistry()
+    metrics.count('frames', 3)
+    metrics.record('binning', .002)
+    snapshot = metrics.snapshot()
+    metrics.count('frames')
+    metrics.record('binning', .004)
+    assert snapshot['counters'] == {'frames': 3}  # snapshots do not change afterwards
+    assert snapshot['stages']['binning']['count'] == 1
+
+    metrics.reset()
+    snapshot = metrics.snapshot()
+    assert snapshot['stages'] == {} and snapshot['counters'] == {}
+    assert snapshot['elapsed_s'] < 1
+    metrics.count('frames')
+    assert metrics.snapshot()['counters'] == {'frames': 1}
+
+
+def test_dump_and_format(tmp_path):
+    metrics = MetricsRegistry()
+    metrics.record('binning', .002)
+    metrics.count('frames', 2)
+    filename = str(tmp_path / 'metrics.jsonl')
+    metrics.dump(filename)
+    metrics.dump(filename)
+    with open(filename) as f:
+        lines = [json.loads(line) for line in f]
+    assert len(lines) == 2
+    assert lines[1]['counters'] == {'frames': 2} and 'timestamp' in lines[1]
+    table = MetricsRegistry.format(lines[0])
+    assert 'binning' in table and 'frames' in table
@@ -0,0 +1,16 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of utilities.misc.
+
+@author: Steinn Ymir Agustsson
+"""
+import numpy as np
+
+from utilities.misc import make_time_bins
+
+
+def test_make_time_bins():
+    axis, bins = make_time_bins(-1.02, .98, .1)
+    np.testing.assert_allclose(axis, np.arange(-11, 10) * .1, atol=1e-12)
+    np.testing.assert_allclose(bins[1:] - bins[:-1], .1)
+    np.testing.assert_allclose(bins[:-1] + .05, axis)
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+Parity tests between the projection backends in measurement.cscripts.
+
+@author: Steinn Ymir Agustsson
+"""
+import sys
+
+import numpy as np
+import pytest
+
+from measurement.cscripts import projectNp, projectPy
+from utilities.math import fit_sin_fast, sin, sin_residual
+
+
+def make_stream(n_samples=18000, amplitude=300, seed=0):
+    """ Simulated shaker positions, signal, dark control and reference."""
+    rng = np.random.default_rng(seed)
+    x = np.arange(n_samples)
+    spos = np.array(amplitude * np.sin(2 * np.pi * x / 30000 + .3), dtype=int)
+    signal = rng.normal(size=n_samples)
+    dark_control = np.zeros(n_samples)
+    dark_control[::2] = 1.
+    dark_control[1::2] = 0.
+    dark_control[4000:6000] = dark_control[4000:6000][::-1]  # swap the phase of the chopper for a while
+    reference = 1 + .01 * rng.normal(size=n_samples)
+    return spos, signal, dark_control, reference
+
+
+class ParallelBackend(object):
+    """ Wraps the parallel cython functions in the project/project_r0 signature."""
+
+    def __init__(self, module, n_threads):
+        self.module = module
+        self.n_threads = n_threads
+
+    def project(self, *args):
+        return self.module.project_parallel(*args, n_threads=self.n_threads)
+
+    def project_r0(self, *args):
+        return self.module.project_r0_parallel(*args, n_threads=self.n_threads)
+
+
+@pytest.fixture(scope='module')
+def cython_project():
+    """ The compiled cython projector. Skipped, and reported as such, if the extension is not built."""
+    return pytest.importorskip('measurement.cscripts.project',
+                               reason='cython projector not built, run: python setup.py build_ext --inplace')
+
+
+@pytest.fixture(params=['python', 'cython', 'cython_parallel_1', 'cython_parallel_3', 'cython_parallel_4'])
+def backend(request):
+    """ Projection backend compared against projectNp."""
+    if request.param == 'python':
+        return projectPy
+    module = request.getfixturevalue('cython_project')
+    if request.param == 'cython':
+        return module
+    return ParallelBackend(module, int(request.param.rsplit('_', 1)[1]))
+
+
+@pytest.mark.parametrize('use_dark_control', [True, False])
+@pytest.mark.parametrize('n_samples', [18000, 1001])
+def test_project_parity(backend, use_dark_control, n_samples):
+    spos, signal, dark_control, _ = make_stream(n_samples)
+    expected = projectNp.project(spos, signal, dark_control, use_dark_control)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result = backend.project(spos, signal, dark_control, use_dark_control)
+    np.testing.assert_allclose(result, expected, rtol=1e-10, equal_nan=True)
+
+
+@pytest.mark.parametrize('use_dark_control', [True, False])
+@pytest.mark.parametrize('n_samples', [18000, 1001])
+def test_project_r0_parity(backend, use_dark_control, n_samples):
+    spos, signal, dark_control, reference = make_stream(n_samples)
+    expected = projectNp.project_r0(spos, signal, dark_control, reference, use_dark_control)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result = backend.project_r0(spos, signal, dark_control, reference, use_dark_control)
+    np.testing.assert_allclose(result, expected, rtol=1e-6, equal_nan=True)
+
+
+@pytest.mark.parametrize('spos_dtype', [np.int32, np.int64])
+def test_project_parallel_spos_dtypes(cython_project, spos_dtype):
+    spos, signal, dark_control, _ = make_stream()
+    expected = projectNp.project(spos, signal, dark_control, True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result = cython_project.project_parallel(spos.astype(spos_dtype), signal, dark_control, True, n_threads=4)
+    np.testing.assert_allclose(result, expected, rtol=1e-10, equal_nan=True)
+
+
+def test_load_projector():
+    from measurement.cscripts import load_projector
+    assert load_projector('numpy') == (projectNp.project, projectNp.project_r0)
+    assert load_projector('python') == (projectPy.project, projectPy.project_r0)
+    with pytest.raises(ValueError):
+        load_projector('fortran')
+
+
+@pytest.mark.parametrize('backend', ['cython', 'cython_parallel'])
+def test_load_projector_fallback_warns(monkeypatch, caplog, backend):
+    from measurement import cscripts
+    monkeypatch.setitem(sys.modules, 'measurement.cscripts.project', None)  # import raises ImportError
+    monkeypatch.setattr(cscripts, '_loaded_projectors', {})
+    with caplog.at_level('WARNING', logger='measurement.cscripts'):
+        assert cscripts.load_projector(backend, n_threads=2) == (projectNp.project, projectNp.project_r0)
+    assert 'loading numpy instead' in caplog.text
+
+
+def make_shaker_signal(n_samples=18000, noise=.005, seed=0):
+    """ Noisy shaker position, in volt, covering part of a period as in a triggered frame."""
+    rng = np.random.default_rng(seed)
+    x = np.arange(n_samples, dtype=np.float64)
+    popt = [.15, 30000 / (2 * np.pi), .3, .02]
+    return x, sin(x, *popt) + rng.normal(0, noise, n_samples), popt
+
+
+def test_fit_sin_fast_parity():
+    from scipy.optimize import curve_fit
+    x, y, popt = make_shaker_signal()
+    fast, residual = fit_sin_fast(y, x)
+    guess = [y.max() - y.min(), 15000 / np.pi, 0, (y.max() - y.min()) / 5]
+    expected = curve_fit(sin, x, y, p0=guess)[0]
+    # compare the fitted positions, the parameters are only defined up to the phase
+    np.testing.assert_allclose(sin(x, *fast), sin(x, *expected), atol=1e-4)
+    np.testing.assert_allclose(sin(x, *fast), sin(x, *popt), atol=1e-3)
+    assert residual == pytest.approx(sin_residual(y, x, expected), rel=1e-3)
+    warm, _ = fit_sin_fast(y, x, guess=expected)
+    np.testing.assert_allclose(sin(x, *warm), sin(x, *expected), atol=1e-4)
+
+
+@pytest.mark.parametrize('max_fit_residual, n_fallback', [(.1, 0), (0, 1)])
+def test_projector_fit_fallback(monkeypatch, max_fit_residual, n_fallback):
+    import scipy.optimize
+    from measurement.fastscan import projector
+    calls = []
+    curve_fit = scipy.optimize.curve_fit
+
+    def counting_curve_fit(*args, **kwargs):
+        calls.append(args)
+        return curve_fit(*args, **kwargs)
+
+    monkeypatch.setattr(scipy.optimize, 'curve_fit', counting_curve_fit)
+    x, spos, _ = make_shaker_signal()
+    _, signal, dark_control, _ = make_stream(len(x))
+    stream_data = np.stack((spos, signal, dark_control))
+    output, _, _, residual = projector(stream_data, use_r0=False, backend='numpy',
+                                          max_fit_residual=max_fit_residual)
+    assert len(calls) == n_fallback
+    assert residual < .1
+    assert np.isfinite(output.values).any()
+
+
+def test_time_grid_follows_shaker_offset():
+    from measurement.fastscan import FastScanConfig, projector
+    config = FastScanConfig(fixed_time_grid=True, shaker_amplitude=100, dark_control=False)
+    adc_step = config.shaker_position_step
+    x = np.arange(18000)
+    amplitude = 50 / config.shaker_time_step * adc_step  # 100 ps peak to peak
+    spos = amplitude * np.cos(2 * np.pi * x / 30000) + 20 / config.shaker_time_step * adc_step  # 20 ps offset
+    _, signal, dark_control, _ = make_stream(len(x))
+    output = projector(np.stack((spos, signal, dark_control)), backend='numpy', config=config)[0]
+    assert output.attrs['n_outside'] == 0
+    assert output.time.values[0] < -30 + 1 and output.time.values[-1] > 70 - 1
+    assert output.counts.values.sum() == len(x)
+
+    pos_min, n_bins = -10, 20
+    _, _, counts, n_outside = projectNp.project_to_grid(np.arange(-20, 20), np.ones(40), np.zeros(40), None,
+                                                        False, pos_min, n_bins)
+    assert counts.sum() == n_bins and n_outside == 20
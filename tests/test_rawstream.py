@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the raw stream recording, and of its replay by FastScanStreamer.
+
+@author: Steinn Ymir Agustsson
+"""
+import os
+
+import numpy as np
+import pytest
+
+from measurement.fastscan import FastScanConfig, FastScanStreamer
+from measurement.processpool import FramePool
+from measurement.rawstream import RawStreamFile, RawStreamRecorder
+
+N_SAMPLES = 500
+
+
+def record_simulated(filename, n_frames):
+    """ Record n_frames simulated frames, and return copies of them."""
+    frames = []
+    errors = []
+
+    def on_data(data):
+        frames.append(data.copy())
+        if len(frames) == n_frames:
+            streamer.stop_acquisition()
+
+    config = FastScanConfig(simulate=True, n_samples=N_SAMPLES, record_file=filename)
+    streamer = FastScanStreamer(config, on_data=on_data, on_error=errors.append)
+    streamer.start_acquisition()
+    assert errors == []
+    return np.array(frames)
+
+
+def replay(filename, frame_pool=None):
+    """ Frames emitted by FastScanStreamer replaying the recording, and the errors."""
+    frames = []
+    errors = []
+    config = FastScanConfig(acquisition_mode='replay', replay_file=filename, replay_speed='max', n_samples=N_SAMPLES)
+    streamer = FastScanStreamer(config, on_data=lambda data: frames.append(data.copy()), on_error=errors.append)
+    if frame_pool is not None:
+        streamer.frame_pool = frame_pool
+
+        def on_frame(slot):
+            frames.append(frame_pool.view(slot).copy())
+            frame_pool.release(slot)
+
+        streamer.on_frame = on_frame
+    streamer.start_acquisition()
+    return np.array(frames).reshape(-1, 4, N_SAMPLES), errors
+
+
+@pytest.mark.parametrize('use_frame_pool', [False, True])
+def test_record_and_replay(settings_file, tmp_path, use_frame_pool):
+    filename = str(tmp_path / 'recording')
+    recorded = record_simulated(filename, 5)
+    assert len(np.unique(recorded[:, 1], axis=0)) == 5  # the frames differ, so their order is checked
+
+    recording = RawStreamFile(filename)
+    assert len(recording) == 5 and recording.shape == (4, N_SAMPLES)
+    assert np.all(np.diff(recording.timestamps) >= 0)
+
+    frame_pool = FramePool(2, 4, N_SAMPLES) if use_frame_pool else None
+    replayed, errors = replay(filename, frame_pool)
+    assert errors == []
+    assert replayed.tobytes() == recorded.tobytes()  # bit identical, in order
+
+
+def test_record_appends(settings_file, tmp_path):
+    filename = str(tmp_path / 'recording')
+    first = record_simulated(filename, 3)
+    second = record_simulated(filename, 2)
+    assert RawStreamFile(filename + '.raw')[:].tobytes() == np.concatenate((first, second)).tobytes()
+    with pytest.raises(ValueError):
+        RawStreamRecorder(filename, 4, N_SAMPLES + 1)
+
+
+@pytest.mark.parametrize('extension, n_bytes, n_frames', [
+    ('.raw', 3 * 4 * N_SAMPLES * 8 + 100, 3),  # last frame partially written
+    ('.raw', 0, 0),
+    ('.times', 2 * 8 + 3, 2),  # crash before the last timestamps were written
+])
+def test_replay_truncated_recording(settings_file, tmp_path, extension, n_bytes, n_frames):
+    filename = str(tmp_path / 'recording')
+    recorded = record_simulated(filename, 5)
+    os.truncate(filename + extension, n_bytes)
+
+    recording = RawStreamFile(filename)
+    assert len(recording) == n_frames and len(recording.timestamps) == n_frames
+    replayed, errors = replay(filename)
+    assert errors == []
+    assert replayed.tobytes() == recorded[:n_frames].tobytes()
+
+
+def test_replay_shape_mismatch(settings_file, tmp_path):
+    filename = str(tmp_path / 'recording')
+    recorder = RawStreamRecorder(filename, 4, N_SAMPLES + 1)
+    recorder.add(np.zeros((4, N_SAMPLES + 1)))
+    recorder.close()
+    replayed, errors = replay(filename)
+    assert len(replayed) == 0
+    assert len(errors) == 1 and isinstance(errors[0], ValueError)
@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the cached reading and debounced writing of settings files.
+
+@author: Steinn Ymir Agustsson
+"""
+import os
+import shutil
+import stat
+import subprocess
+import sys
+import time
+
+import pytest
+
+from utilities import settings
+from utilities.settings import SettingsCache
+
+
+def set_entry(path, category, name, value):
+    """ Change an entry of the file in place, bypassing the cache."""
+    with open(path) as f:
+        lines = f.readlines()
+    section = None
+    for i, line in enumerate(lines):
+        if line.startswith('['):
+            section = line.strip()[1:-1]
+        elif section == category and line.split('=')[0].strip() == name:
+            lines[i] = '{} = {}\n'.format(name, value)
+    with open(path, 'w') as f:
+        f.writelines(lines)
+
+
+def test_find_settings_file(settings_file, tmp_path, monkeypatch):
+    assert settings.find_settings_file() == settings_file
+    monkeypatch.chdir(tmp_path)
+    assert settings.find_settings_file('other.ini') == str(tmp_path / 'other.ini')
+
+
+def test_cache_invalidated_on_size_change(settings_file):
+    cache = SettingsCache()
+    assert cache.category(settings_file, 'fastscan')['n_samples'] == 18000
+    stat = os.stat(settings_file)
+    set_entry(settings_file, 'fastscan', 'n_samples', 180000)
+    os.utime(settings_file, ns=(stat.st_atime_ns, stat.st_mtime_ns))  # same mtime, only the size changes
+    assert cache.category(settings_file, 'fastscan')['n_samples'] == 180000
+
+
+def test_cache_invalidated_on_mtime_change(settings_file):
+    cache = SettingsCache()
+    assert cache.category(settings_file, 'fastscan')['n_samples'] == 18000
+    stat = os.stat(settings_file)
+    set_entry(settings_file, 'fastscan', 'n_samples', 20000)  # same size
+    assert os.stat(settings_file).st_size == stat.st_size
+    os.utime(settings_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert cache.category(settings_file, 'fastscan')['n_samples'] == 20000
+
+
+def test_cache_not_reread_while_unchanged(settings_file, monkeypatch):
+    cache = SettingsCache()
+    cache.category(settings_file, 'fastscan')
+    reads = []
+    read = settings.ConfigParser.read
+    monkeypatch.setattr(settings.ConfigParser, 'read', lambda self, *args: reads.append(args) or read(self, *args))
+    for _ in range(10):
+        cache.category(settings_file, 'fastscan')
+    cache.category(settings_file, 'paths')
+    assert reads == []
+
+
+def test_cache_entries_per_path(settings_file, tmp_path):
+    other = str(tmp_path / 'OTHER.ini')
+    shutil.copyfile(settings_file, other)
+    set_entry(other, 'fastscan', 'n_samples', 500)
+    cache = SettingsCache()
+    assert cache.category(settings_file, 'fastscan')['n_samples'] == 18000
+    assert cache.category(other, 'fastscan')['n_samples'] == 500
+    assert cache.category(settings_file, 'fastscan')['n_samples'] == 18000
+
+
+def test_cache_category_is_a_copy(settings_file):
+    cache = SettingsCache()
+    category = cache.category(settings_file, 'fastscan')
+    category['n_samples'] = 1
+    category['new_entry'] = 2
+    assert cache.category(settings_file, 'fastscan')['n_samples'] == 18000
+    assert 'new_entry' not in cache.category(settings_file, 'fastscan')
+    with pytest.raises(KeyError):
+        cache.category(settings_file, 'no such category')
+
+
+def read_entry(path, category, name):
+    """ Value of the entry as written in the file."""
+    parser = settings.ConfigParser()
+    parser.read(path)
+    return parser[category][name]
+
+
+class CountingCache(SettingsCache):
+    """ SettingsCache counting the file writes."""
+
+    def __init__(self):
+        super(CountingCache, self).__init__()
+        self.writes = []
+
+    def write(self, path, values):
+        self.writes.append(values)
+        super(CountingCache, self).write(path, values)
+
+
+def test_writer_merges_rapid_writes(settings_file):
+    cache = CountingCache()
+    writer = settings.SettingsWriter(cache, delay=.2)
+    for n_samples in range(1000, 1010):
+        writer.write(settings_file, {'fastscan': {'n_samples': n_samples}})
+    writer.write(settings_file, {'fastscan': {'n_averages': 7}})
+    assert cache.writes == []
+    t0 = time.time()
+    while not cache.writes and time.time() - t0 < 10:
+        time.sleep(.02)
+    time.sleep(.1)
+    assert cache.writes == [{'fastscan': {'n_samples': 1009, 'n_averages': 7}}]
+    assert read_entry(settings_file, 'fastscan', 'n_samples') == '1009'
+    assert read_entry(settings_file, 'fastscan', 'n_averages') == '7'
+
+
+def test_pending_values_read_before_flush(settings_file):
+    settings.write_setting(12345, 'fastscan', 'n_samples')
+    settings.write_settings({'fastscan': {'dark_control': False}, 'new category': {'entry': 'value'}})
+    assert read_entry(settings_file, 'fastscan', 'n_samples') == '18000'  # not written yet
+    assert settings.parse_setting('fastscan', 'n_samples') == 12345
+    assert settings.parse_category('fastscan')['dark_control'] is False
+    assert settings.parse_category('fastscan')['n_samples'] == 12345
+    assert settings.parse_category('new category') == {'entry': 'value'}
+
+    settings.flush_settings()
+    assert read_entry(settings_file, 'fastscan', 'n_samples') == '12345'
+    assert read_entry(settings_file, 'new category', 'entry') == 'value'
+    assert settings.parse_setting('fastscan', 'n_samples') == 12345
+
+
+def test_write_is_atomic_and_keeps_mode(settings_file, monkeypatch):
+    os.chmod(settings_file, 0o640)
+    settings.write_setting(12345, 'fastscan', 'n_samples')
+    settings.flush_settings()
+    assert stat.S_IMODE(os.stat(settings_file).st_mode) == 0o640
+    assert read_entry(settings_file, 'fastscan', 'n_samples') == '12345'
+
+    with open(settings_file) as f:
+        content = f.read()
+
+    def failing_replace(src, dst):
+        raise OSError('disk full')
+
+    monkeypatch.setattr(os, 'replace', failing_replace)
+    settings.write_setting(1, 'fastscan', 'n_samples')
+    with pytest.raises(OSError):
+        settings.flush_settings()
+    with open(settings_file) as f:
+        assert f.read() == content
+    assert os.listdir(os.path.dirname(settings_file)) == ['SETTINGS.ini']  # temporary file removed
+
+
+def test_pending_settings_written_at_exit(settings_file):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    script = ('from utilities import settings\n'
+              'settings._default_settings_file = {!r}\n'
+              'settings.write_setting(12345, "fastscan", "n_samples")\n'.format(settings_file))
+    subprocess.run([sys.executable, '-c', script], cwd=root, check=True, timeout=60)
+    assert read_entry(settings_file, 'fastscan', 'n_samples') == '12345'
+
+
+def test_subscribers(settings_file, caplog):
+    updates = []
+
+    def failing(category, name, value):
+        raise RuntimeError('subscriber failed')
+
+    def callback(category, name, value):
+        updates.append((category, name, value))
+
+    settings.subscribe_settings(failing)
+    settings.subscribe_settings(callback)
+    try:
+        settings.write_settings({'fastscan': {'n_samples': 12345, 'n_averages': 7}})
+    finally:
+        settings.unsubscribe_settings(failing)
+    assert updates == [('fastscan', 'n_samples', 12345), ('fastscan', 'n_averages', 7)]
+    assert 'subscriber failed' in caplog.text
+
+    settings.unsubscribe_settings(callback)
+    settings.unsubscribe_settings(callback)  # unknown callbacks are ignored
+    settings.write_setting(1, 'fastscan', 'n_averages')
+    assert len(updates) == 2
+
+    settings.flush_settings()  # the failing subscriber did not lose the update
+    assert read_entry(settings_file, 'fastscan', 'n_samples') == '12345'
+    assert read_entry(settings_file, 'fastscan', 'n_averages') == '1'
@@ -3,9 +3,12 @@
 
 @author: Steinn Ymir Agustsson
 """
-import h5py
 import numpy as np
 
+from utilities.misc import LazyModule
+
+h5py = LazyModule('h5py')  # imported on first use
+
 
 def dict_to_hdf(f, group, data_dict, columns, index):
     """ writes a dictionary to an h5 group
@@ -56,6 +59,16 @@ def dict_to_hdf(f, group, data_dict, columns, index):
 
 
 
+def settings_to_hdf(f, group, settings):
+    """ Write a dictionary of settings as one dataset per entry of the group.
+
+    None, which h5py cannot store, is written as the string 'None', as in
+    SETTINGS.ini.
+    """
+    for k, v in settings.items():
+        f.create_dataset('{}/{}'.format(group, k), data='None' if v is None else v)
+
+
 def main():
     pass
 
@@ -20,7 +20,6 @@
 
 """
 import numpy as np
-from scipy.special import erf
 
 
 def monotonically_increasing(l):
@@ -51,10 +50,179 @@ def gaussian_fwhm(x, A, x0, fwhm, c):
     return A * np.exp(-np.power(x - x0, 2.) / (2 * np.power(sig, 2.))) + c
 
 
+def sech2_fwhm_jac(x, A, x0, fwhm, c):
+    """ Jacobian of sech2_fwhm, for curve_fit(jac=...).
+
+    Parameters broadcast with x as in sech2_fwhm, and the derivatives by
+    A, x0, fwhm and c are stacked along a new last axis."""
+    x = np.asarray(x, dtype=float)
+    tau = fwhm * 2 / 1.76
+    u = (x - x0) / tau
+    e = np.exp(-2 * np.abs(u))
+    s = 4 * e / (1 + e) ** 2  # sech(u)**2, without overflow of cosh
+    t = np.tanh(u)
+    return np.stack((s, 2 * A * s * t / tau, 2 * A * s * t * u / fwhm, np.ones_like(s)), axis=-1)
+
+
+def gaussian_fwhm_jac(x, A, x0, fwhm, c):
+    """ Jacobian of gaussian_fwhm, for curve_fit(jac=...). Shaped as sech2_fwhm_jac."""
+    x = np.asarray(x, dtype=float)
+    sig = fwhm * 2 / 2.355
+    dx = x - x0
+    g = np.exp(-dx ** 2 / (2 * sig ** 2))
+    return np.stack((g, A * g * dx / sig ** 2, A * g * dx ** 2 / (sig ** 2 * fwhm), np.ones_like(g)), axis=-1)
+
+
+def fit_lm_batch(function, jac, x, y, p0, n_iter=100, lambda0=1e-3, tolerance=1e-10):
+    """ Levenberg-Marquardt fit of many curves sharing the same x at once.
+
+    All curves are iterated together, with numpy broadcasting: function and
+    jac are called with x of shape (n,) and each parameter of shape (m, 1),
+    as sech2_fwhm and sech2_fwhm_jac allow. Each curve has its own damping,
+    and stops iterating once its cost no longer decreases by more than
+    tolerance, relative. Non finite values in y are ignored.
+
+    Args:
+        function: model f(x, *pars)
+        jac: jacobian of function, with derivatives along the last axis
+        x (ndarray): shape (n,), sample positions
+        y (ndarray): shape (m, n), curves to fit
+        p0 (ndarray): shape (m, p), initial parameters of each curve
+        n_iter (int): maximum number of iterations
+        lambda0 (float): initial damping
+        tolerance (float): relative cost decrease below which a fit converged
+
+    Returns:
+        popt: (m, p) fitted parameters
+        pcov: (m, p, p) covariance of the parameters, nan if undetermined
+        converged: (m,) bool, False for fits which hit n_iter. Curves with
+            less defined points than parameters are not fitted, and their
+            popt is nan.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.atleast_2d(np.asarray(y, dtype=np.float64))
+    p = np.array(p0, dtype=np.float64, ndmin=2)
+    m, n_pars = p.shape
+    weight = np.isfinite(y).astype(np.float64)
+    y = np.where(weight > 0, y, 0.)
+    dof = weight.sum(axis=1) - n_pars
+    p[dof <= 0] = np.nan
+
+    r = (y - function(x, *p.T[..., None])) * weight
+    cost = np.sum(r ** 2, axis=1)
+    lam = np.full(m, lambda0)
+    active = dof > 0
+    converged = np.zeros(m, dtype=bool)
+    eye = np.eye(n_pars)
+    for _ in range(n_iter):
+        if not active.any():
+            break
+        J = jac(x, *p[active].T[..., None]) * weight[active, :, None]
+        JtJ = np.einsum('mnp,mnq->mpq', J, J)
+        Jtr = np.einsum('mnp,mn->mp', J, r[active])
+        diag = JtJ * eye
+        A = JtJ + lam[active, None, None] * diag + 1e-12 * eye  # Marquardt scaling
+        step = np.linalg.solve(A, Jtr[..., None])[..., 0]
+
+        p_new = p[active] + step
+        r_new = (y[active] - function(x, *p_new.T[..., None])) * weight[active]
+        cost_new = np.sum(r_new ** 2, axis=1)
+        better = cost_new < cost[active]
+
+        idx = np.flatnonzero(active)
+        improved = idx[better]
+        done = improved[cost[improved] - cost_new[better] <= tolerance * cost[improved]]
+        p[improved] = p_new[better]
+        r[improved] = r_new[better]
+        cost[improved] = cost_new[better]
+        lam[idx] = np.where(better, lam[idx] / 10, lam[idx] * 10)
+        stuck = idx[lam[idx] > 1e12]  # no step decreases the cost: at the minimum
+        converged[done] = True
+        converged[stuck] = True
+        active[done] = False
+        active[stuck] = False
+
+    pcov = np.full((m, n_pars, n_pars), np.nan)
+    fitted = np.flatnonzero(dof > 0)
+    J = jac(x, *p[fitted].T[..., None]) * weight[fitted, :, None]
+    JtJ = np.einsum('mnp,mnq->mpq', J, J)
+    for i, jtj in zip(fitted, JtJ):
+        try:
+            pcov[i] = np.linalg.inv(jtj) * cost[i] / dof[i]
+        except np.linalg.LinAlgError:
+            pass
+    return p, pcov, converged
+
+
 def sin(x, A, f, p, o):
     return A * np.sin(x / f + p) + o
 
 
+def sin_residual(y, x, popt):
+    """ rms residual of a sin fit, relative to the fitted amplitude."""
+    return np.sqrt(np.mean((y - sin(x, *popt)) ** 2)) / np.abs(popt[0])
+
+
+def _lstsq(basis, y):
+    """ least squares solution via the normal equations. basis has shape (m, n)"""
+    return np.linalg.solve(basis @ basis.T, basis @ y)
+
+
+def fit_sin_fast(y, x=None, guess=None, n_iter=2):
+    """ Fit y to a sine, without iterative solvers from scratch.
+
+    The angular frequency is taken from the guess if given, otherwise it is
+    estimated in closed form from the linear relation between y and its
+    double integral (y'' = -w**2 (y - o)), which works also when the data
+    covers less than one period. Amplitude, phase and offset are then obtained
+    by linear least squares on sin/cos bases, and the result is refined by
+    n_iter Gauss-Newton steps on all parameters.
+
+    Args:
+        y (ndarray): data to fit
+        x (ndarray): sample positions. Defaults to np.arange(len(y))
+        guess (list): parameters [A, f, p, o] as used by sin. Only f is used,
+            as warm start for the frequency.
+        n_iter (int): number of Gauss-Newton refinement steps.
+
+    Returns:
+        popt: [A, f, p, o] parameters as used by sin
+        residual: rms residual relative to the amplitude
+    """
+    y = np.asarray(y, dtype=np.float64)
+    if x is None:
+        x = np.arange(len(y), dtype=np.float64)
+    x0, span = x[0], x[-1] - x[0]
+    t = (x - x0) / span  # normalize to [0,1] for numerical stability
+
+    if guess is not None and guess[1] != 0:
+        w = abs(span / guess[1])
+    else:
+        dt = np.diff(t)
+        s1 = np.concatenate(([0], np.cumsum(dt * (y[1:] + y[:-1]) / 2)))
+        s2 = np.concatenate(([0], np.cumsum(dt * (s1[1:] + s1[:-1]) / 2)))
+        basis = np.stack((s2, t ** 2, t, np.ones_like(t)))
+        coef = _lstsq(basis, y)
+        w = np.sqrt(-coef[0]) if coef[0] < 0 else 2 * np.pi
+
+    basis = np.stack((np.sin(w * t), np.cos(w * t), np.ones_like(t)))
+    a, b, o = _lstsq(basis, y)
+    pars = np.array([np.hypot(a, b), w, np.arctan2(b, a), o])
+
+    for _ in range(n_iter):
+        A, w, p, o = pars
+        arg = w * t + p
+        s, c = np.sin(arg), np.cos(arg)
+        jac = np.stack((s, A * t * c, A * c, np.ones_like(t)))
+        step = _lstsq(jac, y - (A * s + o))
+        pars = pars + step
+
+    A, w, p, o = pars
+    # back to the parametrization of sin, with x not normalized
+    popt = np.array([A, span / w, p - w * x0 / span, o])
+    return popt, sin_residual(y, x, popt)
+
+
 def globalcounter(idx, M):
     counterlist = idx[::-1]
     maxlist = M[::-1]
@@ -70,6 +238,7 @@ def transient_1expdec(t, A1, tau1, sigma, y0, off, t0):
     sigma: pump pulse duration
     y0: whole curve offset
     off: slow dynamics offset"""
+    from scipy.special import erf
     t = t - t0
     tmp = erf((sigma ** 2. - 5.545 * tau1 * t) / (2.7726 * sigma * tau1))
     tmp = .5 * (1 - tmp) * np.exp(sigma ** 2. / (11.09 * tau1 ** 2.))
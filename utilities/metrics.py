@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+
+@author: Steinn Ymir Agustsson
+
+    Copyright (C) 2018 Steinn Ymir Agustsson
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+
+
+class StageTimer(object):
+    """ Durations of a processing stage.
+
+    Keeps the total count and time, and the last `window` durations, from
+    which the latency percentiles are computed.
+    """
+
+    def __init__(self, window=1000):
+        self.durations = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.
+        self.max = 0.
+
+    def record(self, duration):
+        self.durations.append(duration)
+        self.count += 1
+        self.total += duration
+        self.max = max(self.max, duration)
+
+    def summary(self, elapsed):
+        """ Dictionary of count, rate and latency statistics, in ms."""
+        summary = {'count': self.count,
+                   'rate_hz': self.count / elapsed if elapsed > 0 else 0.,
+                   'mean_ms': 1000 * self.total / self.count if self.count else np.nan,
+                   'max_ms': 1000 * self.max,
+                   }
+        if self.durations:
+            p50, p95, p99 = np.percentile(np.fromiter(self.durations, float), (50, 95, 99)) * 1000
+        else:
+            p50 = p95 = p99 = np.nan
+        summary.update({'p50_ms': float(p50), 'p95_ms': float(p95), 'p99_ms': float(p99)})
+        return summary
+
+
+class MetricsRegistry(object):
+    """ Thread safe registry of stage timers and counters.
+
+    Stages are timed with the timer context manager, or by recording a
+    duration measured elsewhere. snapshot returns a plain dictionary, which
+    can be emitted by a Qt signal or dumped by a headless run.
+
+    Example:
+        metrics = MetricsRegistry()
+        with metrics.timer('binning'):
+            project(...)
+        metrics.count('frames_projected')
+        metrics.snapshot()['stages']['binning']['p95_ms']
+    """
+
+    def __init__(self, window=1000):
+        self.window = window
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.stages = {}
+            self.counters = {}
+            self.t_start = time.time()
+
+    def record(self, stage, duration):
+        """ Add a duration, in seconds, to a stage."""
+        with self._lock:
+            timer = self.stages.get(stage)
+            if timer is None:
+                timer = self.stages[stage] = StageTimer(self.window)
+            timer.record(duration)
+
+    @contextmanager
+    def timer(self, stage):
+        """ Context manager recording the time spent in its block."""
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - t0)
+
+    def count(self, counter, n=1):
+        """ Increase a counter by n."""
+        with self._lock:
+            self.counters[counter] = self.counters.get(counter, 0) + n
+
+    def snapshot(self):
+        """ Current state of all stages and counters.
+
+        Returns:
+            dict with 'elapsed_s', 'stages': {stage: summary} as given by
+            StageTimer.summary, and 'counters': {counter: value}.
+        """
+        with self._lock:
+            elapsed = time.time() - self.t_start
+            return {'elapsed_s': elapsed,
+                    'stages': {name: timer.summary(elapsed) for name, timer in self.stages.items()},
+                    'counters': dict(self.counters),
+                    }
+
+    def dump(self, filename):
+        """ Append a snapshot, with its time stamp, as a line of JSON to filename."""
+        snapshot = self.snapshot()
+        snapshot['timestamp'] = time.time()
+        with open(filename, 'a') as f:
+            f.write(json.dumps(snapshot) + '\n')
+        return snapshot
+
+    @staticmethod
+    def format(snapshot):
+        """ Text table of a snapshot."""
+        lines = ['{:14s} {:>7s} {:>8s} {:>8s} {:>8s} {:>8s}'.format('stage', 'Hz', 'p50 ms', 'p95 ms', 'p99 ms',
+                                                                     'max ms')]
+        for name, s in snapshot['stages'].items():
+            lines.append('{:14s} {:7.1f} {:8.2f} {:8.2f} {:8.2f} {:8.2f}'.format(
+                name, s['rate_hz'], s['p50_ms'], s['p95_ms'], s['p99_ms'], s['max_ms']))
+        for name, value in snapshot['counters'].items():
+            lines.append('{:14s} {}'.format(name, value))
+        return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    pass
@@ -19,8 +19,11 @@
     along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 """
+import importlib
 import sys
-import numpy
+import types
+
+import numpy as np
 
 
 def main():
@@ -116,5 +119,29 @@ def make_time_bins(min_t, max_t, step):
     axis = bins[:-1] + step / 2
     return axis, bins
 
+
+class LazyModule(types.ModuleType):
+    """ Module imported on first attribute access.
+
+    Stands in for heavy optional dependencies, so that importing a module
+    which uses them stays fast:
+        xr = LazyModule('xarray')
+        xr.DataArray(...)  # xarray is imported here
+    """
+
+    def __init__(self, name):
+        super().__init__(name)
+
+    def __getattr__(self, attr):
+        module = importlib.import_module(self.__name__)
+        self.__dict__.update(module.__dict__)  # next lookups skip __getattr__
+        return getattr(module, attr)
+
+    def __repr__(self):
+        if self.__name__ in sys.modules and '__file__' in self.__dict__:
+            return repr(sys.modules[self.__name__])
+        return '<lazy module {!r}>'.format(self.__name__)
+
+
 if __name__ == '__main__':
     main()
@@ -4,9 +4,17 @@
 @author: Steinn Ymir Agustsson
 """
 import ast
+import atexit
+import logging
 import os
+import shutil
+import tempfile
+import threading
 from configparser import ConfigParser
 
+logger = logging.getLogger(__name__)
+
+
 def make_settings():
     settings_dict = {'paths':{'h5_data':'D:\data',
                               },
@@ -35,6 +43,189 @@ def set_default_settings():
         default_settings.write(configfile)
 
 
+def _literal(value):
+    """ Evaluate a setting string as a python literal, or keep it as string."""
+    try:
+        return ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        return value
+
+
+_default_settings_file = None
+
+
+def find_settings_file(settings_file='default'):
+    """ Resolve the path of the settings file.
+
+    'default' is the first SETTINGS.ini found walking up from this folder.
+    """
+    global _default_settings_file
+    if settings_file != 'default':
+        return os.path.abspath(settings_file)
+    if _default_settings_file is not None and os.path.isfile(_default_settings_file):
+        return _default_settings_file
+    current_path = os.path.dirname(os.path.abspath(__file__))
+    while not os.path.isfile(os.path.join(current_path, 'SETTINGS.ini')):
+        parent = os.path.split(current_path)[0]
+        if parent == current_path:
+            raise FileNotFoundError('No SETTINGS.ini found above {}'.format(os.path.dirname(__file__)))
+        current_path = parent
+    _default_settings_file = os.path.join(current_path, 'SETTINGS.ini')
+    return _default_settings_file
+
+
+class SettingsCache(object):
+    """ Process wide cache of parsed settings files.
+
+    Files are keyed by their resolved path and only read again when their
+    modification time or size changes, so settings can be looked up in
+    loops without reparsing the file each time.
+    """
+
+    def __init__(self):
+        self._files = {}  # path: (stamp, ConfigParser, {category: {name: value}})
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def _stamp(path):
+        stat = os.stat(path)
+        return stat.st_mtime_ns, stat.st_size
+
+    def category(self, path, category):
+        """ Parsed entries of a category of the file, as {name: value}.
+
+        Returns a copy, which the caller is free to change.
+
+        Raises:
+            KeyError: if the category is not in the file.
+        """
+        stamp = self._stamp(path)
+        with self._lock:
+            cached = self._files.get(path)
+            if cached is None or cached[0] != stamp:
+                settings = ConfigParser()
+                settings.read(path)
+                cached = (stamp, settings, {})
+                self._files[path] = cached
+            _, settings, categories = cached
+            if category not in categories:
+                categories[category] = {k: _literal(v) for k, v in settings[category].items()}
+            return dict(categories[category])
+
+    def write(self, path, values):
+        """ Update entries of the file in a single atomic write.
+
+        Args:
+            values (dict): {category: {name: value}} of the entries to write.
+        """
+        with self._lock:
+            settings = ConfigParser()
+            settings.read(path)
+            for category, entries in values.items():
+                if not settings.has_section(category):
+                    settings.add_section(category)
+                for name, value in entries.items():
+                    settings[category][name] = str(value)
+            # write next to the file and swap, so readers never see it half written
+            fd, tmp_path = tempfile.mkstemp(prefix='.SETTINGS.', suffix='.tmp', dir=os.path.dirname(path))
+            try:
+                with os.fdopen(fd, 'w') as configfile:
+                    settings.write(configfile)
+                shutil.copymode(path, tmp_path)
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.remove(tmp_path)
+                raise
+            self._files.pop(path, None)
+
+    def clear(self):
+        with self._lock:
+            self._files.clear()
+
+
+class SettingsWriter(object):
+    """ Debounced writer of settings files.
+
+    Updates are kept in memory and written together, in a single atomic
+    write, once delay seconds have passed since the first pending update.
+    Pending values are returned by parse_setting and parse_category right
+    away, and subscribers are notified of each update when it is made, so
+    nobody needs to re-read the file to see a change.
+    """
+
+    def __init__(self, cache, delay=.5):
+        self.cache = cache
+        self.delay = delay
+        self._pending = {}  # path: {category: {name: value}}
+        self._subscribers = []
+        self._timer = None
+        self._lock = threading.RLock()
+
+    def write(self, path, values):
+        """ Queue the entries for writing and notify the subscribers.
+
+        Args:
+            values (dict): {category: {name: value}} of the entries to write.
+        """
+        with self._lock:
+            pending = self._pending.setdefault(path, {})
+            for category, entries in values.items():
+                for name, value in entries.items():
+                    # store what will be read back from the file
+                    pending.setdefault(category, {})[name] = _literal(str(value))
+            if self._timer is None:
+                self._timer = threading.Timer(self.delay, self._flush_pending)
+                self._timer.daemon = True
+                self._timer.start()
+        for category, entries in values.items():
+            for name, value in entries.items():
+                for callback in list(self._subscribers):
+                    try:
+                        callback(category, name, value)
+                    except Exception:
+                        logger.exception('settings subscriber {} failed on {}/{}'.format(callback, category, name))
+
+    def pending(self, path, category):
+        """ Entries of a category waiting to be written, as {name: value}."""
+        with self._lock:
+            return dict(self._pending.get(path, {}).get(category, {}))
+
+    def flush(self):
+        """ Write all pending entries now."""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            pending, self._pending = self._pending, {}
+            for path, values in pending.items():
+                self.cache.write(path, values)
+
+    def _flush_pending(self):
+        try:
+            self.flush()
+        except Exception:
+            logger.exception('Failed writing settings')
+
+    def subscribe(self, callback):
+        """ Call callback(category, name, value) on every settings update.
+
+        The callback runs in the thread making the update. Exceptions it
+        raises are logged, and do not reach the code making the update.
+        """
+        self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        try:
+            self._subscribers.remove(callback)
+        except ValueError:
+            pass
+
+
+settings_cache = SettingsCache()
+settings_writer = SettingsWriter(settings_cache)
+atexit.register(settings_writer.flush)
+
+
 def parse_category(category, settings_file='default'):
     """ parse setting file and return desired value
 
@@ -47,23 +238,15 @@ def parse_category(category, settings_file='default'):
         dictionary containing name and value of all entries present in this
         category.
     """
-    settings = ConfigParser()
-    if settings_file == 'default':
-        current_path = os.path.dirname(__file__)
-        while not os.path.isfile(os.path.join(current_path, 'SETTINGS.ini')):
-            current_path = os.path.split(current_path)[0]
-
-        settings_file = os.path.join(current_path, 'SETTINGS.ini')
-    settings.read(settings_file)
+    path = find_settings_file(settings_file)
     try:
+        cat_dict = settings_cache.category(path, category)
+    except KeyError:
         cat_dict = {}
-        for k,v in settings[category].items():
-            try:
-                cat_dict[k] = ast.literal_eval(v)
-            except ValueError:
-                cat_dict[k] = v
+    cat_dict.update(settings_writer.pending(path, category))
+    if cat_dict:
         return cat_dict
-    except KeyError:
+    else:
         print('No category "{}" found in SETTINGS.ini'.format(category))
 
 
@@ -79,51 +262,59 @@ def parse_setting(category, name, settings_file='default'):
     Returns:
         value of the parameter, None if parameter cannot be found.
     """
-    settings = ConfigParser()
-    if settings_file == 'default':
-        current_path = os.path.dirname(__file__)
-        while not os.path.isfile(os.path.join(current_path, 'SETTINGS.ini')):
-            current_path = os.path.split(current_path)[0]
-
-        settings_file = os.path.join(current_path, 'SETTINGS.ini')
-    settings.read(settings_file)
-
+    path = find_settings_file(settings_file)
     try:
-        value = settings[category][name]
-        return ast.literal_eval(value)
+        return settings_writer.pending(path, category)[name]
+    except KeyError:
+        pass
+    try:
+        return settings_cache.category(path, category)[name]
     except KeyError:
         print('No entry "{}" in category "{}" found in SETTINGS.ini'.format(name, category))
         return None
-    except ValueError:
-        return settings[category][name]
-    except SyntaxError:
-        return settings[category][name]
+
 
 def write_setting(value, category, name, settings_file='default'):
     """ Write enrty in the settings file
 
+    The file is written shortly after, together with other updates made in
+    the meantime, see SettingsWriter. The new value is returned by
+    parse_setting right away.
+
     Args:
         category (str): title of the category
         name (str): name of the parameter
         setting_file (str): path to setting file. If set to 'default' it takes
             a file called SETTINGS.ini in the main folder of the repo.
+    """
+    write_settings({category: {name: value}}, settings_file)
 
-    Returns:
-        value of the parameter, None if parameter cannot be found.
+
+def write_settings(values, settings_file='default'):
+    """ Write several entries in the settings file at once.
+
+    As write_setting, the file is written shortly after.
+
+    Args:
+        values (dict): {category: {name: value}} of the entries to write.
+        setting_file (str): path to setting file. If set to 'default' it takes
+            a file called SETTINGS.ini in the main folder of the repo.
     """
-    settings = ConfigParser()
-    if settings_file == 'default':
-        current_path = os.path.dirname(__file__)
-        while not os.path.isfile(os.path.join(current_path, 'SETTINGS.ini')):
-            current_path = os.path.split(current_path)[0]
+    settings_writer.write(find_settings_file(settings_file), values)
 
-        settings_file = os.path.join(current_path, 'SETTINGS.ini')
-    settings.read(settings_file)
 
-    settings[category][name] = str(value)
+def flush_settings():
+    """ Write pending settings updates to file now."""
+    settings_writer.flush()
 
-    with open(settings_file, 'w') as configfile:
-        settings.write(configfile)
+
+def subscribe_settings(callback):
+    """ Call callback(category, name, value) whenever a setting is written."""
+    settings_writer.subscribe(callback)
+
+
+def unsubscribe_settings(callback):
+    settings_writer.unsubscribe(callback)
 
 
 if __name__ == '__main__':
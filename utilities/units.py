@@ -12,28 +12,40 @@ This avoids errors between quantities of different unit registries that occur wh
 Custom units and prefixes that we use frequently should be defined here to get consistency.
 """
 
-# Import pint and initialize a standard unit registry:
-import pint
-import pint.quantity
-import numpy
+# The registry takes long to build, so it is created on first access of
+# ureg or Quantity, as in: from utilities.units import ureg
+import functools
 
-ureg = pint.UnitRegistry()
-Quantity = ureg.Quantity
 
-# Custom units that we use frequently can be defined here:
-# ureg.define('dog_year = 52 * day = dy')
-ureg.define('pixel = []')
-ureg.define('count = []')
+@functools.lru_cache(maxsize=None)
+def get_registry():
+    """ The unit registry, with our custom units and contexts."""
+    import pint
 
-# Custom prefixes we use frequently can be defined here:
-# ureg.define('myprefix- = 30 = my-')
+    ureg = pint.UnitRegistry()
 
-# Custom contexts we use frequently can be defined here:
-c = pint.Context('light')
-c.add_transformation('[length]', '[time]', lambda ureg, x: x / ureg.speed_of_light)
-c.add_transformation('[time]', '[length]', lambda ureg, x: x * ureg.speed_of_light)
-ureg.add_context(c)
+    # Custom units that we use frequently can be defined here:
+    # ureg.define('dog_year = 52 * day = dy')
+    ureg.define('pixel = []')
+    ureg.define('count = []')
 
+    # Custom prefixes we use frequently can be defined here:
+    # ureg.define('myprefix- = 30 = my-')
+
+    # Custom contexts we use frequently can be defined here:
+    c = pint.Context('light')
+    c.add_transformation('[length]', '[time]', lambda ureg, x: x / ureg.speed_of_light)
+    c.add_transformation('[time]', '[length]', lambda ureg, x: x * ureg.speed_of_light)
+    ureg.add_context(c)
+    return ureg
+
+
+def __getattr__(name):
+    if name == 'ureg':
+        return get_registry()
+    if name == 'Quantity':
+        return get_registry().Quantity
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
 
 
 def main():